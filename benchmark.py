@@ -0,0 +1,1108 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the logsim package.
+
+Run from the repository root, e.g.:
+    python benchmark.py datapool --rows 1000000
+    python benchmark.py engine --users 20 --days 62
+    python benchmark.py memory --users 1000 --days 7
+    python benchmark.py fleet --users 400 --days 100
+    python benchmark.py runner --users 200 --days 62
+    python benchmark.py partitions --users 200 --days 62 --analytics 100000
+    python benchmark.py analytics --users 10000 30000 100000
+    python benchmark.py refresh --users 10000 --days 60
+    python benchmark.py query --users 100000 --days 30
+    python benchmark.py rollup --users 10000 --days 60
+    python benchmark.py storage --users 1000 --days 100
+    python benchmark.py schema --users 1000 --days 100
+    python benchmark.py ingest --users 5000 --days 100
+    python benchmark.py spill --users 20 --days 62 124 248
+    python benchmark.py profile --users 20 --days 62
+    python benchmark.py population --users 500 --days 240
+    python benchmark.py fork --users 20 --warmup 180 --days 60
+    python benchmark.py startup --budget 0.1
+    python benchmark.py report --users 200 --days 62
+
+Track performance over changes with the benchmark suite:
+    python benchmark.py suite --out baseline.json
+    python benchmark.py suite --out new.json
+    python benchmark.py compare baseline.json new.json --threshold 10
+"""
+
+# %% Import essentials
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import simpy
+from logsim.datapool import CDP, DataPool, plot_columns, rollup_sums
+from logsim.datapool import with_dates, without_dates
+from logsim.fleet import simulate_fleet
+from logsim.hi import HI
+from logsim.ingest import ingest, partition_features
+from logsim.partition import PartitionedPool
+from logsim.population import Lifecycle, Population, override
+from logsim.profile import Profiler
+from logsim.report import PageFigure, render_report, report_pages
+from logsim.runner import load_users, run_fleet, run_partitioned
+from logsim.runner import simulate as run_users
+from logsim.simulation import Simulation
+
+REFERENCE = 'configs/reference.json'
+POPULATION = 'configs/population.json'
+POOLS = ['app_daily', 'app_hourly', 'fsw_daily', 'fsw_monthly']
+# Import time budget (secs) of the simulate only path, on top of importing
+# pandas, which varies a lot between pandas versions and machines
+STARTUP_BUDGET = 0.1
+# Bytes pr HI after creation with RAM/NVRAM as dicts (1000 reference HIs,
+# no random generator pr HI), and the targeted reduction
+MEMORY_BASELINE = 36.1e3
+MEMORY_TARGET = 5
+# Modules the simulate only path must not import
+PLOTTING = ['matplotlib', 'seaborn']
+
+
+# %% Helpers
+def sample_row(i, n_users=20, n_counters=12):
+    """Create a row looking like an hourly App sample"""
+    row = {'id': i % n_users, 'power_cycle': i // n_users,
+           'charge': 3 * i, 'usage': 5 * i}
+    for c in range(n_counters):
+        row['cnt{}'.format(c)] = i + c
+    return row
+
+
+def timed(func, *args, **kwargs):
+    """Return (result, wall time in secs) of calling func"""
+    t0 = time.perf_counter()
+    res = func(*args, **kwargs)
+    return res, time.perf_counter() - t0
+
+
+# %% DataPool ingestion
+def bench_datapool_put(rows=10**6, step=None):
+    """
+    Time DataPool.put for a growing number of rows
+
+    Parameters
+    ----------
+    rows : int
+        Total number of rows to put
+    step : int, optional
+        Report the per-row cost for every 'step' rows. Default rows/10.
+
+    Returns
+    -------
+    list of dicts with the measurements
+    """
+    step = step if step else max(rows // 10, 1)
+    dp = DataPool('bench')
+    res = []
+    t_start = time.perf_counter()
+    t_last = t_start
+    for i in range(rows):
+        dp.put(sample_row(i))
+        if (i + 1) % step == 0:
+            now = time.perf_counter()
+            res.append({'rows': i + 1,
+                        'us-pr-row': 1e6 * (now - t_last) / step})
+            t_last = now
+    t_put = time.perf_counter() - t_start
+    df, t_df = timed(lambda: dp.df)
+    assert len(df) == rows
+    print('DataPool.put: {} rows in {:.2f}s ({:.2f} us/row), '
+          'materialize df in {:.2f}s'.format(
+              rows, t_put, 1e6 * t_put / rows, t_df))
+    for r in res:
+        print('  {:>10} rows: {:6.2f} us/row'.format(
+            r['rows'], r['us-pr-row']))
+    return res
+
+
+def bench_datapool_put_many(rows=10**6, batch=31):
+    """Time DataPool.put_many with NVRAM sized batches"""
+    dp = DataPool('bench')
+    batch_rows = [sample_row(i) for i in range(batch)]
+    _, t_put = timed(lambda: [dp.put_many(batch_rows)
+                              for i in range(rows // batch)])
+    df, t_df = timed(lambda: dp.df)
+    print('DataPool.put_many: {} rows in {:.2f}s ({:.2f} us/row), '
+          'materialize df in {:.2f}s'.format(
+              len(df), t_put, 1e6 * t_put / len(df), t_df))
+
+
+# %% DataPool analytics
+def daily_pool(n_users, days=30, seed=1):
+    """DataPool shaped like the daily App pool with 'n_users' users"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'id': np.repeat(np.arange(n_users), days),
+                       'power_cycle': np.tile(np.arange(days), n_users)})
+    for k in ['charge', 'usage', 'ovd', 'speech', 'ovd-snr-low',
+              'vcUp', 'vcDwn']:
+        inc = rng.integers(0, 3600, size=(n_users, days))
+        df[k] = np.cumsum(inc, axis=1).ravel()
+    # Samples arrive in time order, i.e. interleaved between users
+    df = df.sort_values(by=['power_cycle', 'id'], kind='stable')
+    dp = DataPool('bench')
+    dp.df = df.reset_index(drop=True)
+    return dp
+
+
+def bench_diff_data(users=(10000, 30000, 100000), days=30):
+    """Time DataPool.diff_data for a growing number of users"""
+    res = []
+    for n in users:
+        dp = daily_pool(n, days)
+        _, t = timed(dp.diff_data)
+        res.append({'users': n, 'rows': n * days, 'secs': t})
+        print('DataPool.diff_data: {:>7} users, {:>8} rows in {:6.2f}s '
+              '({:.2f} us/row)'.format(n, n * days, t, 1e6 * t / n / days))
+    return res
+
+
+def bench_create_features(users=(10000, 30000, 100000), days=30):
+    """Time DataPool.create_features for a growing number of users"""
+    res = []
+    for n in users:
+        dp = daily_pool(n, days)
+        _, t = timed(dp.create_features)
+        res.append({'users': n, 'rows': n * days, 'secs': t})
+        print('DataPool.create_features: {:>7} users, {} features '
+              'in {:6.2f}s'.format(n, dp.dfeat.shape[1], t))
+    return res
+
+
+def bench_refresh(n_users=10000, days=60):
+    """Refresh the plot data after each simulated day, full vs incremental"""
+    df = daily_pool(n_users, days).df
+    for k in ['ovd-snr-med', 'ovd-snr-high']:
+        df[k] = df['ovd-snr-low']
+    res = {}
+    for mode in ['full', 'incremental']:
+        dp = DataPool('bench')
+        t_day = []
+        for _, day in df.groupby('power_cycle'):
+            dp.put_many(day)
+            if mode == 'full':
+                # Recompute from scratch, as before incremental updates
+                dp.df = dp.df
+            _, t = timed(dp.prepare_plot_data)
+            t_day.append(t)
+        res[mode] = dp.ddiff.sort_values(by=['id', 'power_cycle'])
+        print('{:12}: {} users, {} days, total {:6.2f}s, last day '
+              '{:6.3f}s'.format(mode, n_users, days, sum(t_day), t_day[-1]))
+    assert res['full'].reset_index(drop=True).equals(
+        res['incremental'].reset_index(drop=True))
+    print('Incremental refresh matches the full recompute')
+
+
+def bench_query(n_users=100000, days=30, queries=100, seed=1):
+    """Per user and date queries: index vs full column scans"""
+    dp = daily_pool(n_users, days)
+    df = dp.df
+    df['time'] = 1583107200 + 86400 * df['power_cycle'] + df['id']
+    dp.df = df
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(0, n_users, queries).tolist()
+    _, t = timed(dp.index)
+    print('{} users, {} rows: index built in {:.3f}s'.format(
+        n_users, len(df), t))
+
+    def scan_user():
+        return [df[df['id'] == u] for u in ids]
+
+    def index_user():
+        return [dp.get_user(u) for u in ids]
+    ref, t_scan = timed(scan_user)
+    res, t_index = timed(index_user)
+    assert all(a.equals(b) for a, b in zip(ref, res))
+    print('get_user:  {:8.3f} ms scanning, {:8.3f} ms indexed'.format(
+        1e3 * t_scan / queries, 1e3 * t_index / queries))
+    some = ids[:50]
+    ref, t_scan = timed(lambda: df[df['id'].isin(some)].sort_values(
+        by=['id', 'power_cycle']))
+    res, t_index = timed(dp.get_users, some)
+    assert ref.equals(res)
+    print('get_users: {:8.3f} ms scanning, {:8.3f} ms indexed ({} users)'
+          .format(1e3 * t_scan, 1e3 * t_index, len(some)))
+    dates = ('2020-03-10', '2020-03-11')
+    t0, t1 = 1583107200 + 8 * 86400, 1583107200 + 10 * 86400
+    ref, t_scan = timed(lambda: df[(df['time'] >= t0) & (df['time'] < t1)]
+                        .sort_values(by=['id', 'power_cycle']))
+    dp.get_dates(dates)
+    res, t_index = timed(dp.get_dates, dates)
+    assert ref.equals(res)
+    print('get_dates: {:8.3f} ms scanning, {:8.3f} ms indexed ({} rows)'
+          .format(1e3 * t_scan, 1e3 * t_index, len(res)))
+
+
+def bench_rollup(n_users=10000, days=60, grain='month'):
+    """Refresh a calendar rollup after each day, full vs incremental"""
+    df = daily_pool(n_users, days).df
+    for k in ['ovd-snr-med', 'ovd-snr-high']:
+        df[k] = df['ovd-snr-low']
+    df['time'] = 1583107200 + 86400 * df['power_cycle'] + df['id']
+    dp = DataPool('bench')
+    t_full = t_inc = 0
+    for _, day in df.groupby('power_cycle'):
+        dp.put_many(day)
+        dp.normalize_data()
+        # From scratch, as a groupby of the whole daily DB
+        full, t = timed(rollup_sums, dp.ddiff, grain, dp._k_list)
+        t_full += t
+        inc, t = timed(dp.rollup, grain)
+        t_inc += t
+    pd.testing.assert_frame_equal(
+        inc.set_index(['id', 'time'])[dp._k_list], full[dp._k_list],
+        check_dtype=False)
+    print('{} rollup of {} users after each of {} days: {:.2f}s from '
+          'scratch, {:.2f}s incremental (identical), {} rows'.format(
+              grain, n_users, days, t_full, t_inc, len(inc)))
+
+
+# %% Storage
+def bench_storage(n_users=1000, days=100):
+    """Compare write/read time and file size of the storage formats"""
+    users = reference_users(n_users)
+    cdp = simulate_fleet(users, days * 24 * 3600, seed=1)
+    dp = cdp.getAppHourly()
+    print('Hourly App pool: {} rows x {} columns'.format(*dp.df.shape))
+    cwd = os.getcwd()
+    res = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for fmt in ['csv', 'parquet', 'feather']:
+                _, t_write = timed(dp.save, fmt=fmt)
+                size = os.path.getsize(
+                    [f for f in os.listdir(tmp) if f.endswith(fmt)][0])
+                rd = DataPool(dp.name)
+                _, t_read = timed(rd.load, fmt=fmt)
+                _, t_slice = timed(rd.load, fmt=fmt,
+                                   columns=['id', 'usage', 'ovd'],
+                                   ids=range(10),
+                                   dates=('2020-04-01', '2020-04-30'))
+                res.append({'format': fmt, 'write': t_write, 'read': t_read,
+                            'read-slice': t_slice, 'MB': size / 1e6})
+                print('  {:8}: write {:6.2f}s, read {:6.2f}s, read slice '
+                      '{:6.3f}s, {:7.1f} MB'.format(
+                          fmt, t_write, t_read, t_slice, size / 1e6))
+        finally:
+            os.chdir(cwd)
+    return res
+
+
+def bench_schema(n_users=1000, days=100, seed=1):
+    """Memory of the DB's with the declared vs inferred column types"""
+    res = []
+    for diff in [False, True]:
+        cfgs = {}
+        users = {}
+        for i, cfg in reference_users(n_users).items():
+            if id(cfg) not in cfgs:
+                cfgs[id(cfg)] = override(cfg, {'app.diff': diff})
+            users[i] = cfgs[id(cfg)]
+        cdps = {}
+        for typed in [False, True]:
+            cdps[typed], t = timed(simulate_fleet, users, days * 24 * 3600,
+                                   seed=seed, cdp=CDP(typed=typed))
+            report = cdps[typed].memory_report()
+            row = report.loc['app_hourly']
+            res.append({'diff': diff, 'typed': typed, 'secs': t,
+                        'MB': report['bytes'].sum() / 1e6,
+                        'hourly-MB': row['bytes'] / 1e6,
+                        'hourly-bytes-pr-row': row['bytes pr row']})
+            print('diff {!s:5}, {:8}: {:6.2f}s, all DB\'s {:7.1f} MB, '
+                  'hourly {:7.1f} MB ({:5.1f} bytes/row)'.format(
+                      diff, 'typed' if typed else 'inferred', t,
+                      res[-1]['MB'], res[-1]['hourly-MB'],
+                      res[-1]['hourly-bytes-pr-row']))
+        # Same values in either types
+        for pool in POOLS:
+            pd.testing.assert_frame_equal(
+                getattr(cdps[False], pool).df,
+                getattr(cdps[True], pool).df, check_dtype=False)
+        print('  hourly pool {:.1f}x smaller, same values'.format(
+            res[-2]['hourly-MB'] / res[-1]['hourly-MB']))
+    return res
+
+
+def traced(func, *args, **kwargs):
+    """Return (result, peak traced MB) of calling func"""
+    tracemalloc.start()
+    res = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, peak / 1e6
+
+
+def load_features(fnames):
+    """Features of log dumps read whole into one DataPool"""
+    dp = DataPool('app_daily')
+    dp.df = pd.concat([pd.read_json(f, lines=True, convert_dates=False)
+                       if f.endswith('.jsonl') else
+                       without_dates(pd.read_csv(f, index_col=[0]))
+                       for f in fnames], ignore_index=True)
+    dp.clean_data()
+    dp.create_features()
+    return dp.dfeat
+
+
+def ingest_features(fnames, out, partitions, chunk_rows):
+    """Features of log dumps ingested in chunks to partitions"""
+    ingest(fnames, out, partitions, chunk_rows)
+    return partition_features(out)
+
+
+def bench_ingest(n_users=5000, days=100, partitions=16, chunk_rows=50000):
+    """Features of overlapping log dumps: chunked ingest vs read whole"""
+    cdp = simulate_fleet(reference_users(n_users), days * 24 * 3600, seed=1,
+                         hourly=False)
+    df = cdp.getAppDaily().df
+    # Two dumps sharing a third of the days, as CSV and JSONL
+    t = df['power_cycle']
+    res = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        fnames = [os.path.join(tmp, 'dump_01.csv'),
+                  os.path.join(tmp, 'dump_02.jsonl')]
+        with_dates(df.loc[t < 2 * days // 3]).to_csv(fnames[0])
+        df.loc[t >= days // 3].to_json(fnames[1], orient='records',
+                                       lines=True)
+        print('Dumps of {} users, {} days: {} rows, {:.1f} MB'.format(
+            n_users, days, (t < 2 * days // 3).sum() + (t >= days // 3).sum(),
+            sum(os.path.getsize(f) for f in fnames) / 1e6))
+        del cdp, df, t
+        # Timed and traced in separate runs, tracing slows down parsing
+        for mode in ['whole', 'chunked']:
+            args = [fnames] if mode == 'whole' else \
+                [fnames, os.path.join(tmp, 'parts_'), partitions, chunk_rows]
+            func = load_features if mode == 'whole' else ingest_features
+            res[mode], t = timed(func, *args)
+            if mode == 'chunked':
+                args[1] = os.path.join(tmp, 'parts_traced')
+            _, peak = traced(func, *args)
+            print('  {:8}: {:6.2f}s, peak {:7.1f} MB'.format(mode, t, peak))
+    pd.testing.assert_frame_equal(res['whole'], res['chunked'],
+                                  check_dtype=False)
+    print('Features pr partition match the features of the whole dumps')
+
+
+# %% Simulation engine
+class CountingEnvironment(simpy.Environment):
+    """SimPy environment counting the processed events"""
+
+    def __init__(self, initial_time=0):
+        super().__init__(initial_time)
+        self.events = 0
+
+    def step(self):
+        self.events += 1
+        super().step()
+
+
+def reference_users(n_users, fname=REFERENCE, **overrides):
+    """
+    Map 'n_users' ids onto the reference configs
+
+    The ids are distributed like the 'users' ranges of the reference file
+    (id % 20 for the logsim.py setup).
+
+    Returns
+    -------
+    dict of {id: HI config}
+    """
+    ref = load_users(fname, **overrides)
+    return {i: ref[i % len(ref)] for i in range(n_users)}
+
+
+def simulate(users, days, seed=1):
+    """Simulate 'users' for 'days' days and return (CDP, env, wall time)"""
+    random.seed(seed)
+    env = CountingEnvironment()
+    cdp = CDP()
+    t0 = time.perf_counter()
+    for i, cfg in users.items():
+        HI(i, env, cdp, cfg)
+    env.run(until=days * 24 * 3600)
+    return cdp, env, time.perf_counter() - t0
+
+
+def sorted_pool(dp):
+    """
+    DataFrame of a pool in (id, power_cycle, time) order
+
+    Simultaneous events of different HIs may be processed in any order,
+    so pools are compared in this order.
+    """
+    keys = [k for k in ['id', 'power_cycle', 'time'] if k in dp.df.keys()]
+    return dp.df.sort_values(by=keys).reset_index(drop=True)
+
+
+def bench_engine(n_users=20, days=62, **overrides):
+    """Report events and HI-days/sec for a reference simulation"""
+    users = reference_users(n_users, **overrides)
+    cdp, env, wall = simulate(users, days)
+    hi_days = n_users * days
+    res = {'users': n_users, 'days': days, 'events': env.events,
+           'events-pr-hi-day': env.events / hi_days,
+           'events-pr-sec': env.events / wall,
+           'hi-days-pr-sec': hi_days / wall, 'wall': wall}
+    print('{}: {:>6} HI-days, {:8.1f} events/HI-day, {:9.0f} events/s, '
+          '{:7.1f} HI-days/s'.format(
+              overrides if overrides else 'reference', hi_days,
+              res['events-pr-hi-day'], res['events-pr-sec'],
+              res['hi-days-pr-sec']))
+    return res
+
+
+def check_estimator_modes(n_users=20, days=62, seed=1):
+    """Check that the analytic estimators give the reference counters"""
+    ref, _, _ = simulate(reference_users(n_users), days, seed)
+    ana, _, _ = simulate(reference_users(
+        n_users, estimator_mode='analytic'), days, seed)
+    for pool in POOLS:
+        pd.testing.assert_frame_equal(sorted_pool(getattr(ref, pool)),
+                                      sorted_pool(getattr(ana, pool)))
+    print('Analytic estimators match the reference counters '
+          '({} users, {} days)'.format(n_users, days))
+
+
+def bench_memory(n_users=1000, days=7, seed=1):
+    """
+    Memory pr HI after creation and of its counters after 'days' days,
+    against MEMORY_BASELINE and MEMORY_TARGET
+    """
+    tracemalloc.start()
+    rngs = [random.Random('{}:{}'.format(seed, i)) for i in range(n_users)]
+    rng = tracemalloc.get_traced_memory()[0] / n_users
+    tracemalloc.stop()
+    del rngs
+    for mode in ['process', 'analytic']:
+        users = reference_users(n_users, estimator_mode=mode)
+        env = simpy.Environment()
+        cdp = CDP()
+        tracemalloc.start()
+        his = [HI(i, env, cdp, cfg, rng=random.Random('{}:{}'.format(
+            seed, i))) for i, cfg in users.items()]
+        created = tracemalloc.get_traced_memory()[0] / n_users
+        tracemalloc.stop()
+        env.run(until=days * 24 * 3600)
+        counters = np.mean([sys.getsizeof(h.ram) + sys.getsizeof(h.mem)
+                            for h in his])
+        # The baseline had no random generator pr HI
+        gain = MEMORY_BASELINE / (created - rng)
+        print('{:8}: {:6.1f} KB pr HI incl. its random generator ({:.1f} '
+              'KB), counters {:5.1f} KB pr HI, {:.1f}x less than with '
+              'dicts -> {}'.format(
+                  mode, created / 1e3, rng / 1e3, counters / 1e3, gain,
+                  'OK' if gain >= MEMORY_TARGET else
+                  'BELOW the {}x target'.format(MEMORY_TARGET)))
+
+
+# %% Vectorized fleet engine
+def session_increments(dp):
+    """Per session increments of all counters in a pool"""
+    df = sorted_pool(dp)
+    cols = [k for k in df.keys()
+            if k not in ['id', 'power_cycle', 'time', 'date']]
+    inc = df.groupby('id')[cols].diff().dropna()
+    inc['rows'] = 1
+    return inc
+
+
+def check_fleet_engine(n_users=400, days=100, tol=3.0):
+    """
+    Compare the vectorized fleet engine with the SimPy engine
+
+    The mean session increments of all counters in the daily pools must
+    agree within 'tol' percent, as must the number of rows in all pools.
+    """
+    users = reference_users(n_users, estimator_mode='analytic')
+    ref, _, t_ref = simulate(users, days)
+    fleet, t_fleet = timed(simulate_fleet, users, days * 24 * 3600, seed=1)
+    print('SimPy engine: {:.2f}s, vectorized engine: {:.2f}s'.format(
+        t_ref, t_fleet))
+    ok = True
+    for pool in POOLS:
+        a, b = getattr(ref, pool), getattr(fleet, pool)
+        dev = {'rows': 100.0 * (len(b.df) / len(a.df) - 1)}
+        if pool in ['app_daily', 'fsw_daily']:
+            inc_a, inc_b = session_increments(a), session_increments(b)
+            dev.update(100.0 * (inc_b.mean() / inc_a.mean() - 1))
+        worst = max(dev, key=lambda k: abs(dev[k]))
+        ok = ok and abs(dev[worst]) < tol
+        print('  {:12}: max deviation {:+.2f}% ({})'.format(
+            pool, dev[worst], worst))
+    print('Vectorized engine {} the SimPy engine within {}%'.format(
+        'matches' if ok else 'DOES NOT match', tol))
+    return ok
+
+
+# %% Sharded fleet runner
+def bench_spill(n_users=20, days=(62, 124, 248), seed=1):
+    """Peak memory of a run with the DB's in memory vs spilled to disk"""
+    users = reference_users(n_users, estimator_mode='analytic')
+    for d in days:
+        res = []
+        for spill in [False, True]:
+            with tempfile.TemporaryDirectory() as tmp:
+                tracemalloc.start()
+                t0 = time.perf_counter()
+                cdp = run_users(users, d * 24 * 3600, seed,
+                                CDP(spill=tmp) if spill else None)
+                t = time.perf_counter() - t0
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                if spill:
+                    disk = sum(dp.sink.size() for dp in cdp.pools())
+                    # Spilled chunks read back as one DB after the run
+                    reopened = CDP(spill=tmp).getAppHourly().df
+                    assert reopened.equals(cdp.getAppHourly().df)
+            res.append((peak, t))
+        print('{:4} days: memory peak {:6.1f} MB ({:5.1f}s), spilled peak '
+              '{:6.1f} MB ({:5.1f}s), {:6.1f} MB on disk'.format(
+                  d, res[0][0] / 1e6, res[0][1], res[1][0] / 1e6, res[1][1],
+                  disk / 1e6))
+
+
+def bench_population(n_users=500, days=240, seed=1, fname=POPULATION):
+    """Live fleet of a joining/churning population vs all HIs from t=0"""
+    with open(fname) as f:
+        spec = json.load(f)
+    spec['population']['users'] = n_users
+    spec['configs'] = {name: dict(cfg, estimator_mode='analytic')
+                       for name, cfg in spec['configs'].items()}
+    static = copy.deepcopy(spec)
+    for k in ['join', 'churn']:
+        static['population'].pop(k, None)
+    for name, sp in [('all from t=0', static), ('join/churn', spec)]:
+        pop = Population(sp, seed)
+        env = simpy.Environment()
+        peak = {'heap': 0, 'bytes': 0, 'live': 0}
+
+        def sample():
+            # Daily peak of scheduled events and traced memory, live HIs
+            while True:
+                peak['live'] += len(life.active) / days
+                peak['heap'] = max(peak['heap'], len(env._queue))
+                peak['bytes'] = max(peak['bytes'],
+                                    tracemalloc.get_traced_memory()[0])
+                yield env.timeout(24 * 3600)
+        with tempfile.TemporaryDirectory() as tmp:
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            # Spill the DB's, the simulation state is measured
+            cdp = CDP(spill=tmp)
+            life = Lifecycle(env, cdp, pop,
+                             rng=lambda i: random.Random('{}:{}'.format(
+                                 seed, i)))
+            env.process(sample())
+            env.run(until=days * 24 * 3600)
+            wall = time.perf_counter() - t0
+            tracemalloc.stop()
+        print('{:12}: {:5} users joined, {:5} left, {:5.0f} live HIs on '
+              'average, peak {:5} live HIs, {:6} events scheduled, {:6.1f} '
+              'MB traced, {:5.1f}s'.format(
+                  name, life.joined, life.left, peak['live'], life.peak,
+                  peak['heap'], peak['bytes'] / 1e6, wall))
+
+
+def bench_fork(n_users=20, warmup=180, days=60, seed=1):
+    """Scenarios after a shared warm-up, from scratch vs forked"""
+    users = reference_users(n_users, estimator_mode='analytic')
+    scenarios = [{}, {'fsw.visits': [1, 6, 7, 12]},
+                 {'fsw.visits': [1, 7, 9, 12]}, {'app.interval': '30m'}]
+    until = (warmup + days) * 24 * 3600
+    t0 = time.perf_counter()
+    scratch = Simulation(users, seed).run(until).result()
+    for overrides in scenarios[1:]:
+        cfgs = {}
+        for i, cfg in users.items():
+            if id(cfg) not in cfgs:
+                cfgs[id(cfg)] = override(cfg, overrides)
+        Simulation({i: cfgs[id(cfg)] for i, cfg in users.items()},
+                   seed).run(until).result()
+    t_scratch = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    sim = Simulation(users, seed).run(warmup * 24 * 3600)
+    snap = sim.snapshot()
+    forks = [Simulation.restore(snap, overrides).run(until).result()
+             for overrides in scenarios]
+    t_fork = time.perf_counter() - t0
+    for pool in POOLS:
+        pd.testing.assert_frame_equal(getattr(scratch, pool).df,
+                                      getattr(forks[0], pool).df)
+    print('{} scenarios, {} users, {} days warm-up + {} days: from scratch '
+          '{:.1f}s, forked {:.1f}s ({} KB snapshot)'.format(
+              len(scenarios), n_users, warmup, days, t_scratch, t_fork,
+              len(snap) // 1000))
+    print('The fork without overrides matches the run from scratch')
+
+
+def bench_profile(n_users=20, days=62, seed=1):
+    """Profile a reference simulation and report the profiling overhead"""
+    users = reference_users(n_users)
+    until = days * 24 * 3600
+    _, t_off = timed(run_users, users, until, seed)
+    with Profiler() as prof:
+        _, t_on = timed(run_users, users, until, seed)
+    _, t_after = timed(run_users, users, until, seed)
+    prof.report()
+    print('Wall time: {:.2f}s not profiled, {:.2f}s profiled, {:.2f}s after '
+          'uninstall'.format(t_off, t_on, t_after))
+    return prof
+
+
+def bench_runner(n_users=200, days=62, seed=1):
+    """Scaling of the sharded runner, results must not depend on it"""
+    users = reference_users(n_users)
+    until = days * 24 * 3600
+    ref = None
+    for workers in sorted({1, 2, os.cpu_count()}):
+        cdp, wall = timed(run_fleet, users, until, seed, workers)
+        print('{} worker(s): {:7.1f} HI-days/s'.format(
+            workers, n_users * days / wall))
+        if ref is None:
+            ref = cdp
+            continue
+        for pool in POOLS:
+            pd.testing.assert_frame_equal(getattr(ref, pool).df,
+                                          getattr(cdp, pool).df)
+    print('Results are identical for all worker counts')
+
+
+def bench_partitions(n_users=200, days=62, analytics=100000, seed=1,
+                     partitions=16):
+    """Sharded runs written to partitions, and the analytics of one
+    DataFrame vs a partitioned DB in a process pool"""
+    users = reference_users(n_users)
+    until = days * 24 * 3600
+    with tempfile.TemporaryDirectory() as tmp:
+        # Shards writing their partitions hold the merged DB
+        cdp, t_merge = timed(run_fleet, users, until, seed, 1, partitions)
+        pools, t_part = timed(run_partitioned, users, until,
+                              os.path.join(tmp, 'run'), seed, 1, partitions)
+        for pool in POOLS:
+            pd.testing.assert_frame_equal(getattr(cdp, pool).df,
+                                          pools[pool].read())
+        print('{} users, {} days in {} shards: merged {:.2f}s, written to '
+              'partitions {:.2f}s, identical pools'.format(
+                  n_users, days, partitions, t_merge, t_part))
+
+        def large_pool():
+            """Daily pool with all columns of the analytics"""
+            dp = daily_pool(analytics, 30, seed)
+            for k in ['ovd-snr-med', 'ovd-snr-high']:
+                dp.df[k] = dp.df['ovd-snr-low']
+            return dp
+
+        def analyze(dp, *args):
+            dp.normalize_data(*args)
+            dp.create_features(None, *args)
+        dp = large_pool()
+        pp = PartitionedPool(os.path.join(tmp, 'daily'), partitions)
+        pp.write(dp.df)
+        res = {}
+        _, t = timed(analyze, dp)
+        _, peak = traced(analyze, large_pool())
+        res['one DataFrame'] = (t, peak)
+        for workers in sorted({1, 2, os.cpu_count()}):
+            _, t = timed(analyze, pp, workers)
+            res['{} worker(s)'.format(workers)] = (t, None)
+        # Memory of a worker, as traced in this process
+        _, peak = traced(analyze, pp, 1)
+        res['1 worker(s)'] = (res['1 worker(s)'][0], peak)
+        pd.testing.assert_frame_equal(
+            dp.ddiff.sort_values(by=['id', 'power_cycle']).reset_index(
+                drop=True),
+            pp.read(diffed=True).sort_values(by=['id', 'power_cycle'])
+            .reset_index(drop=True), check_dtype=False)
+        pd.testing.assert_frame_equal(dp.dfeat, pp.dfeat)
+    print('Normalize and features of {} users x 30 days, {} partitions:'
+          .format(analytics, partitions))
+    for k, (t, peak) in res.items():
+        print('  {:14}: {:6.2f}s{}'.format(
+            k, t, '' if peak is None else ', peak {:6.1f} MB'.format(peak)))
+    print('Partitioned results match the results of one DataFrame')
+    return res
+
+
+# %% Batch reports
+def bench_report(n_users=200, days=62):
+    """Batch report: one pass and reused figures vs per user plotting"""
+    dp = daily_pool(n_users, days)
+    df = dp.df
+    for k in ['ovd-snr-med', 'ovd-snr-high']:
+        df[k] = df['ovd-snr-low']
+    df['time'] = 1583107200 + 86400 * df['power_cycle'] + df['id']
+    dp.df = df
+    (charts, pages, x_label), t_pass = timed(report_pages, dp)
+    cols = [c for chart in charts for c in chart[1]] + ['Threshold']
+
+    def per_user():
+        # As plot_daily/plot_monthly, filtering the DBs for each user
+        res = []
+        r = dp.rollup('month')
+        plot_columns(r)
+        for u in range(n_users):
+            d = dp.ddiff[dp.ddiff['id'] == u]
+            res += [d.iloc[-32:-1][cols].to_numpy(),
+                    r[r['id'] == u][cols].to_numpy()]
+        return res
+    ref, t_filter = timed(per_user)
+    assert all(np.array_equal(p[3], r, equal_nan=True)
+               for p, r in zip(pages, ref))
+    print('Plot data of {} users: {:.3f}s filtering pr user, {:.3f}s in '
+          'one pass (identical)'.format(n_users, t_filter, t_pass))
+
+    sample = pages[:40]
+    with tempfile.TemporaryDirectory() as tmp:
+        def new_figures():
+            for k, page in enumerate(sample):
+                fig = PageFigure(charts, len(page[2]), x_label)
+                fig.draw(page)
+                fig.save(os.path.join(tmp, '{}.png'.format(k)), dpi=80)
+
+        def reused_figure():
+            render_report(dp, tmp, ids=range(len(sample) // 2), workers=1)
+        t_new = best_of(new_figures, 1)
+        t_reuse = best_of(reused_figure, 1)
+        print('{} pages: {:.1f} ms/page with a new figure pr page, {:.1f} '
+              'ms/page on a reused figure'.format(
+                  len(sample), 1e3 * t_new / len(sample),
+                  1e3 * t_reuse / len(sample)))
+        for workers in sorted({1, os.cpu_count()}):
+            _, t = timed(render_report, dp, tmp, workers=workers)
+            print('Report of {} users, {} pages, {} worker(s): {:.1f}s'
+                  .format(n_users, len(pages), workers, t))
+
+
+# %% Startup
+def import_time(code, repeat=5):
+    """Best wall time in secs of a fresh interpreter running 'code'"""
+    return min(timed(subprocess.run, [sys.executable, '-c', code],
+                     check=True)[1] for r in range(repeat))
+
+
+def bench_startup(budget=STARTUP_BUDGET, repeat=5):
+    """
+    Import time of the simulate only path against a budget
+
+    Parameters
+    ----------
+    budget : float, optional
+        Budget in secs on top of importing pandas. The default is
+        STARTUP_BUDGET.
+    repeat : int, optional
+        Times are the best of 'repeat' interpreters. The default is 5.
+
+    Returns
+    -------
+    True if the simulate only path is within budget and loads no plotting
+    library
+
+    """
+    base = import_time('pass', repeat)
+    paths = {'pandas': 'import numpy, pandas',
+             'logsim.runner': 'import logsim.runner',
+             'logsim.sweep': 'import logsim.sweep',
+             'python -m logsim': 'import logsim.__main__ as m; '
+             'm.make_parser()',
+             'logsim.datapool + pyplot': 'import logsim.datapool, '
+             'matplotlib.pyplot, seaborn'}
+    times = {name: import_time(code, repeat) - base
+             for name, code in paths.items()}
+    for name, t in times.items():
+        print('{:26} {:6.3f}s'.format(name, t))
+    # Timed in the interpreter, after pandas, as differences of
+    # interpreter wall times are noisy
+    code = 'import time, numpy, pandas; t = time.perf_counter(); ' \
+        'import logsim.runner; print(time.perf_counter() - t)'
+    t = min(float(subprocess.run(
+        [sys.executable, '-c', code], check=True, capture_output=True,
+        text=True).stdout) for r in range(repeat))
+    code = 'import sys, logsim.runner, logsim.sweep; print(" ".join(' \
+        'm for m in {} if m in sys.modules))'.format(PLOTTING)
+    loaded = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True).stdout.strip()
+    ok = t <= budget and not loaded
+    print('Simulate only: {:.3f}s on top of pandas, of a {:.3f}s budget, '
+          'plotting modules loaded: {} -> {}'.format(
+              t, budget, loaded or 'none', 'OK' if ok else 'OVER BUDGET'))
+    return ok
+
+
+# %% Benchmark suite
+# Simulated days pr number of users, and DataPool row counts
+SUITE = {'full': {'users': {1: 365, 20: 62, 1000: 14, 10000: 7},
+                  'rows': [10**4, 10**5, 10**6]},
+         'quick': {'users': {1: 62, 20: 31, 200: 7},
+                   'rows': [10**4, 10**5]}}
+
+
+def best_of(func, repeat=3):
+    """Best wall time in secs of 'repeat' calls of func"""
+    return min(timed(func)[1] for r in range(repeat))
+
+
+def suite_meta(size):
+    """Describe the code and machine a suite was run on"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True).stdout
+    except OSError:
+        commit = ''
+    return {'size': size, 'commit': commit.strip(),
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'simpy': simpy.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def run_suite(size='full', repeat=3):
+    """
+    Run the benchmark suite
+
+    Parameters
+    ----------
+    size : string, optional
+        'full' or 'quick', see SUITE. The default is 'full'.
+    repeat : int, optional
+        DataPool timings are the best of 'repeat' runs. The default is 3.
+
+    Returns
+    -------
+    dict with 'meta' and 'metrics', each metric a dict with 'value',
+    'unit' and 'better' ('higher' or 'lower')
+    """
+    metrics = {}
+
+    def metric(name, value, unit, better='lower'):
+        metrics[name] = {'value': value, 'unit': unit, 'better': better}
+        print('  {:45} {:12.4g} {}'.format(name, value, unit))
+
+    print('Simulation')
+    for mode in ['process', 'analytic']:
+        for n, days in SUITE[size]['users'].items():
+            users = reference_users(n, estimator_mode=mode)
+            cdp, env, wall = simulate(users, days)
+            name = 'engine/{}/{}-users/'.format(mode, n)
+            metric(name + 'hi-days-pr-sec', n * days / wall, 'HI-days/s',
+                   'higher')
+            metric(name + 'events-pr-hi-day', env.events / n / days,
+                   'events/HI-day')
+
+    print('Startup')
+    t = import_time('import logsim.runner', repeat)
+    metric('startup/import-runner', t - import_time('pass', repeat), 's')
+
+    print('DataPool')
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in SUITE[size]['rows']:
+            name = 'datapool/{}-rows/'.format(rows)
+            sample = [sample_row(i) for i in range(rows)]
+
+            def put():
+                dp = DataPool('bench')
+                for r in sample:
+                    dp.put(r)
+                return dp.df
+            metric(name + 'put', 1e6 * best_of(put, repeat) / rows,
+                   'us/row')
+            # Daily pools of 30 days
+            dp = daily_pool(max(rows // 30, 1))
+            df = dp.df
+            for k in ['ovd-snr-med', 'ovd-snr-high']:
+                df[k] = df['ovd-snr-low']
+
+            def diff():
+                dp.df = df
+                dp.diff_data()
+            metric(name + 'diff_data', best_of(diff, repeat), 's')
+            metric(name + 'create_features',
+                   best_of(dp.create_features, repeat), 's')
+            dp.name = os.path.join(tmp, 'bench')
+            for fmt in ['parquet', 'csv']:
+                metric(name + 'save-' + fmt,
+                       best_of(lambda: dp.save(fmt=fmt), repeat), 's')
+                metric(name + 'load-' + fmt,
+                       best_of(lambda: dp.load(fmt=fmt), repeat), 's')
+    return {'meta': suite_meta(size), 'metrics': metrics}
+
+
+def compare(base, new, threshold=10.0):
+    """
+    Compare two suite results and flag regressions
+
+    Parameters
+    ----------
+    base, new : dict
+        Results of run_suite
+    threshold : float, optional
+        Regression threshold in %. The default is 10.
+
+    Returns
+    -------
+    list of names of regressed metrics
+    """
+    print('Base: {}, new: {}'.format(base['meta'], new['meta']))
+    regressions = []
+    for name, b in base['metrics'].items():
+        if name not in new['metrics']:
+            print('  {:45} missing in new results'.format(name))
+            continue
+        v = new['metrics'][name]['value']
+        change = 100.0 * (v - b['value']) / b['value'] if b['value'] else 0
+        # Positive when worse
+        worse = change if b['better'] == 'lower' else -change
+        flag = ''
+        if worse > threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif worse < -threshold:
+            flag = 'improved'
+        print('  {:45} {:12.4g} -> {:12.4g} {:14} {:+7.1f}% {}'.format(
+            name, b['value'], v, b['unit'], change, flag))
+    print('{} regression(s) beyond {}%'.format(len(regressions), threshold))
+    return regressions
+
+
+# %% Main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='logsim benchmarks')
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('datapool', help='DataPool ingestion')
+    p.add_argument('--rows', type=int, default=10**6)
+    p = sub.add_parser('engine', help='Simulation events and throughput')
+    p.add_argument('--users', type=int, default=20)
+    p.add_argument('--days', type=int, default=62)
+    p = sub.add_parser('memory', help='Memory pr HI')
+    p.add_argument('--users', type=int, default=1000)
+    p.add_argument('--days', type=int, default=7)
+    p = sub.add_parser('fleet', help='Vectorized engine vs SimPy')
+    p.add_argument('--users', type=int, default=400)
+    p.add_argument('--days', type=int, default=100)
+    p = sub.add_parser('runner', help='Sharded fleet runner')
+    p.add_argument('--users', type=int, default=200)
+    p.add_argument('--days', type=int, default=62)
+    p = sub.add_parser('partitions', help='Partitioned DB analytics')
+    p.add_argument('--users', type=int, default=200)
+    p.add_argument('--days', type=int, default=62)
+    p.add_argument('--analytics', type=int, default=100000,
+                   help='Users of the analyzed daily pool')
+    p = sub.add_parser('analytics', help='DataPool analytics')
+    p.add_argument('--users', type=int, nargs='+',
+                   default=[10000, 30000, 100000])
+    p = sub.add_parser('refresh', help='Incremental diff after each day')
+    p.add_argument('--users', type=int, default=10000)
+    p.add_argument('--days', type=int, default=60)
+    p = sub.add_parser('query', help='Per user and date queries')
+    p.add_argument('--users', type=int, default=100000)
+    p.add_argument('--days', type=int, default=30)
+    p = sub.add_parser('rollup', help='Incremental calendar rollups')
+    p.add_argument('--users', type=int, default=10000)
+    p.add_argument('--days', type=int, default=60)
+    p = sub.add_parser('storage', help='CSV vs Parquet/Feather')
+    p.add_argument('--users', type=int, default=1000)
+    p.add_argument('--days', type=int, default=100)
+    p = sub.add_parser('schema', help='Declared vs inferred column types')
+    p.add_argument('--users', type=int, default=1000)
+    p.add_argument('--days', type=int, default=100)
+    p = sub.add_parser('ingest', help='Chunked ingest of log dumps')
+    p.add_argument('--users', type=int, default=5000)
+    p.add_argument('--days', type=int, default=100)
+    p.add_argument('--partitions', type=int, default=16)
+    p.add_argument('--chunk-rows', type=int, default=50000)
+    p = sub.add_parser('spill', help='Peak memory with spill to disk')
+    p.add_argument('--users', type=int, default=20)
+    p.add_argument('--days', type=int, nargs='+', default=[62, 124, 248])
+    p = sub.add_parser('population', help='Lazy HIs of a population')
+    p.add_argument('--users', type=int, default=500)
+    p.add_argument('--days', type=int, default=240)
+    p = sub.add_parser('fork', help='Scenarios forked after a warm-up')
+    p.add_argument('--users', type=int, default=20)
+    p.add_argument('--warmup', type=int, default=180)
+    p.add_argument('--days', type=int, default=60)
+    p = sub.add_parser('report', help='Batch report of all users')
+    p.add_argument('--users', type=int, default=200)
+    p.add_argument('--days', type=int, default=62)
+    p = sub.add_parser('startup', help='Import time of the simulate path')
+    p.add_argument('--budget', type=float, default=STARTUP_BUDGET)
+    p = sub.add_parser('profile', help='Profile a simulation')
+    p.add_argument('--users', type=int, default=20)
+    p.add_argument('--days', type=int, default=62)
+    p = sub.add_parser('suite', help='Run the suite, save the results')
+    p.add_argument('--size', choices=list(SUITE), default='full')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--out', default=None, help='JSON file of the results')
+    p = sub.add_parser('compare', help='Compare suite results')
+    p.add_argument('base', help='JSON file of the baseline results')
+    p.add_argument('new', help='JSON file of the new results')
+    p.add_argument('--threshold', type=float, default=10.0,
+                   help='Flag changes worse than this (%%)')
+    args = parser.parse_args()
+
+    if args.bench == 'datapool':
+        bench_datapool_put(args.rows)
+        bench_datapool_put_many(args.rows)
+    elif args.bench == 'engine':
+        bench_engine(args.users, args.days)
+        bench_engine(args.users, args.days, estimator_mode='analytic')
+        check_estimator_modes(args.users, args.days)
+    elif args.bench == 'memory':
+        bench_memory(args.users, args.days)
+    elif args.bench == 'fleet':
+        check_fleet_engine(args.users, args.days)
+    elif args.bench == 'runner':
+        bench_runner(args.users, args.days)
+    elif args.bench == 'partitions':
+        bench_partitions(args.users, args.days, args.analytics)
+    elif args.bench == 'analytics':
+        bench_diff_data(args.users)
+        bench_create_features(args.users)
+    elif args.bench == 'refresh':
+        bench_refresh(args.users, args.days)
+    elif args.bench == 'query':
+        bench_query(args.users, args.days)
+    elif args.bench == 'rollup':
+        bench_rollup(args.users, args.days)
+    elif args.bench == 'storage':
+        bench_storage(args.users, args.days)
+    elif args.bench == 'schema':
+        bench_schema(args.users, args.days)
+    elif args.bench == 'ingest':
+        bench_ingest(args.users, args.days, args.partitions, args.chunk_rows)
+    elif args.bench == 'spill':
+        bench_spill(args.users, args.days)
+    elif args.bench == 'population':
+        bench_population(args.users, args.days)
+    elif args.bench == 'fork':
+        bench_fork(args.users, args.warmup, args.days)
+    elif args.bench == 'report':
+        bench_report(args.users, args.days)
+    elif args.bench == 'startup':
+        if not bench_startup(args.budget):
+            sys.exit(1)
+    elif args.bench == 'profile':
+        bench_profile(args.users, args.days)
+    elif args.bench == 'suite':
+        res = run_suite(args.size, args.repeat)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(res, f, indent=1)
+    elif args.bench == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        if compare(base, new, args.threshold):
+            sys.exit(1)
@@ -118,6 +118,8 @@ hi = HI(0, env, cdp, HI_cfg0)
 
 
 # %% More users?
+# Fleets with archetypes, joining and leaving users: see
+# configs/population.json and logsim.runner
 users = {}
 def more_users(users):
     for i in range(1, 8):
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Command line of logsim: simulate, analyze and plot from files.
+
+Usage:
+    python -m logsim run configs/reference.json --until 372d:4h --seed 1 \\
+        --ver 01 [--fmt parquet] [--workers 4] [--cache .logsim_cache]
+    python -m logsim analyze --ver 01 [--fmt parquet] [--pool app_daily] \\
+        [--ids 0 1 2] [--out features.csv]
+    python -m logsim run configs/reference.json --until 372d --seed 1 \\
+        --parts parts [--workers 4]
+    python -m logsim analyze --parts parts [--pool app_daily] [--workers 4]
+    python -m logsim plot --ver 01 [--fmt parquet] --user 0 \\
+        [--kind daily|monthly|features] [--out plot.png]
+    python -m logsim report --ver 01 [--fmt parquet] --out report \\
+        [--kinds daily monthly] [--pages png|pdf] [--workers 4]
+    python -m logsim ingest dump_01.csv dump_02.jsonl --out parts \\
+        [--partitions 16] [--chunk-rows 100000] [--features features.csv]
+
+Every command imports only the modules it needs, when it runs. Simulating
+never loads matplotlib or seaborn, so sweep and worker processes start
+fast, see 'python benchmark.py startup' for the import time budget.
+"""
+
+# %% Import essentials
+import argparse
+import glob
+import os
+import sys
+
+# Same as logsim.runner.POOLS, without importing the simulation
+POOLS = ['app_daily', 'app_hourly', 'fsw_daily', 'fsw_monthly']
+FORMATS = ['csv', 'parquet', 'feather']
+
+
+# %% Commands
+def run(args):
+    """ Simulate a fleet from a configs/users or population file """
+    import logsim.ttime as tt
+    from logsim.datapool import CDP
+    from logsim.runner import load_fleet, run_fleet, simulate
+
+    if args.spill and glob.glob(os.path.join(args.spill, '*', 'chunk_*')):
+        # The chunks would be read as part of the new run's DB's
+        print('Spill directory holds DB chunks of another run: '
+              + args.spill)
+        return 1
+    users = load_fleet(args.config, args.seed)
+    until = tt.hms2sec(args.until)
+    if args.profile:
+        from logsim.profile import Profiler
+        with Profiler() as prof:
+            cdp = simulate(users, until, args.seed,
+                           CDP(spill=args.spill) if args.spill else None)
+        prof.report()
+        prof.save(args.profile)
+    elif args.spill:
+        cdp = simulate(users, until, args.seed, CDP(spill=args.spill))
+    elif args.parts:
+        from logsim.runner import run_partitioned
+        run_partitioned(users, until, args.parts, args.seed, args.workers,
+                        args.shards)
+        print('Partitioned pools: ' + args.parts)
+        return
+    elif args.cache:
+        from logsim.cache import RunCache
+        cache = RunCache(args.cache)
+        cdp = cache.run(users, until, args.seed, args.workers,
+                        args.shards)
+        print('Run cache: {}'.format(cache.stats()))
+    else:
+        cdp = run_fleet(users, until, args.seed, args.workers, args.shards)
+    cdp.save(ver=args.ver, fmt=args.fmt)
+
+
+def load_pool(args):
+    """ Load the DB of a saved simulation, None if missing or empty """
+    from logsim.datapool import CDP
+
+    dp = getattr(CDP(), args.pool)
+    dp.load(args.ver, args.fmt, ids=args.ids)
+    if dp.isEmpty():
+        print('No data in {} version {} ({})'.format(args.pool, args.ver,
+                                                     args.fmt))
+        return None
+    return dp
+
+
+def analyze(args):
+    """ Summarize the features pr user of a saved DB """
+    import pandas as pd
+
+    if args.parts:
+        # One partition pr worker at a time, see logsim.partition
+        from logsim.partition import PartitionedPool
+        path = os.path.join(args.parts, args.pool)
+        if not os.path.isdir(path):
+            print('No partitions: ' + path)
+            return 1
+        dp = PartitionedPool(path)
+        dp.create_features(workers=args.workers)
+    else:
+        dp = load_pool(args)
+        if dp is None:
+            return 1
+        dp.create_features()
+    with pd.option_context('display.width', 160, 'display.max_columns', 20):
+        print(dp.dfeat.describe())
+    if args.out:
+        dp.dfeat.to_csv(args.out)
+
+
+def plot(args):
+    """ Plot a user or the features of a saved DB """
+    import matplotlib
+    if args.out:
+        # Save the figures without a display
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    dp = load_pool(args)
+    if dp is None:
+        return 1
+    if args.kind == 'daily':
+        dp.plot_daily(user_id=args.user, days=args.days)
+    elif args.kind == 'monthly':
+        dp.plot_monthly(user_id=args.user)
+    else:
+        dp.plot_features()
+    if not args.out:
+        plt.show()
+        return
+    # One file pr figure, numbered if more than one
+    stem, ext = os.path.splitext(args.out)
+    figs = plt.get_fignums()
+    for k, num in enumerate(figs):
+        fname = args.out if len(figs) == 1 else \
+            '{}_{}{}'.format(stem, k + 1, ext)
+        plt.figure(num).savefig(fname, bbox_inches='tight')
+        print('Saved ' + fname)
+    plt.close('all')
+
+
+def report(args):
+    """ Render the charts of all users of a saved DB to files """
+    from logsim.report import render_report, report_kinds
+
+    dp = load_pool(args)
+    if dp is None:
+        return 1
+    try:
+        report_kinds(dp, args.kinds)
+    except ValueError as e:
+        print(e)
+        return 1
+    print('Report: ' + render_report(dp, args.out, args.kinds, args.ids,
+                                     args.pages, args.workers,
+                                     days=args.days, dpi=args.dpi))
+
+
+def ingest(args):
+    """ Partition log dumps by user in chunks, summarize the features """
+    import pandas as pd
+    from logsim.ingest import ingest, partition_features
+
+    print('Ingest: {}'.format(ingest(args.dumps, args.out, args.partitions,
+                                     args.chunk_rows, name=args.pool)))
+    if args.features:
+        dfeat = partition_features(args.out, name=args.pool)
+        with pd.option_context('display.width', 160,
+                               'display.max_columns', 20):
+            print(dfeat.describe())
+        dfeat.to_csv(args.features)
+
+
+# %% Arguments
+def run_arguments(parser):
+    """ Add the arguments of the run command to 'parser' """
+    parser.add_argument('config', help='JSON file with configs and users '
+                        'or a population')
+    parser.add_argument('--until', default='31d',
+                        help='Simulation length, e.g. 372d:4h')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--shards', type=int, default=None)
+    parser.add_argument('--ver', default='00', help='Version of saved files')
+    parser.add_argument('--fmt', default='csv', choices=FORMATS,
+                        help='File format of the saved pools')
+    parser.add_argument('--spill', default=None,
+                        help='Spill the DB chunks to this new or empty '
+                        'directory while simulating in one process')
+    parser.add_argument('--profile', default=None,
+                        help='Profile the simulation in one process, save '
+                        'the accounting to this JSON file')
+    parser.add_argument('--cache', default=None,
+                        help='Reuse results from this run cache directory')
+    parser.add_argument('--parts', default=None,
+                        help='Write the pools partitioned by user to this '
+                        'directory, a partition pr shard, instead of saving')
+
+
+def pool_arguments(parser, pool='app_daily'):
+    """ Add the arguments selecting a saved DB to 'parser' """
+    parser.add_argument('--ver', default='00', help='Version of saved files')
+    parser.add_argument('--fmt', default='csv', choices=FORMATS,
+                        help='File format of the saved pools')
+    parser.add_argument('--pool', default=pool, choices=POOLS)
+    parser.add_argument('--ids', type=int, nargs='+', default=None,
+                        help='Users to load. The default is all users')
+
+
+def make_parser():
+    """ Parser of the logsim command line """
+    parser = argparse.ArgumentParser(
+        prog='logsim', description='Event logging simulation of HIs')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('run', help='Simulate a fleet and save its DBs')
+    run_arguments(p)
+    p.set_defaults(func=run)
+    p = sub.add_parser('analyze', help='Features pr user of a saved DB')
+    pool_arguments(p)
+    p.add_argument('--out', default=None, help='CSV file of the features')
+    p.add_argument('--parts', default=None,
+                   help='Analyze the partitioned pools in this directory')
+    p.add_argument('--workers', type=int, default=None)
+    p.set_defaults(func=analyze)
+    p = sub.add_parser('plot', help='Plot a saved DB')
+    pool_arguments(p)
+    p.add_argument('--user', type=int, default=0)
+    p.add_argument('--kind', default='daily',
+                   choices=['daily', 'monthly', 'features'])
+    p.add_argument('--days', type=int, default=31,
+                   help='Days of the daily plot')
+    p.add_argument('--out', default=None,
+                   help='Save the figures to this file instead of showing')
+    p.set_defaults(func=plot)
+    p = sub.add_parser('report', help='Charts of all users to files')
+    pool_arguments(p)
+    p.add_argument('--out', default='report', help='Output directory')
+    p.add_argument('--kinds', nargs='+', default=None,
+                   choices=['daily', 'monthly'],
+                   help='Kinds of pages, the default is all the pool has')
+    p.add_argument('--pages', default='png', choices=['png', 'pdf'],
+                   help='A PNG file pr page or a multi-page PDF pr part')
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--days', type=int, default=31,
+                   help='Days of the daily pages')
+    p.add_argument('--dpi', type=int, default=80)
+    p.set_defaults(func=report)
+    p = sub.add_parser('ingest', help='Partition log dumps by user')
+    p.add_argument('dumps', nargs='+', help='CSV or JSONL files')
+    p.add_argument('--out', default='parts',
+                   help='Directory of the partitions, new rows are added')
+    p.add_argument('--partitions', type=int, default=16,
+                   help='Partitions by user, a partition is cleaned and '
+                   'analyzed in memory')
+    p.add_argument('--chunk-rows', type=int, default=100000,
+                   help='Rows read at a time, bounds the memory of the '
+                   'reading only')
+    p.add_argument('--pool', default='app_daily', choices=POOLS)
+    p.add_argument('--features', default=None,
+                   help='CSV file of the features pr user')
+    p.set_defaults(func=ingest)
+    return parser
+
+
+def main(argv=None):
+    """ Run the command line 'argv', the default is sys.argv """
+    args = make_parser().parse_args(argv)
+    return args.func(args)
+
+
+# %% Main
+if __name__ == '__main__':
+    sys.exit(main())
@@ -40,73 +40,97 @@ class App:
         self.env = env
         self.cdp_app_hourly = cdp.getAppHourly()
         self.cdp_app_daily = cdp.getAppDaily()
-        self.interval = cfg['interval']
-        self.diff = cfg['diff']
+        self.configure(cfg)
         self.verbosity = verbosity
         self.sim_start = sim_start
         self.timelog = {}
+        # Process state: counters of the last sample (a tuple in the field
+        # order of the HI), yesterdays counters stored, time the App went
+        # to sleep with the HI off
+        self.last_data = None
+        self.yesterday_stored = False
+        self.t_off = 0
         # Start the App
-        self.env.process(self.run())
+        self.HI.start(self.run())
+
+    def configure(self, cfg):
+        """Set the parameters of cfg"""
+        self.interval = cfg['interval']
+        self.diff = cfg['diff']
+
+    def __getstate__(self):
+        """State for a snapshot, without the SimPy environment"""
+        return {k: v for k, v in self.__dict__.items() if k != 'env'}
 
     def time2str(self):
         """Return current date and time as string"""
         return tt.time2str(self.sim_start + self.env.now)
 
-    def date2str(self):
-        """Return current date as string"""
-        return tt.time2date(self.sim_start + self.env.now)
-
-    def run(self):
-        """Run the App"""
+    def run(self, wake=None):
+        """Run the App, a restored one from its pending 'wake'"""
         app_tick = tt.hms2sec(self.interval)
-        app_data = {}
-        last_data = {}
-        yesterday_data = {}
-        yesterday_stored = False
+        if wake == tt.ASLEEP:
+            yield self.HI.session_started
+            yield self.env.timeout(0)
+            wake = self.env.now + (self.t_off - self.env.now) % app_tick
+        yield self.env.timeout(
+            app_tick if wake is None else wake - self.env.now)
         while True:
-            yield self.env.timeout(app_tick)
             if self.HI.is_running():
                 # Get current RAM counters
-                RAM = self.HI.get_counters_RAM()
-                for k in RAM.keys():
-                    app_data[k] = RAM[k]
-                # Update to app time
-                app_data['time'] = self.time2str()
-                app_data['date'] = self.date2str()
+                RAM = self.HI.get_counters_RAM(as_dict=True)
+                app_data = dict(RAM)
+                # Update to app time, epoch secs. Strings are derived in
+                # bulk on export, see DataPool.with_dates
+                app_data['time'] = self.sim_start + self.env.now
                 # Update timelog
                 if app_data['power_cycle'] not in self.timelog.keys():
                     self.timelog[app_data['power_cycle']] = (
                         app_data['time'], app_data['usage'])
                 # Detectors/Estimators in diff/percentage?
-                if (self.diff and (len(last_data) > 0)):
+                last_data = self.last_data
+                if self.diff and last_data is not None:
+                    index = self.HI.index
                     for e in self.HI.detectors:
-                        app_data[e] = app_data[e] - last_data[e]
+                        app_data[e] = app_data[e] - last_data[index[e]]
                     for e in self.HI.estimators:
-                        app_data[e] = '{:.1f}%'.format(
-                            100.0 * (app_data[e] - last_data[e]) / app_tick)
+                        app_data[e] = round(
+                            100.0 * (app_data[e] - last_data[index[e]])
+                            / app_tick, 1)
 
                 # Store in hourly DB
                 self.cdp_app_hourly.put(app_data)
-                for k in RAM.keys():
-                    last_data[k] = RAM[k]
+                self.last_data = tuple(RAM.values())
 
                 # Store in daily DB
-                if not yesterday_stored and self.HI.get_yesterdays_counters():
+                if not self.yesterday_stored and \
+                        self.HI.get_yesterdays_counters() is not None:
                     # Get yesterdays counters
-                    y_cnt = self.HI.get_yesterdays_counters()
-                    for k in y_cnt.keys():
-                        yesterday_data[k] = y_cnt[k]
+                    yesterday_data = self.HI.counters2dict(
+                        self.HI.get_yesterdays_counters())
                     # Get yesterdays power_cycle
                     pwr_cyc = yesterday_data['power_cycle']
-                    yesterday_data['time'] = self.timelog[pwr_cyc][0]
-                    yesterday_data['date'] = \
-                        yesterday_data['time'].split(' ')[0]
-                    yesterday_data['usage-at-time'] = self.timelog[pwr_cyc][1]
+                    # A session without App reads is logged as of now,
+                    # with all its usage
+                    yesterday_data['time'], yesterday_data['usage-at-time'] \
+                        = self.timelog.get(pwr_cyc, (
+                            app_data['time'], yesterday_data['usage']))
                     self.cdp_app_daily.put(yesterday_data)
-                    yesterday_stored = True
+                    self.yesterday_stored = True
+                    # Older power cycles are never looked up again
+                    self.timelog = {pc: v for pc, v in self.timelog.items()
+                                    if pc >= pwr_cyc}
                 # Log
                 if self.verbosity > 2:
-                    print('@ {}: App: {}'.format(app_data['time'], app_data))
+                    print('@ {}: App: {}'.format(self.time2str(), app_data))
+                yield self.env.timeout(app_tick)
             else:
                 # Prepare next day
-                yesterday_stored = False
+                self.yesterday_stored = False
+                # Sleep until the HI starts, resume on the App phase
+                self.t_off = self.env.now
+                yield self.HI.session_started
+                # Let the detectors woken by the HI schedule first, so a
+                # detector firing at an App tick is seen by the App
+                yield self.env.timeout(0)
+                yield self.env.timeout((self.t_off - self.env.now) % app_tick)
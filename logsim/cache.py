@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Content addressed cache of simulation results.
+
+A run is identified by a hash of the normalized HI configurations, the
+user mapping, the simulation length, the seed and the logsim code version.
+On a hit the stored CDP pools are returned, on a miss the fleet is
+simulated and stored. The cache is bounded in size on disk, the least
+recently used runs are evicted first.
+"""
+
+# %% Import essentials
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import pandas as pd
+import logsim
+from logsim.datapool import CDP
+from logsim.population import Population
+from logsim.runner import POOLS, run_fleet
+
+
+def code_version():
+    """Version of logsim including a hash of its source files"""
+    h = hashlib.sha256()
+    for fname in sorted(glob.glob(os.path.join(
+            os.path.dirname(logsim.__file__), '*.py'))):
+        with open(fname, 'rb') as f:
+            h.update(f.read())
+    return '{}+{}'.format(logsim.__version__, h.hexdigest()[:12])
+
+
+def run_key(users, until, seed):
+    """
+    Hash identifying a simulation run
+
+    Parameters
+    ----------
+    users : dict of {id: HI config} or Population
+    until : int, end of simulation (secs)
+    seed : int
+
+    Returns
+    -------
+    string, hex digest
+
+    """
+    if isinstance(users, Population):
+        run = {'population': users.spec, 'population_seed': users.seed,
+               'ids': users.keys(), 'until': until, 'seed': seed,
+               'version': code_version()}
+        return hashlib.sha256(
+            json.dumps(run, sort_keys=True).encode()).hexdigest()
+    # Normalize: ids grouped by identical config
+    groups = {}
+    for i in sorted(users):
+        key = json.dumps(users[i], sort_keys=True)
+        groups.setdefault(key, []).append(int(i))
+    run = {'users': sorted(([ids, json.loads(k)]
+                            for k, ids in groups.items()),
+                           key=lambda g: g[0]),
+           'until': until, 'seed': seed, 'version': code_version()}
+    return hashlib.sha256(
+        json.dumps(run, sort_keys=True).encode()).hexdigest()
+
+
+class RunCache:
+    """Class holding a size bounded LRU cache of simulation results"""
+
+    def __init__(self, path='.logsim_cache', max_bytes=2 * 1024**3):
+        """
+        Constructor of a RunCache
+
+        Parameters
+        ----------
+        path : string, optional
+            Cache directory. The default is '.logsim_cache'.
+        max_bytes : int, optional
+            Size limit of the cache. The default is 2 GB.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+    def entry(self, key):
+        """Directory of a cache entry"""
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        """Return the stored CDP for 'key', None if not cached"""
+        if not os.path.isdir(self.entry(key)):
+            return None
+        cdp = CDP()
+        for p in POOLS:
+            fname = os.path.join(self.entry(key), p + '.pkl')
+            if os.path.exists(fname):
+                getattr(cdp, p).df = pd.read_pickle(fname)
+        # Mark as recently used
+        os.utime(self.entry(key))
+        return cdp
+
+    def put(self, key, cdp, meta=None):
+        """Store the pools of 'cdp' under 'key' and evict old entries"""
+        tmp = self.entry(key) + '.tmp'
+        os.makedirs(tmp, exist_ok=True)
+        for p in POOLS:
+            dp = getattr(cdp, p)
+            if not dp.isEmpty():
+                dp.df.to_pickle(os.path.join(tmp, p + '.pkl'))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(dict(meta if meta else {}, created=time.time()), f)
+        # Replace atomically, a concurrent run may have stored it too
+        shutil.rmtree(self.entry(key), ignore_errors=True)
+        os.replace(tmp, self.entry(key))
+        self.evict()
+
+    def entries(self):
+        """List of (last used, size, key) of all entries"""
+        res = []
+        for key in os.listdir(self.path):
+            d = self.entry(key)
+            if not os.path.isdir(d) or key.endswith('.tmp'):
+                continue
+            size = sum(os.path.getsize(os.path.join(d, f))
+                       for f in os.listdir(d))
+            res.append((os.path.getmtime(d), size, key))
+        return sorted(res)
+
+    def evict(self):
+        """Remove least recently used entries until below max_bytes"""
+        entries = self.entries()
+        total = sum(size for t, size, key in entries)
+        for t, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self.entry(key), ignore_errors=True)
+            total -= size
+            self.count('evictions')
+
+    def counters(self):
+        """Return the hit/miss/eviction counters"""
+        st = {'hits': 0, 'misses': 0, 'evictions': 0}
+        try:
+            with open(os.path.join(self.path, 'stats.json')) as f:
+                st.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        return st
+
+    def count(self, what):
+        """Increment a hit/miss/eviction counter"""
+        st = self.counters()
+        st[what] += 1
+        with open(os.path.join(self.path, 'stats.json'), 'w') as f:
+            json.dump(st, f)
+
+    def stats(self):
+        """Return hit/miss statistics and the size of the cache"""
+        st = self.counters()
+        entries = self.entries()
+        st['entries'] = len(entries)
+        st['bytes'] = sum(size for t, size, key in entries)
+        return st
+
+    def run(self, users, until, seed, workers=None, shards=None):
+        """
+        Simulate a fleet like runner.run_fleet, reusing stored results
+
+        Runs without a seed are not reproducible and never cached. The
+        result does not depend on the workers and shards, so they are not
+        part of the key.
+
+        Returns
+        -------
+        cdp : CDP
+
+        """
+        if seed is None:
+            return run_fleet(users, until, seed, workers, shards)
+        key = run_key(users, until, seed)
+        cdp = self.get(key)
+        if cdp is not None:
+            self.count('hits')
+            return cdp
+        self.count('misses')
+        cdp = run_fleet(users, until, seed, workers, shards)
+        self.put(key, cdp, {'users': len(users), 'until': until,
+                            'seed': seed})
+        return cdp
@@ -7,40 +7,625 @@ Created on Thu May 13 09:01:13 2021
 
 
 # %% Define Data Pool
-import matplotlib.pyplot as plt
+import importlib.util
+import itertools
+import os
 import numpy as np
 import pandas as pd
-import seaborn as sns
+import logsim.ttime as tt
+from logsim.sink import DiskSink, MemorySink
 pd.options.mode.chained_assignment = None
 
 
-# Data base as pandas dataframe
+# %% Features for analytics
+# Features are computed from aggregates of the DB columns pr user
+AGGREGATES = ['first', 'last', 'min', 'max', 'mean']
+FEATURES = {}
+secPyear = 365 * 3600
+
+
+def register_feature(name, columns, func):
+    """
+    Declare a feature for DataPool.create_features
+
+    Parameters
+    ----------
+    name : string
+    columns : list of string
+        DB columns the feature depends on
+    func : function
+        Gets the aggregates pr user as a DataFrame with (column, aggregate)
+        columns, aggregates as listed in AGGREGATES. Returns the feature
+        as a Series indexed by user.
+
+    Returns
+    -------
+    None.
+
+    """
+    FEATURES[name] = (columns, func)
+
+
+def increase(col):
+    """Feature: Increase of a counter over the period, pr year"""
+    return lambda a: (a[col, 'last'] - a[col, 'first']) / secPyear
+
+
+def rate(col):
+    """Feature: Increase of a counter pr hour of usage, NaN if no usage"""
+    def feature(a):
+        usage = a['usage', 'last'] - a['usage', 'first']
+        return (3600.0 * (a[col, 'last'] - a[col, 'first'])
+                / usage.where(usage != 0))
+    return feature
+
+
+register_feature('usage-pr-day', ['usage'],
+                 lambda a: a['usage', 'last'] / secPyear)
+register_feature('ovd-inc', ['ovd'], increase('ovd'))
+register_feature('speech-inc', ['speech'], increase('speech'))
+register_feature('ovd-snr-low-inc', ['ovd-snr-low'], increase('ovd-snr-low'))
+register_feature('ovd-snr-med-inc', ['ovd-snr-med'], increase('ovd-snr-med'))
+register_feature('ovd-snr-high-inc', ['ovd-snr-high'],
+                 increase('ovd-snr-high'))
+register_feature('vcUp-rate', ['vcUp', 'usage'], rate('vcUp'))
+register_feature('vcDwn-rate', ['vcDwn', 'usage'], rate('vcDwn'))
+
+
+# %% Derived columns of the diff'd DB
+# Daily usage (hours) below the threshold is low
+USAGE_THRESHOLD = 5.0
+# Normalized columns, averaged pr day by the rollups
+MEANS = ['Usage', 'Charge', 'Speech', 'OwnVoice', 'OVD-snr-low',
+         'OVD-snr-med', 'OVD-snr-high']
+
+
+def normalize(d):
+    """ Add normalized columns (hours, percentages) to diff'd data """
+    d['Usage'] = d['usage'] / 3600
+    d['Charge'] = d['charge'] / 3600
+    d['Speech'] = 100.0 * d['speech'] / d['usage']
+    d['OwnVoice'] = 100.0 * d['ovd'] / d['usage']
+    # OVD pr SNR?
+    if 'ovd-snr-low' in d.keys():
+        d['OVD-snr-low'] = 100.0 * d['ovd-snr-low'] / d['usage']
+        d['OVD-snr-med'] = 100.0 * d['ovd-snr-med'] / d['usage']
+        d['OVD-snr-high'] = 100.0 * d['ovd-snr-high'] / d['usage']
+
+
+def plot_columns(d):
+    """ Add coloring of usage data based on threshold """
+    d['Usage Low'] = d['Usage']
+    d['Usage OK'] = d['Usage']
+    d['Threshold'] = np.ones(d.shape[0]) * USAGE_THRESHOLD
+    d.loc[d['Usage'] >= USAGE_THRESHOLD, 'Usage Low'] = 0.0
+    d.loc[d['Usage'] < USAGE_THRESHOLD, 'Usage OK'] = 0.0
+
+
+# Derived column stages, in the order they are applied
+DERIVED = {'normalize': normalize, 'plot': plot_columns}
+
+
+def rollup_sums(d, grain, k_list):
+    """
+    Sums pr (id, period) of diff'd rows, see DataPool.rollup
+
+    Returns
+    -------
+    DataFrame indexed by (id, period start secs) with the sums of the
+    counters and the normalized columns, the number of values of each
+    normalized column ('<col> n'), the days and the low usage days
+
+    """
+    if 'Usage' not in d.keys():
+        raise ValueError('Rows without Usage (hours), rollups need '
+                         'normalized App rows, see normalize')
+    means = [c for c in MEANS if c in d.keys()]
+    cols = {'id': d['id'].to_numpy(),
+            'time': tt.times2period(d['time'].to_numpy(), grain),
+            'days': np.ones(len(d), dtype=np.int64),
+            'low-days': (d['Usage'] < USAGE_THRESHOLD).to_numpy(np.int64)}
+    for k in k_list + means:
+        cols[k] = d[k].to_numpy()
+    for k in means:
+        cols[k + ' n'] = d[k].notna().to_numpy(np.int64)
+    return pd.DataFrame(cols).groupby(['id', 'time']).sum()
+
+
+def row_keys(df):
+    """ Unique int64 key of the (id, power_cycle) of each row """
+    return (df['id'].to_numpy(np.int64) << 32) \
+        + df['power_cycle'].to_numpy(np.int64)
+
+
+# %% Binary storage
+# File extension and pyarrow dataset format pr storage format
+FORMATS = {'parquet': ('parquet', 'parquet'),
+           'feather': ('feather', 'ipc'),
+           'csv': ('csv', None)}
+# Storage types of the time columns, other columns keep their dtype
+COLUMN_TYPES = {'time': 'int64', 'date': 'string'}
+# Rows pr row group of Parquet files
+ROW_GROUP = 2**16
+
+
+def storage_schema(df):
+    """ Explicit pyarrow schema for storing a DB DataFrame """
+    # pyarrow is only imported when storing, see require_pyarrow
+    import pyarrow as pa
+    fields = []
+    for k in df.keys():
+        if k in COLUMN_TYPES:
+            t = COLUMN_TYPES[k]
+        elif pd.api.types.is_integer_dtype(df[k]) \
+                or pd.api.types.is_float_dtype(df[k]):
+            # Compact columns stay compact, e.g. int32 counters
+            t = pa.from_numpy_dtype(df[k].dtype)
+        else:
+            t = 'string'
+        fields.append(pa.field(k, t))
+    return pa.schema(fields)
+
+
+# %% Column types
+def merge_schemas(schema, other):
+    """ Schema holding the columns of both, in the wider type of both """
+    res = dict(schema)
+    for k, t in other.items():
+        res[k] = np.promote_types(res[k], t) if k in res else t
+    return res
+
+
+def apply_schema(df, schema, name='DB'):
+    """
+    Cast the columns of a DataFrame to the types of a schema
+
+    Parameters
+    ----------
+    df : DataFrame
+    schema : dict of {column: numpy.dtype}
+    name : string, optional
+        Name of the DB, for the error message. The default is 'DB'.
+
+    Returns
+    -------
+    DataFrame
+
+    """
+    types = {}
+    for k in df.keys():
+        if k not in schema:
+            raise ValueError('Column {} is not in the schema of {}'.format(
+                k, name))
+        t = schema[k]
+        if df[k].dtype == t:
+            continue
+        # Columns missing in some rows (NaN) stay float
+        if pd.api.types.is_float_dtype(df[k]) and t.kind in 'iu' \
+                and df[k].isna().any():
+            continue
+        types[k] = t
+    return df.astype(types) if types else df
+
+
+# %% Time columns
+# DB's record the time as epoch secs, readable time/date strings are only
+# derived in bulk for export and plotting
+def with_dates(df):
+    """ Copy of 'df' with readable 'time' and 'date' columns """
+    if 'time' not in df.keys() or not \
+            pd.api.types.is_integer_dtype(df['time']):
+        return df
+    t = df['time'].to_numpy()
+    df = df.copy()
+    df['time'] = tt.times2str(t)
+    df.insert(df.columns.get_loc('time') + 1, 'date', tt.times2date(t))
+    return df
+
+
+def without_dates(df):
+    """ Convert readable 'time' back to epoch secs and drop 'date' """
+    # Strings read from CSV are object or string typed, by pandas version
+    if 'time' in df.keys() and (pd.api.types.is_object_dtype(df['time'])
+                                or pd.api.types.is_string_dtype(df['time'])):
+        df['time'] = tt.strs2time(df['time'])
+    if 'date' in df.keys():
+        df = df.drop(columns=['date'])
+    return df
+
+
+def date_bounds(dates):
+    """ Epoch secs [start, end) of a (first date, last date) range """
+    last = str(np.datetime64(dates[1]) + np.timedelta64(1, 'D'))
+    return tt.date2time(dates[0]), tt.date2time(last)
+
+
+def require_pyarrow(fmt):
+    """ Check that the storage format is available """
+    if fmt not in FORMATS:
+        raise ValueError('Unknown storage format: ' + fmt)
+    if fmt != 'csv' and importlib.util.find_spec('pyarrow') is None:
+        raise ImportError('Storage format {} requires pyarrow'.format(fmt))
+
+
+# %% Per user index
+class UserIndex:
+    """Class holding a DB sorted by (id, power_cycle), rows found pr id"""
+
+    def __init__(self, df):
+        """
+        Constructor of a UserIndex, sorts the DB unless already sorted
+
+        Parameters
+        ----------
+        df : DataFrame with 'id' and 'power_cycle' columns
+
+        Returns
+        -------
+        None.
+
+        """
+        self.source = df
+        self.columns = list(df.keys())
+        keys = row_keys(df) if not df.empty else np.zeros(0, np.int64)
+        if len(keys) > 1 and (keys[1:] < keys[:-1]).any():
+            order = np.argsort(keys, kind='stable')
+            self.df = df.iloc[order]
+            keys = keys[order]
+        else:
+            self.df = df
+        ids = keys >> 32
+        # Row range [first, last) of every id
+        self.ids, self.first = np.unique(ids, return_index=True)
+        self.last = np.append(self.first[1:], len(keys))
+        self.power_cycle = keys & 0xFFFFFFFF
+        # Rows in time order, built by the first date query
+        self._time_order = None
+        self._times = None
+
+    def matches(self, df):
+        """ Check if the index is still valid for 'df' """
+        return df is self.source and len(df) == len(self.df) \
+            and list(df.keys()) == self.columns
+
+    def rows(self, id, start=None, end=None):
+        """ Row range [a, b) of user 'id' with start <= power_cycle < end """
+        k = np.searchsorted(self.ids, id)
+        if k == len(self.ids) or self.ids[k] != id:
+            return 0, 0
+        a, b = self.first[k], self.last[k]
+        pc = self.power_cycle[a:b]
+        lo = a if start is None else a + np.searchsorted(pc, start)
+        hi = b if end is None else a + np.searchsorted(pc, end)
+        return int(lo), int(hi)
+
+    def user(self, id, start=None, end=None, dates=None):
+        """ Rows of user 'id', see DataPool.get_user """
+        a, b = self.rows(id, start, end)
+        d = self.df.iloc[a:b]
+        if dates is not None:
+            t0, t1 = date_bounds(dates)
+            t = d['time'].to_numpy()
+            d = d.loc[(t >= t0) & (t < t1)]
+        return d
+
+    def users(self, ids):
+        """ Rows of the users 'ids', see DataPool.get_users """
+        ranges = [self.rows(i) for i in sorted(set(ids))]
+        pos = np.concatenate([np.arange(a, b) for a, b in ranges] +
+                             [np.zeros(0, np.int64)])
+        return self.df.iloc[pos]
+
+    def dates(self, dates):
+        """ Rows within a date range, see DataPool.get_dates """
+        if 'time' not in self.columns:
+            raise ValueError('DB without times, no date queries')
+        if self._time_order is None:
+            self._time_order = np.argsort(self.df['time'].to_numpy(),
+                                          kind='stable')
+            self._times = self.df['time'].to_numpy()[self._time_order]
+        t0, t1 = date_bounds(dates)
+        a, b = np.searchsorted(self._times, [t0, t1])
+        return self.df.iloc[np.sort(self._time_order[a:b])]
+
+
+# %% Data base as pandas dataframe
 class DataPool:
     """Class holding a DB (based on a Pandas DataFrame)"""
 
-    def __init__(self, name, monthly=False):
-        """ Constructor of a DB (based on a Pandas DataFrame) """
+    def __init__(self, name, monthly=False, chunk_rows=4096, sink=None):
+        """
+        Constructor of a DB (based on a Pandas DataFrame)
+
+        Parameters
+        ----------
+        name : string
+        monthly : bool, optional
+            The default is False.
+        chunk_rows : int, optional
+            Number of rows buffered before they are handed to the sink as
+            a DataFrame chunk. The default is 4096.
+        sink : MemorySink or DiskSink, optional
+            Receiver of the chunks. The default is a MemorySink, a
+            DiskSink spills the chunks to disk during the simulation.
+
+        Returns
+        -------
+        None.
+
+        """
         self.name = name
-        self.df = pd.DataFrame()
+        self._df = pd.DataFrame()
         self.ddiff = pd.DataFrame()
         self.dfeat = pd.DataFrame()
+        # Incremental diff state, see diff_data: derived stages applied,
+        # (id, power_cycle) keys seen, last row pr id (the watermark) and
+        # number of rows processed. 'dirty' forces a full recompute.
+        self._derived = []
+        self._seen = set()
+        self._last = pd.DataFrame()
+        self._columns = []
+        self._k_list = []
+        self._int_cols = set()
+        self._n_done = 0
+        self._dirty = True
+        # Per user indexes of df and ddiff, see index()
+        self._indexes = {}
         self.monthly = monthly
+        # Ingestion buffer: rows are collected in a list and turned into
+        # DataFrame chunks of 'chunk_rows' rows, stored by the sink. The
+        # chunks are only concatenated into 'df' when somebody reads it.
+        self.chunk_rows = chunk_rows
+        self._rows = []
+        self._pending = []
+        self.sink = sink if sink else MemorySink()
+        # Column types enforced on the chunks, see declare()
+        self.schema = None
+        self._declared = None
+
+    @property
+    def df(self):
+        """ The DB as a DataFrame, materialized on demand """
+        if self._rows or self._pending or not self.sink.empty():
+            self._materialize()
+        return self._df
+
+    @df.setter
+    def df(self, df):
+        """ Replace the DB content """
+        self._df = df
+        self._rows = []
+        self._pending = []
+        self.sink.discard()
+        # The diff'd data no longer matches
+        self._dirty = True
+
+    @property
+    def ddiff(self):
+        """ The diff'd DB as a DataFrame, appended parts joined on demand """
+        if self._ddiff_parts:
+            parts = self._ddiff_parts
+            if not self._ddiff.empty:
+                parts = [self._ddiff] + parts
+            self._ddiff = pd.concat(parts, ignore_index=True)
+            self._ddiff_parts = []
+        return self._ddiff
+
+    @ddiff.setter
+    def ddiff(self, ddiff):
+        """ Replace the diff'd DB """
+        self._ddiff = ddiff
+        self._ddiff_parts = []
+        # Rollups of the rows appended from now on, see rollup()
+        self._rollups = {}
+
+    def declare(self, schema):
+        """
+        Declare the types of columns put from now on
+
+        Declaring more columns widens the schema, e.g. for HIs of another
+        configuration. Chunks are cast to the schema as they are formed.
+
+        Parameters
+        ----------
+        schema : dict of {column: numpy.dtype}
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.schema is None:
+            self.schema = dict(schema)
+        elif schema is not self._declared:
+            self.schema = merge_schemas(self.schema, schema)
+        self._declared = schema
+
+    def _chunk(self, df):
+        """ A chunk of rows in the declared column types """
+        if self.schema is None:
+            return df
+        return apply_schema(df, self.schema, self.name)
+
+    def _flush_rows(self):
+        """ Turn the buffered rows into a DataFrame chunk """
+        if self._rows:
+            self.sink.write(self._chunk(pd.DataFrame(self._rows)))
+            self._rows = []
+
+    def _take(self):
+        """ Collect the chunks of the sink, not yet joined onto 'df' """
+        self._flush_rows()
+        self._pending.extend(self.sink.take())
+
+    def _materialize(self):
+        """ Concatenate buffered chunks onto the DataFrame """
+        self._take()
+        chunks = self._pending
+        if not self._df.empty:
+            chunks = [self._df] + chunks
+        self._df = pd.concat(chunks, ignore_index=True)
+        self._pending = []
+
+    def _new_rows(self):
+        """ Rows put since the last diff, without joining the DB """
+        self._take()
+        new = []
+        pos = 0
+        for f in [self._df] + self._pending:
+            if pos + len(f) > self._n_done:
+                new.append(f.iloc[max(0, self._n_done - pos):])
+            pos += len(f)
+        self._n_done = pos
+        return pd.concat(new, ignore_index=True) if new else None
+
+    def flush(self):
+        """ Hand the buffered rows to the sink, e.g. at end of a run """
+        self._flush_rows()
+
+    def chunks(self):
+        """ The DB as DataFrame chunks, read one at a time without joining """
+        self._flush_rows()
+        if not self._df.empty:
+            yield self._df
+        yield from self._pending
+        yield from self.sink.read()
+
+    def _stored_chunks(self):
+        """
+        The DB as chunks of the same columns, for storing them one at a
+        time
+
+        Spilled chunks (logsim.sink.DiskSink) are stored without joining
+        them in memory. Columns declared after a chunk was formed are NaN
+        in it, as when joined. Without a declared schema the columns are
+        only known once joined, the DB is joined first.
+
+        Returns
+        -------
+        template : empty DataFrame of the columns and their types
+        chunks : iterator of DataFrame
+
+        """
+        chunks = self.chunks() if self.schema is not None else iter([])
+        first = next(chunks, None)
+        if first is None:
+            df = self.df
+            return df.iloc[:0], iter([df])
+        columns = list(first.keys()) + [k for k in self.schema
+                                        if k not in first]
+        template = pd.DataFrame({k: pd.Series(dtype=self.schema[k]
+                                              if k in self.schema
+                                              else first[k].dtype)
+                                 for k in columns})
+        return template, (c if list(c.keys()) == columns
+                          else c.reindex(columns=columns)
+                          for c in itertools.chain([first], chunks))
+
+    # Per user queries
+    def index(self, diffed=False):
+        """
+        Index of the DB by user, built again when the DB has changed
+
+        Parameters
+        ----------
+        diffed : bool, optional
+            Index the diff'd DB instead. The default is False.
+
+        Returns
+        -------
+        UserIndex
+
+        """
+        df = self.ddiff if diffed else self.df
+        idx = self._indexes.get(diffed)
+        if idx is None or not idx.matches(df):
+            idx = self._indexes[diffed] = UserIndex(df)
+        return idx
+
+    def get_user(self, id, start=None, end=None, dates=None):
+        """
+        Rows of a user, found in O(log n)
+
+        Parameters
+        ----------
+        id : int
+        start, end : int, optional
+            Power cycles [start, end) of the rows. The default is all.
+        dates : (string, string), optional
+            First and last date of the rows, e.g. ('2020-03-01',
+            '2020-03-31'). The default is all dates.
+
+        Returns
+        -------
+        DataFrame sorted by power_cycle, a slice of the index: copy it
+        before changing it
+
+        """
+        return self.index().user(id, start, end, dates)
+
+    def get_users(self, ids):
+        """ Rows of the users 'ids', sorted by (id, power_cycle) """
+        return self.index().users(ids)
+
+    def get_dates(self, dates):
+        """
+        Rows of all users within a date range, found in O(log n)
+
+        Parameters
+        ----------
+        dates : (string, string)
+            First and last date, e.g. ('2020-03-01', '2020-03-31').
+
+        Returns
+        -------
+        DataFrame sorted by (id, power_cycle)
+
+        """
+        return self.index().dates(dates)
 
     def put(self, data):
         """ Add a new entry to the DB """
-        if self.df.empty:
-            self.df = pd.DataFrame([data])
+        # Copy, the caller may reuse the dict for the next sample
+        self._rows.append(dict(data))
+        if len(self._rows) >= self.chunk_rows:
+            self._flush_rows()
+
+    def put_many(self, data):
+        """ Add a number of entries (dicts or a DataFrame) to the DB """
+        if isinstance(data, pd.DataFrame):
+            # Keep the order of rows put before this call
+            self._flush_rows()
+            if not data.empty:
+                self.sink.write(self._chunk(data.reset_index(drop=True)))
         else:
-            self.df = self.df.append(data, ignore_index=True)
+            self._rows.extend(dict(d) for d in data)
+            if len(self._rows) >= self.chunk_rows:
+                self._flush_rows()
+
+    def memory(self):
+        """ Bytes of the DB in memory, strings included """
+        return int(self.df.memory_usage(index=False, deep=True).sum())
 
     def isEmpty(self):
         """ Check if DB is empty """
-        return self.df.empty
+        return self._df.empty and not self._rows and not self._pending \
+            and self.sink.empty()
 
     # Save DB as CSV
     def saveAsCSV(self, ver='00'):
-        """ Save DB as a CSV file """
-        self.df.to_csv(self.name + '_' + ver + '.csv')
+        """ Save DB as a CSV file, with readable times """
+        template, chunks = self._stored_chunks()
+        # Appended chunk by chunk, numbered as the joined DB
+        with open(self.name + '_' + ver + '.csv', 'w', newline='') as f:
+            start = 0
+            for df in chunks:
+                df = with_dates(df)
+                df.index = pd.RangeIndex(start, start + len(df))
+                df.to_csv(f, header=not start)
+                start += len(df)
+            if not start:
+                with_dates(template).to_csv(f)
 
     # Load DB from CSV
     def loadAsCSV(self, ver='00'):
@@ -48,10 +633,127 @@ class DataPool:
         # print('LOADING CSV FILE: ' + self.name)
         try:
             fname = self.name + '_' + ver + '.csv'
-            self.df = pd.read_csv(fname, index_col=[0])
+            self.df = without_dates(pd.read_csv(fname, index_col=[0]))
         except FileNotFoundError:
             print('No file: ' + fname)
 
+    # Save DB in a binary format
+    def save(self, ver='00', fmt='parquet'):
+        """
+        Save DB as a Parquet/Feather file, or as CSV for export
+
+        The chunks of the DB are written one at a time, a spilled DB is
+        not joined in memory.
+
+        Parameters
+        ----------
+        ver : string, optional
+            Version of the file. The default is '00'.
+        fmt : string, optional
+            'parquet', 'feather' or 'csv'. The default is 'parquet'.
+
+        Returns
+        -------
+        None.
+
+        """
+        require_pyarrow(fmt)
+        if fmt == 'csv':
+            return self.saveAsCSV(ver)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # Times are stored as epoch secs
+        fname = self.name + '_' + ver + '.' + FORMATS[fmt][0]
+        template, chunks = self._stored_chunks()
+        schema = storage_schema(template)
+        tables = (pa.Table.from_pandas(df, schema=schema,
+                                       preserve_index=False)
+                  for df in chunks)
+        if fmt == 'feather':
+            # Feather V2 is the Arrow IPC file format
+            codec = 'lz4' if pa.Codec.is_available('lz4') else None
+            with pa.ipc.new_file(fname, schema, options=pa.ipc.
+                                 IpcWriteOptions(compression=codec)) as w:
+                for table in tables:
+                    w.write_table(table)
+            return
+        # Row groups allow skipping data when filtering on load, small
+        # chunks are joined to full row groups
+        with pq.ParquetWriter(fname, schema) as w:
+            group = []
+            for table in tables:
+                group.append(table)
+                if sum(len(t) for t in group) >= ROW_GROUP:
+                    w.write_table(pa.concat_tables(group), ROW_GROUP)
+                    group = []
+            if group:
+                w.write_table(pa.concat_tables(group), ROW_GROUP)
+
+    # Load DB from a binary format
+    def load(self, ver='00', fmt='parquet', columns=None, ids=None,
+             dates=None):
+        """
+        Load DB from a Parquet/Feather file (or CSV), reading only the
+        needed slice
+
+        Parameters
+        ----------
+        ver : string, optional
+            Version of the file. The default is '00'.
+        fmt : string, optional
+            'parquet', 'feather' or 'csv'. The default is 'parquet'.
+        columns : list of string, optional
+            Columns to load. The default is all columns.
+        ids : list of int, optional
+            Users to load. The default is all users.
+        dates : (string, string), optional
+            First and last date to load, e.g. ('2020-03-01', '2020-03-31').
+            The default is all dates.
+
+        Returns
+        -------
+        None.
+
+        """
+        require_pyarrow(fmt)
+        fname = self.name + '_' + ver + '.' + FORMATS[fmt][0]
+        if fmt == 'csv':
+            try:
+                keys = pd.read_csv(fname, index_col=[0], nrows=0).keys()
+            except FileNotFoundError:
+                print('No file: ' + fname)
+                return
+            # CSV can only be filtered after parsing, on its readable dates
+            columns = [c for c in (columns if columns else keys)
+                       if c in keys]
+            need = columns + (['id'] if ids is not None else []) \
+                + (['date'] if dates is not None else [])
+            df = pd.read_csv(fname, usecols=lambda c: c in need)
+            if ids is not None:
+                df = df.loc[df['id'].isin(ids)]
+            if dates is not None:
+                df = df.loc[(df['date'] >= dates[0])
+                            & (df['date'] <= dates[1])]
+            self.df = without_dates(df[columns].reset_index(drop=True))
+            return
+        import pyarrow.dataset as ds
+        try:
+            dataset = ds.dataset(fname, format=FORMATS[fmt][1])
+        except FileNotFoundError:
+            print('No file: ' + fname)
+            return
+        # Predicates are pushed down to the file reader
+        filt = None
+        if ids is not None:
+            filt = ds.field('id').isin(list(ids))
+        if dates is not None:
+            start, end = date_bounds(dates)
+            d = (ds.field('time') >= start) & (ds.field('time') < end)
+            filt = d if filt is None else filt & d
+        if columns:
+            columns = [c for c in columns if c in dataset.schema.names]
+        self.df = dataset.to_table(columns=columns, filter=filt).to_pandas()
+
     def clean_data(self):
         """ Create the silver buckets from RAW bronze data """
         # Sort by if and day
@@ -60,50 +762,114 @@ class DataPool:
         self.df.drop_duplicates(subset=['id', 'power_cycle'], inplace=True)
 
     def diff_data(self):
-        """ Differentiate counters"""
-        if self.ddiff.empty:
-            # Clean data first
-            self.clean_data()
-
-            # Which columns to differentiate
-            k_list = [x for x in list(self.df.keys())
-                      if x not in ['id', 'power_cycle', 'time',
-                                   'date', 'usage-at-time']]
-            # Get list of ID's
-            id_list = list(self.df['id'].unique())
-            # Diff the relevant data
-            self.ddiff = self.df.copy()
-            self.ddiff.drop(
-                self.ddiff.loc[self.ddiff['power_cycle'] == 0].index,
-                inplace=True)
-
-            # Loop over all ID's
-            for id in id_list:
-                self.ddiff.loc[self.ddiff['id'] == id, k_list] = \
-                    self.df.loc[self.df['id'] == id, k_list]\
-                        .diff().iloc[1:].astype(int)
+        """
+        Differentiate counters, incrementally
+
+        The first call cleans and diffs the whole DB. Later calls only diff
+        the rows put since: rows with an (id, power_cycle) already seen are
+        dropped, the rest are diffed against the last row of their id, and
+        appended to 'ddiff' with the derived columns already created. Rows
+        older than the last row of their id, a change of columns or a
+        replaced DB trigger a full recompute.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self._dirty:
+            self._full_diff()
+            return
+        new = self._new_rows()
+        if new is None or new.empty:
+            return
+        if list(new.keys()) != self._columns:
+            return self._full_diff()
+        # Drop duplicates of rows already diff'd, and within the new rows
+        keys = row_keys(new)
+        seen = self._seen
+        keep = ~pd.Index(keys).duplicated() \
+            & np.fromiter((k not in seen for k in keys.tolist()), bool,
+                          len(keys))
+        new = new.loc[keep]
+        if new.empty:
+            return
+        # Rows behind the watermark of their id need a full recompute
+        wm = self._last['power_cycle'].reindex(new['id']).to_numpy()
+        if (new['power_cycle'].to_numpy() <= wm).any():
+            return self._full_diff()
+        seen.update(keys[keep].tolist())
+        new = new.sort_values(by=['id', 'power_cycle'], kind='stable')
+        # Diff against the last row of each id
+        prev = self._last.loc[self._last.index.intersection(
+            new['id'].unique())]
+        both = pd.concat([prev, new], ignore_index=True)
+        d = both.copy()
+        d[self._k_list] = both.groupby('id', sort=False)[self._k_list].diff()
+        d = d.iloc[len(prev):]
+        d = d.loc[d['power_cycle'] != 0]
+        # Counters are integers, unless a first entry is left (NaN)
+        for k in self._k_list:
+            if d[k].isna().any():
+                if k in self._int_cols:
+                    self._int_cols.remove(k)
+                    self.ddiff[k] = self.ddiff[k].astype(float)
+            elif k in self._int_cols:
+                d[k] = d[k].astype(int)
+        for stage in self._derived:
+            DERIVED[stage](d)
+        self._ddiff_parts.append(d)
+        # Move the watermarks
+        last = new.drop_duplicates('id', keep='last').set_index('id',
+                                                                drop=False)
+        self._last = pd.concat([self._last.drop(last.index, errors='ignore'),
+                                last])
+
+    def _full_diff(self):
+        """ Clean and differentiate the whole DB """
+        if self.isEmpty():
+            return
+        # Clean data first, sorted by (id, power_cycle)
+        self.clean_data()
+
+        # Which columns to differentiate
+        k_list = [x for x in list(self.df.keys())
+                  if x not in ['id', 'power_cycle', 'time',
+                               'date', 'usage-at-time']]
+        # Diff the relevant data pr ID in one grouped pass,
+        # the first entry of each ID has nothing to diff against
+        ddiff = self.df.copy()
+        ddiff[k_list] = self.df.groupby('id', sort=False)[k_list].diff()
+        ddiff = ddiff.loc[ddiff['power_cycle'] != 0]
+        # Counters are integers, unless a first entry is left (NaN)
+        self._int_cols = set()
+        for k in k_list:
+            if not ddiff[k].isna().any():
+                ddiff[k] = ddiff[k].astype(int)
+                self._int_cols.add(k)
+        for stage in self._derived:
+            DERIVED[stage](ddiff)
+        self.ddiff = ddiff
+
+        # Index of the diff'd rows for the incremental updates
+        self._k_list = k_list
+        self._columns = list(self.df.keys())
+        self._seen = set(row_keys(self.df).tolist())
+        self._last = self.df.drop_duplicates('id', keep='last').set_index(
+            'id', drop=False)
+        self._n_done = len(self.df)
+        self._dirty = False
 
     # Normalize dats
     def normalize_data(self):
         """ Normalize Data"""
         # Need diff'd data
         self.diff_data()
-        # Check if already normalized
-        if 'Usage' not in self.ddiff.keys():
-            self.ddiff['Usage'] = self.ddiff['usage'] / 3600
-            self.ddiff['Charge'] = self.ddiff['charge'] / 3600
-            self.ddiff['Speech'] = 100.0 * self.ddiff['speech'] \
-                / self.ddiff['usage']
-            self.ddiff['OwnVoice'] = 100.0 * self.ddiff['ovd'] \
-                / self.ddiff['usage']
-            # OVD pr SNR?
-            if 'ovd-snr-low' in self.ddiff.keys():
-                self.ddiff['OVD-snr-low'] = 100.0 * self.ddiff['ovd-snr-low'] \
-                    / self.ddiff['usage']
-                self.ddiff['OVD-snr-med'] = 100.0 * self.ddiff['ovd-snr-med'] \
-                    / self.ddiff['usage']
-                self.ddiff['OVD-snr-high'] = 100.0 * self.ddiff['ovd-snr-high'] \
-                    / self.ddiff['usage']
+        # Check if already normalized, new rows are then normalized by
+        # diff_data
+        if 'normalize' not in self._derived:
+            normalize(self.ddiff)
+            self._derived.append('normalize')
 
     # Prepare Plot data
     def prepare_plot_data(self):
@@ -111,12 +877,58 @@ class DataPool:
         # Need normalized data
         self.normalize_data()
         # Prepare coloring of usage data based on threshold
-        if 'Usage Low' not in self.ddiff.keys():
-            self.ddiff['Usage Low'] = self.ddiff['Usage']
-            self.ddiff['Usage OK'] = self.ddiff['Usage']
-            self.ddiff['Threshold'] = np.ones(self.ddiff.shape[0]) * 5
-            self.ddiff.loc[self.ddiff['Usage'] >= 5.0, 'Usage Low'] = 0.0
-            self.ddiff.loc[self.ddiff['Usage'] < 5.0, 'Usage OK'] = 0.0
+        if 'plot' not in self._derived:
+            plot_columns(self.ddiff)
+            self._derived.append('plot')
+
+    # Calendar rollups
+    def rollup(self, grain='month', user_id=None):
+        """
+        Rollup of the daily DB pr user and calendar period, refreshed
+        incrementally
+
+        Sums of the diff'd rows are kept pr grain. Rows diff'd since the
+        last call are added to the sums of their periods, a full diff of
+        the DB starts over.
+
+        Parameters
+        ----------
+        grain : string, optional
+            'week' (from Monday), 'month' or 'year', local calendar. The
+            default is 'month'.
+        user_id : int, optional
+            Only the periods of this user, found in the sorted index of the
+            sums. The default is None (all users).
+
+        Returns
+        -------
+        DataFrame sorted by (id, time), 'time' is the start of the period
+        (secs). Columns: days with data, 'low-days' with usage below
+        USAGE_THRESHOLD, the sums of the counters and the mean pr day of
+        the normalized columns (hours and percentages)
+
+        """
+        if self.isEmpty():
+            return pd.DataFrame()
+        self.normalize_data()
+        d = self.ddiff
+        if 'time' not in d.keys():
+            raise ValueError('DB without times, no calendar rollups')
+        sums, done = self._rollups.get(grain, (None, 0))
+        if sums is None or len(d) > done:
+            new = rollup_sums(d.iloc[done:], grain, self._k_list)
+            if sums is not None:
+                # Periods with new days get their sums added
+                new = pd.concat([sums, new]).groupby(level=[0, 1]).sum()
+            sums, done = new, len(d)
+            self._rollups[grain] = (sums, done)
+        if user_id is not None:
+            sums = sums.loc[user_id:user_id]
+        r = sums[['days', 'low-days'] + self._k_list].reset_index()
+        for k in MEANS:
+            if k in sums.keys():
+                r[k] = (sums[k] / sums[k + ' n']).to_numpy()
+        return r
 
     # Plot daily data
     def plot_daily(self, user_id=0, days=31, last_day=-1):
@@ -124,23 +936,24 @@ class DataPool:
         # Prepare coloring of usage data based on threshold
         self.prepare_plot_data()
         # Narrow scope for plot
-        dp = self.ddiff[self.ddiff['id'] == user_id].iloc[last_day
-                                                          - days:last_day]
+        dp = self.index(diffed=True).user(user_id).iloc[last_day
+                                                        - days:last_day]
         self.plot_data(dp, user_id)
 
     # Plot monthly data
-    def plot_monthly(self, user_id=0, month=30):
-        """ Plot most important Monthly data """
-        # Prepare coloring of usage data based on threshold
-        self.prepare_plot_data()
-        # Narrow scope for plot
-        dp = self.ddiff[self.ddiff['id'] == user_id].iloc[::month]
-
+    def plot_monthly(self, user_id=0):
+        """ Plot most important Monthly data, a bar pr calendar month """
+        dp = self.rollup('month', user_id)
+        # Color the mean daily usage of the months
+        plot_columns(dp)
         self.plot_data(dp, user_id)
 
     # Plot data
     def plot_data(self, dp, user_id=0):
+        # Plotting libraries are only loaded when plotting
+        import matplotlib.pyplot as plt
         # Check for date
+        dp = with_dates(dp)
         x_col = 'date'
         x_label = 'Date'
         if x_col not in dp.keys():
@@ -183,31 +996,33 @@ class DataPool:
         plt.xticks(rotation=90)
 
     # Create features for analytics
-    def create_features(self):
-        """ Create DataFrame for holding features"""
-        self.dfeat = pd.DataFrame(data=sorted(self.df['id'].unique()),
-                                  columns=['user_id'])
-
-        # Prepare features
-        features = ['usage-pr-day', 'ovd-inc', 'speech-inc', 'ovd-snr-low-inc']
-        zeros = np.zeros((len(self.dfeat), len(features)))
-        self.dfeat = self.dfeat.join(pd.DataFrame(data=zeros,
-                                                  columns=features))
-        self.dfeat.set_index('user_id', inplace=True)
-
-        # Extract features for each client
-        secPyear = 365 * 3600
-        for i, row in self.dfeat.iterrows():
-            di = self.df.loc[self.df['id'] == i]
-            row['usage-pr-day'] = di.iloc[-1]['usage'] / secPyear
-            # row['charge'] = di.iloc[-1]['charge'] / secPyear
-            row['ovd-inc'] = \
-                (di.iloc[-1]['ovd'] - di.iloc[0]['ovd']) / secPyear
-            row['speech-inc'] = \
-                (di.iloc[-1]['speech'] - di.iloc[0]['speech']) / secPyear
-            row['ovd-snr-low-inc'] = \
-                (di.iloc[-1]['ovd-snr-low'] - di.iloc[0]['ovd-snr-low'])\
-                / secPyear
+    def create_features(self, features=None):
+        """
+        Create DataFrame holding features pr user
+
+        Parameters
+        ----------
+        features : list of string, optional
+            Names of registered features, see register_feature. The
+            default is all features available from the DB columns.
+
+        Returns
+        -------
+        None.
+
+        """
+        if features is None:
+            features = [f for f in FEATURES
+                        if set(FEATURES[f][0]) <= set(self.df.keys())]
+        # Aggregate all needed columns pr user in one grouped pass
+        cols = []
+        for f in features:
+            cols += [c for c in FEATURES[f][0] if c not in cols]
+        agg = self.df.groupby('id')[cols].agg(AGGREGATES)
+        # Extract features for all users
+        self.dfeat = pd.DataFrame({f: FEATURES[f][1](agg)
+                                   for f in features})
+        self.dfeat.index.name = 'user_id'
 
     # Plot features
     def plot_features(self):
@@ -215,6 +1030,7 @@ class DataPool:
         # Create features if not already done
         if self.dfeat.empty:
             self.create_features()
+        import seaborn as sns
         # Create pairplot to analyze correlations
         sns.color_palette("tab10")
         sns.pairplot(self.dfeat, hue="ovd-inc")
@@ -224,12 +1040,84 @@ class DataPool:
 class CDP:
     """Class holding a number of DBs - Common Data Platform """
 
-    def __init__(self):
-        """ CDP Constructor """
-        self.app_daily = DataPool('app_daily')
-        self.app_hourly = DataPool('app_hourly')
-        self.fsw_daily = DataPool('fsw_daily')
-        self.fsw_monthly = DataPool('fsw_monthly')
+    def __init__(self, spill=None, typed=True):
+        """
+        CDP Constructor
+
+        Parameters
+        ----------
+        spill : string, optional
+            Directory to spill the DB chunks to during the simulation, one
+            subdirectory pr DB. Reopening the directory after the run reads
+            the spilled DB's. The default is None (keep DB's in memory).
+        typed : bool, optional
+            Store the columns in the types declared by the HIs, see
+            declare(). Else the types are inferred from the samples. The
+            default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.typed = typed
+        self.app_daily = DataPool('app_daily',
+                                  sink=self.sink(spill, 'app_daily'))
+        self.app_hourly = DataPool('app_hourly',
+                                   sink=self.sink(spill, 'app_hourly'))
+        self.fsw_daily = DataPool('fsw_daily',
+                                  sink=self.sink(spill, 'fsw_daily'))
+        self.fsw_monthly = DataPool('fsw_monthly',
+                                    sink=self.sink(spill, 'fsw_monthly'))
+
+    @staticmethod
+    def sink(spill, name):
+        """ Sink of a DB, on disk if a spill directory is given """
+        return DiskSink(os.path.join(spill, name)) if spill else None
+
+    def declare(self, schemas):
+        """
+        Declare the column types of the DB's, see DataPool.declare
+
+        Parameters
+        ----------
+        schemas : dict of {DB name: dict of {column: numpy.dtype}}
+            As given by logsim.hi.pool_schemas.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.typed:
+            for name, schema in schemas.items():
+                getattr(self, name).declare(schema)
+
+    def memory_report(self):
+        """
+        Rows and bytes in memory of all DB's, as a DataFrame
+
+        Spilled DB's are not read into memory to be reported, only the
+        bytes of their chunks on disk are ('bytes on disk').
+        """
+        rows = {}
+        for dp in self.pools():
+            if isinstance(dp.sink, DiskSink):
+                rows[dp.name] = {'rows': np.nan, 'columns': np.nan,
+                                 'bytes': np.nan, 'bytes pr row': np.nan,
+                                 'bytes on disk': dp.sink.size()}
+                continue
+            n = len(dp.df)
+            b = dp.memory()
+            rows[dp.name] = {'rows': n, 'columns': len(dp.df.keys()),
+                             'bytes': b, 'bytes pr row': b / n if n else 0,
+                             'bytes on disk': 0}
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+    def flush(self):
+        """ Hand buffered rows of all DB's to their sinks """
+        for dp in self.pools():
+            dp.flush()
 
     # Save all DB as CSV
     def saveAsCSV(self, ver='00'):
@@ -244,9 +1132,29 @@ class CDP:
         """ Load all DB's from CSV files"""
         self.app_daily.loadAsCSV(ver)
         self.app_hourly.loadAsCSV(ver)
-        self.fsw_daily.saveAsCSV(ver)
+        self.fsw_daily.loadAsCSV(ver)
         self.fsw_monthly.loadAsCSV(ver)
 
+    # Save all DB in a binary format
+    def save(self, ver='00', fmt='parquet'):
+        """ Save all DB's as Parquet/Feather files, or as CSV for export"""
+        for dp in self.pools():
+            dp.save(ver, fmt)
+
+    # Load all DB from a binary format
+    def load(self, ver='00', fmt='parquet', columns=None, ids=None,
+             dates=None):
+        """ Load all DB's, see DataPool.load"""
+        for dp in self.pools():
+            # Date filter only applies to DB's with dates
+            dp.load(ver, fmt, columns, ids,
+                    dates if dp.name.startswith('app') else None)
+
+    def pools(self):
+        """ List of all DB's """
+        return [self.app_daily, self.app_hourly,
+                self.fsw_daily, self.fsw_monthly]
+
     def getAppDaily(self):
         """ Get Daily App DB """
         return self.app_daily
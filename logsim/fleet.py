@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized fleet simulator, an alternative to the SimPy engine.
+
+All sessions of all HIs sharing a configuration are drawn as arrays and
+the RAM/NVRAM counters seen by the App and the FSW are computed in closed
+form. The result is the same four CDP pools as produced by HI, App and FSW.
+Results are statistically equivalent to the SimPy engine, not identical.
+"""
+
+# %% Import essentials
+import json
+import numpy as np
+import pandas as pd
+import logsim.ttime as tt
+from logsim.datapool import CDP
+from logsim.hi import pool_schemas
+
+DAY = 24 * 3600
+MONTH = 30 * DAY
+
+
+def ceil_div(a, b):
+    """Integer ceil(a / b) for arrays"""
+    return -(-a // b)
+
+
+class FleetGroup:
+    """
+    Class holding the drawn sessions of a group of HIs sharing a config
+    """
+
+    # Constructor
+    def __init__(self, ids, cfg, until, rng):
+        """
+        Constructor of a FleetGroup
+
+        Parameters
+        ----------
+        ids : list of int
+        cfg : JSON, HI configuration (as for HI)
+        until : int, end of simulation (secs)
+        rng : numpy.random.Generator
+
+        Returns
+        -------
+        None.
+
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.cfg = cfg
+        self.until = until
+        self.rng = rng
+        self.sim_start = tt.str2time(cfg['sim_start'])
+        self.nvram_array = cfg['nvram_array']
+        self.nvram_month = cfg['nvram_month']
+        self.estimators = list(cfg['estimators'].keys())
+        self.detectors = list(cfg['detectors'].keys())
+        self.app_on = cfg['app']['on']
+        self.app_tick = tt.hms2sec(cfg['app']['interval'])
+        # RAM layout as created by HI.init_memory
+        self.keys = ['id', 'power_cycle', 'charge', 'usage'] \
+            + self.estimators + self.detectors
+        self.draw_sessions()
+        self.count_sessions()
+
+    def draw_sessions(self):
+        """Draw session start/end times like HI.run_sessions"""
+        n = len(self.ids)
+        cycle = tt.hms2sec('{}h'.format(int(24 / self.cfg['times_pr_day'])))
+        n_sess = self.until // cycle + 2
+        tick = self.rng.integers(tt.hms2sec(self.cfg['min_period']),
+                                 tt.hms2sec(self.cfg['max_period']) + 1,
+                                 size=(n, n_sess))
+        chg = cycle - tick - 300 \
+            + self.rng.integers(0, 601, size=(n, n_sess))
+        chg[:, 0] -= tt.hms2sec('8h')
+        chg = np.maximum(chg, 300)
+        self.tick = tick
+        self.chg = chg
+        self.end = np.cumsum(chg + tick, axis=1)
+        self.start = self.end - tick
+
+    def draw_lengths(self, cfg):
+        """Draw the estimator length pr day, see Estimator.increase_*"""
+        n = len(self.ids)
+        n_days = self.until // DAY + 1
+        org = tt.hms2sec(cfg['length'])
+        inc_d = tt.hms2sec(cfg['inc_d']) if 'inc_d' in cfg else 0
+        inc_m = tt.hms2sec(cfg['inc_m']) if 'inc_m' in cfg else 0
+        pct = 0 if 'rand-off' in cfg else 40
+        length = np.full((n, n_days), org, dtype=np.int64)
+        cur = length[:, 0].copy()
+        for d in range(1, n_days):
+            if inc_d:
+                cur = np.minimum(3 * org, self.rnd_pct(cur, pct) + inc_d)
+            if inc_m and d % 30 == 0:
+                cur = np.minimum(4 * org, self.rnd_pct(cur, pct) + inc_m)
+            length[:, d] = cur
+        return length
+
+    def rnd_pct(self, n, pct):
+        """Vectorized tt.intRndPct"""
+        r = self.rng.uniform(-pct, pct, size=n.shape)
+        return (n * (100.0 + r) / 100.0).astype(np.int64)
+
+    def last_read(self):
+        """Time of the last App read in each session (-1 if none)"""
+        if not self.app_on:
+            return np.full(self.end.shape, -1)
+        r = self.app_tick * (ceil_div(self.end, self.app_tick) - 1)
+        return np.where(r >= self.start, r, -1)
+
+    def count_sessions(self):
+        """Counters pr session: increments and NVRAM (end of session)"""
+        s, e = self.start, self.end
+        self.inc = {'charge': self.chg, 'usage': self.tick}
+        self.nvram = {'charge': np.cumsum(self.chg, axis=1),
+                      'usage': np.cumsum(self.tick, axis=1)}
+        for d in self.detectors:
+            p = tt.hms2sec(self.cfg['detectors'][d])
+            self.inc[d] = ceil_div(e, p) - ceil_div(s, p)
+            self.nvram[d] = np.cumsum(self.inc[d], axis=1)
+        # Estimators on the 'interval' grid; the last window of a session
+        # is only counted up to the last App read before the session end
+        r_last = self.last_read()
+        day = np.minimum(s // DAY, self.until // DAY)
+        self.length = {}
+        for d in self.estimators:
+            cfg = self.cfg['estimators'][d]
+            iv = tt.hms2sec(cfg['interval'])
+            length = np.take_along_axis(self.draw_lengths(cfg), day, axis=1)
+            n_win = ceil_div(e, iv) - ceil_div(s, iv)
+            t_last = iv * (ceil_div(e, iv) - 1)
+            credit = np.where(r_last >= t_last, r_last - t_last, 0)
+            tail = np.where((n_win > 0) & (t_last + length >= e),
+                            length - np.minimum(credit, length), 0)
+            self.length[d] = length
+            self.inc[d] = n_win * length
+            self.nvram[d] = np.cumsum(self.inc[d], axis=1) - tail
+
+    def frame(self, hi, sess, counters):
+        """DataFrame in RAM layout for the (hi, session) index arrays"""
+        data = {'id': self.ids[hi], 'power_cycle': sess}
+        for k in self.keys[2:]:
+            data[k] = counters[k]
+        return pd.DataFrame(data, columns=self.keys)
+
+    def nvram_frame(self, hi, sess):
+        """NVRAM content for the (hi, session) index arrays"""
+        return self.frame(hi, sess, {k: self.nvram[k][hi, sess]
+                                     for k in self.keys[2:]})
+
+    def app_reads(self):
+        """(hi, session, time) of all App reads"""
+        t_end = np.minimum(self.end, self.until)
+        first = self.app_tick * ceil_div(self.start, self.app_tick)
+        n_reads = np.maximum(ceil_div(t_end, self.app_tick)
+                             - ceil_div(self.start, self.app_tick), 0)
+        hi, sess = np.nonzero(n_reads)
+        cnt = n_reads[hi, sess]
+        # Offset of each read within its session
+        offs = np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        hi = np.repeat(hi, cnt)
+        sess = np.repeat(sess, cnt)
+        return hi, sess, first[hi, sess] + offs * self.app_tick
+
+    def app_hourly(self):
+        """Hourly App pool, see App.run"""
+        hi, sess, r = self.app_reads()
+        s = self.start[hi, sess]
+        prev = sess - 1
+        has_prev = prev >= 0
+        prev = np.maximum(prev, 0)
+
+        def before(k):
+            """Counter at the end of the previous session"""
+            return np.where(has_prev,
+                            np.cumsum(self.inc[k], axis=1)[hi, prev], 0)
+
+        counters = {'charge': self.nvram['charge'][hi, sess],
+                    'usage': before('usage') + r - s}
+        for d in self.detectors:
+            p = tt.hms2sec(self.cfg['detectors'][d])
+            counters[d] = before(d) + r // p - ceil_div(s, p) + 1
+        for d in self.estimators:
+            iv = tt.hms2sec(self.cfg['estimators'][d]['interval'])
+            length = self.length[d][hi, sess]
+            n_win = r // iv - ceil_div(s, iv) + 1
+            part = np.minimum(r - iv * (r // iv), length)
+            counters[d] = before(d) + np.where(
+                n_win > 0, (n_win - 1) * length + part, 0)
+        df = self.frame(hi, sess, counters)
+        df['time'] = self.sim_start + r
+        df['stored'] = r
+        # Detectors/Estimators in diff/percentage?
+        if self.cfg['app']['diff']:
+            df = self.diff_reads(df)
+        return df
+
+    def diff_reads(self, df):
+        """Diff detectors and estimators between App reads of a HI"""
+        df = df.sort_values(by=['id', 'time'], kind='stable')
+        first = (df['id'] != df['id'].shift()).to_numpy()
+        for d in self.detectors:
+            diff = df[d].diff().fillna(0).astype(np.int64)
+            df[d] = np.where(first, df[d], diff)
+        for d in self.estimators:
+            pct = (100.0 * df[d].diff() / self.app_tick).round(1)
+            df[d] = np.where(first, df[d], pct)
+        return df
+
+    def app_daily(self, hourly):
+        """Daily App pool (yesterdays counters), see App.run"""
+        first = hourly.drop_duplicates(subset=['id', 'power_cycle'])
+        first = first.sort_values(by=['id', 'power_cycle'])
+        # Yesterday is stored on the first read of the next session
+        sess = first['power_cycle'].to_numpy() - 1
+        keep = sess >= 0
+        # Yesterday had App reads, else it is logged as of the storing read
+        had_reads = ((first['id'].shift() == first['id'])
+                     & (first['power_cycle'].shift() == sess)).to_numpy()
+        hi = np.searchsorted(self.ids, first['id'].to_numpy()[keep])
+        sess = sess[keep]
+        had_reads = had_reads[keep]
+        df = self.nvram_frame(hi, sess)
+        df['time'] = np.where(had_reads, first['time'].shift().to_numpy()[
+            keep], first['time'].to_numpy()[keep]).astype(np.int64)
+        df['usage-at-time'] = np.where(
+            had_reads, first['usage'].shift().to_numpy()[keep],
+            self.nvram['usage'][hi, sess]).astype(np.int64)
+        df['stored'] = first['stored'].to_numpy()[keep]
+        return df
+
+    def fsw(self):
+        """Daily and monthly FSW pools, see FSW.run"""
+        daily = []
+        monthly = []
+        for visit in self.cfg['fsw']['visits']:
+            t_visit = MONTH * visit
+            if t_visit >= self.until:
+                break
+            # Sessions ended before the visit
+            n_done = (self.end < t_visit).sum(axis=1)
+            # NVRAM ring: latest session in each slot
+            slot = np.arange(self.nvram_array)
+            last = slot + self.nvram_array * (
+                (n_done[:, None] - 1 - slot) // self.nvram_array)
+            hi, k = np.nonzero(last >= 0)
+            daily.append(self.nvram_frame(hi, last[hi, k]))
+            daily[-1]['stored'] = t_visit
+            # NVRAM_MONTH ring: sessions 0, nvram_array, 2*nvram_array...
+            if self.nvram_month:
+                n_snap = ceil_div(n_done, self.nvram_array)
+                slot = np.arange(self.nvram_month)
+                snap = slot + self.nvram_month * (
+                    (n_snap[:, None] - 1 - slot) // self.nvram_month)
+                hi, k = np.nonzero(snap >= 0)
+                monthly.append(self.nvram_frame(
+                    hi, snap[hi, k] * self.nvram_array))
+                monthly[-1]['stored'] = t_visit
+        return daily, monthly
+
+
+def simulate_fleet(users, until, seed=None, cdp=None, hourly=True):
+    """
+    Simulate a fleet of HIs with the vectorized engine
+
+    Parameters
+    ----------
+    users : dict of {id: HI config}
+        HI configurations as used for HI, HIs sharing an identical
+        configuration are simulated together.
+    until : int
+        End of simulation (secs), as for simpy.Environment.run
+    seed : int, optional
+        Seed for the random generator. The default is None.
+    cdp : CDP, optional
+        CDP to fill. The default is None (create a new one).
+    hourly : boolean, optional
+        Store the hourly App pool, by far the largest. The default is True.
+
+    Returns
+    -------
+    cdp : CDP
+
+    """
+    rng = np.random.default_rng(seed)
+    cdp = cdp if cdp else CDP()
+    # Group the HIs by config
+    groups = {}
+    for i, cfg in sorted(users.items()):
+        key = json.dumps(cfg, sort_keys=True)
+        groups.setdefault(key, (cfg, []))[1].append(i)
+
+    pools = {'app_hourly': [], 'app_daily': [],
+             'fsw_daily': [], 'fsw_monthly': []}
+    for cfg, ids in groups.values():
+        grp = FleetGroup(ids, cfg, until, rng)
+        cdp.declare(pool_schemas(cfg))
+        if grp.app_on:
+            app_hourly = grp.app_hourly()
+            pools['app_daily'].append(grp.app_daily(app_hourly))
+            if hourly:
+                pools['app_hourly'].append(app_hourly)
+        daily, monthly = grp.fsw()
+        pools['fsw_daily'] += daily
+        pools['fsw_monthly'] += monthly
+
+    # Store in the order the SimPy engine would have stored the samples
+    for name, frames in pools.items():
+        if not frames:
+            continue
+        df = pd.concat(frames, ignore_index=True)
+        df = df.sort_values(by=['stored', 'id'], kind='stable')
+        df = df.drop(columns=['stored'])
+        if name == 'app_daily':
+            # Same column order as App.run
+            df = df[[k for k in df.keys() if k != 'usage-at-time']
+                    + ['usage-at-time']]
+        getattr(cdp, name).put_many(df)
+    return cdp
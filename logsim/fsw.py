@@ -24,29 +24,43 @@ class FSW:
         self.env = env
         self.cdp_fsw_daily = cdp.getFswDaily()
         self.cdp_fsw_monthly = cdp.getFswMonthly()
-        self.visits = cfg['visits']
+        self.configure(cfg)
         self.verbosity = verbosity
+        # Visits are in months from the start of the HI
+        self.started = self.env.now
+        self.last_visit = 0
         # Start the FSW
-        self.env.process(self.run())
+        self.HI.start(self.run())
+
+    def configure(self, cfg):
+        """ Set the parameters of cfg """
+        self.visits = cfg['visits']
+
+    def __getstate__(self):
+        """ State for a snapshot, without the SimPy environment """
+        return {k: v for k, v in self.__dict__.items() if k != 'env'}
+
+    def remaining(self):
+        """ Visits not done yet """
+        return [v for v in self.visits if v > self.last_visit]
 
-    def run(self):
-        """ Run the Fsw"""
+    def run(self, wake=None):
+        """ Run the Fsw, a restored one from the first visit not done """
         month_in_sec = tt.hms2sec('24h') * 30
-        last_visit = 0
-        for visit in self.visits:
-            yield self.env.timeout(month_in_sec * (visit - last_visit))
-            last_visit = visit
+        for visit in self.visits if wake is None else self.remaining():
+            yield self.env.timeout(max(
+                self.started + month_in_sec * visit - self.env.now, 0))
+            self.last_visit = visit
             # Get current NVRAM counters and store in DB
+            # Store in Monthly DB if data is valid
             NVRAM_MONTH = self.HI.get_counters_NVRAM_MONTH()
-            for nv in NVRAM_MONTH:
-                # Store in Daily DB if data is valid
-                if nv['usage']:
-                    self.cdp_fsw_monthly.put(nv)
+            self.cdp_fsw_monthly.put_many(
+                self.HI.counters2dict(nv)
+                for nv in NVRAM_MONTH[NVRAM_MONTH['usage'] != 0])
+            # Store in Daily DB if data is valid
             NVRAM = self.HI.get_counters_NVRAM()
-            for nv in NVRAM:
-                # Store in Daily DB
-                if nv['usage']:
-                    self.cdp_fsw_daily.put(nv)
+            self.cdp_fsw_daily.put_many(
+                self.HI.counters2dict(nv) for nv in NVRAM[NVRAM['usage'] != 0])
             # Log the visit
             if self.verbosity > 0:
                 print('HCP visit     @', self.HI.now2str(),
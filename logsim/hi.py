@@ -11,10 +11,77 @@ import numpy as np
 import pandas as pd
 import pprint
 import random
+from array import array
 import logsim.app as App
 import logsim.fsw as Fsw
 import logsim.ttime as tt
 
+# Fixed counters first in the HI memory, estimators and detectors follow
+ID, POWER_CYCLE, CHARGE, USAGE = range(4)
+# C int counters, as array typecode and numpy type
+COUNTER_CODE = 'i'
+COUNTER_TYPE = np.intc
+# Memory layouts (field names, index, dtype), shared by HIs of a config
+_layouts = {}
+
+
+def memory_layout(cfg):
+    """
+    Field names, field index and structured dtype of the HI memory
+
+    Parameters
+    ----------
+    cfg : JSON, HI configuration
+
+    Returns
+    -------
+    (tuple of string, dict of {field: index}, numpy.dtype)
+
+    """
+    fields = ('id', 'power_cycle', 'charge', 'usage') \
+        + tuple(cfg['estimators']) + tuple(cfg['detectors'])
+    if fields not in _layouts:
+        _layouts[fields] = (fields, {f: i for i, f in enumerate(fields)},
+                            np.dtype([(f, COUNTER_TYPE) for f in fields]))
+    return _layouts[fields]
+
+
+# Column types of the DB's: counters as in the HI memory, epoch secs and
+# App percentages
+TIME_TYPE = np.dtype(np.int64)
+PERCENT_TYPE = np.dtype(np.float32)
+# Schemas of the DB's, shared by HIs of a layout
+_schemas = {}
+
+
+def pool_schemas(cfg):
+    """
+    Column types of the DB's filled by HIs of a configuration
+
+    Parameters
+    ----------
+    cfg : JSON, HI configuration
+
+    Returns
+    -------
+    dict of {DB name: dict of {column: numpy.dtype}}
+
+    """
+    fields = memory_layout(cfg)[0]
+    diff = bool(cfg['app']['on'] and cfg['app']['diff'])
+    if (fields, diff) not in _schemas:
+        counters = {f: np.dtype(COUNTER_TYPE) for f in fields}
+        hourly = dict(counters, time=TIME_TYPE)
+        if diff:
+            # Estimators are read as percentages of the App interval
+            hourly.update({e: PERCENT_TYPE for e in cfg['estimators']})
+        daily = dict(counters, time=TIME_TYPE)
+        daily['usage-at-time'] = counters['usage']
+        _schemas[(fields, diff)] = {'app_hourly': hourly, 'app_daily': daily,
+                                    'fsw_daily': counters,
+                                    'fsw_monthly': counters}
+    return _schemas[(fields, diff)]
+
 
 # Start with building blocks
 class Estimator:
@@ -22,8 +89,14 @@ class Estimator:
     Class for holding an estimator used in the HI
     """
 
+    __slots__ = ['name', 'HI', 'env', 'idx', 'count', 'last_updated',
+                 'interval', 'length', 'org_length', 'running',
+                 'parent_running', 'verbosity', 'inc_d', 'inc_m', 'randinc',
+                 'analytic', 'next_start', 'win_end', 't_off']
+
     # Constructor
-    def __init__(self, name, HI, env, cfg, parent_running, verbosity):
+    def __init__(self, name, HI, env, cfg, parent_running, verbosity,
+                 analytic=False):
         """
         Constructor of an Estimator
 
@@ -35,6 +108,9 @@ class Estimator:
         cfg :  JSON, Configuration parameters
         parent_running : boolean
         verbosity : int
+        analytic : boolean, optional
+            Compute the on-time from the session start/end instead of
+            running a SimPy process. The default is False.
 
         Returns
         -------
@@ -44,50 +120,151 @@ class Estimator:
         self.name = name
         self.HI = HI
         self.env = env
+        # Index of the counter in the HI memory
+        self.idx = HI.index[name]
         self.count = 0
         self.last_updated = 0
-        self.interval = tt.hms2sec(cfg['interval'])
         self.length = tt.hms2sec(cfg['length'])
         self.org_length = self.length
         self.running = False
         self.parent_running = parent_running
         self.verbosity = verbosity
+        self.configure(cfg)
+        self.analytic = analytic
+        # Analytic mode: the estimator starts on a grid of 'interval' secs,
+        # moved when the length changes in a window (see set_length),
+        # 'next_start' is the next grid point not yet accounted for and
+        # 'win_end' the end of the open window (if any)
+        self.next_start = self.env.now
+        self.win_end = None
+        # Process mode: time the estimator went to sleep with the HI off
+        self.t_off = 0
+        # Start the estimator
+        if not self.analytic:
+            self.HI.start(self.run())
+
+    def configure(self, cfg):
+        """Set the parameters of cfg, the length evolves and is kept"""
+        self.interval = tt.hms2sec(cfg['interval'])
         self.inc_d = tt.hms2sec(cfg['inc_d']) if 'inc_d' in cfg else 0
         self.inc_m = tt.hms2sec(cfg['inc_m']) if 'inc_m' in cfg else 0
         self.randinc = 0 if 'rand-off' in cfg else 40
-        # Start the estimator
-        self.env.process(self.run())
+
+    def __getstate__(self):
+        """State for a snapshot, without the SimPy environment"""
+        return {k: getattr(self, k) for k in self.__slots__ if k != 'env'}
+
+    def __setstate__(self, state):
+        """Restore a snapshot, see HI.attach"""
+        for k, v in state.items():
+            setattr(self, k, v)
 
     def update_counter(self):
         """Update counter value"""
-        if self.running:
-            self.HI.RAM[self.name] += self.env.now - self.last_updated
+        if self.analytic:
+            self.advance(self.env.now, self.parent_running())
+            # Count the open window up to now
+            if self.win_end is not None:
+                now = min(self.env.now, self.win_end)
+                self.HI.ram[self.idx] += now - self.last_updated
+                self.last_updated = now
+        elif self.running:
+            self.HI.ram[self.idx] += self.env.now - self.last_updated
             self.last_updated = self.env.now
 
+    def close_window(self):
+        """Count the rest of the open window (analytic mode)"""
+        self.HI.ram[self.idx] += self.win_end - self.last_updated
+        self.win_end = None
+
+    def advance(self, until, running):
+        """
+        Account for all windows starting before 'until' (analytic mode)
+
+        Parameters
+        ----------
+        until : int
+            Time (secs). Windows starting at 'until' are not included,
+            nor is the end of a window ending at 'until'.
+        running : boolean
+            The HI has been running since the last call
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.next_start < until:
+            # Number of grid points in [next_start, until)
+            n = -((self.next_start - until) // self.interval)
+            if running:
+                # Close the window from the previous session
+                if self.win_end is not None:
+                    self.close_window()
+                # All but the last window have ended before 'until'
+                self.HI.ram[self.idx] += (n - 1) * self.length
+                self.last_updated = self.next_start + (n - 1) * self.interval
+                self.win_end = self.last_updated + self.length
+            self.next_start += n * self.interval
+        # The open window may have ended
+        if self.win_end is not None and self.win_end < until:
+            self.close_window()
+
     def set_parent(self, parent):
         """Set parent"""
         self.parent_running = parent
 
+    def set_length(self, length):
+        """Set the length of the windows started from now"""
+        if self.analytic:
+            # Windows started until now use the old length
+            self.advance(self.env.now, self.parent_running())
+            # The process ends an open window after the old length and
+            # waits 'interval' - the new length, which moves the grid. A
+            # window ending now is still open, the daily tick comes first
+            if self.win_end is not None and self.win_end >= self.env.now:
+                self.next_start += self.length - length
+        self.length = length
+
     def increase_daily(self):
         """Inc length daily"""
         # Pick-up on length?
         if self.inc_d:
             # Max 3 times initial length, randomize, increase
-            self.length = min(3*self.org_length,
-                              tt.intRndPct(self.length, self.randinc)
-                              + self.inc_d)
+            self.set_length(min(3*self.org_length,
+                                tt.intRndPct(self.length, self.randinc,
+                                             self.HI.rng)
+                                + self.inc_d))
 
     def increase_monthly(self):
         """Inc length monthly"""
         # Pick-up on length?
         if self.inc_m:
             # Max 3 times initial length, randomize, increase
-            self.length = min(4*self.org_length,
-                              tt.intRndPct(self.length, self.randinc)
-                              + self.inc_m)
+            self.set_length(min(4*self.org_length,
+                                tt.intRndPct(self.length, self.randinc,
+                                             self.HI.rng)
+                                + self.inc_m))
+
+    def end_window(self):
+        """End the running window (process mode)"""
+        # Update counter
+        self.update_counter()
+        if self.verbosity > 3:
+            print('@ {}: {} ended, count = {}'.format(
+                self.HI.now2str(), self.name, self.HI.ram[self.idx]))
+        self.running = False
 
-    def run(self):
-        """Run the Estimator"""
+    def run(self, wake=None):
+        """Run the Estimator, a restored one from its pending 'wake'"""
+        if wake == tt.ASLEEP:
+            yield self.HI.session_started
+            wake = self.env.now + (self.t_off - self.env.now) % self.interval
+        if wake is not None:
+            yield self.env.timeout(wake - self.env.now)
+            if self.running:
+                self.end_window()
+                yield self.env.timeout(self.interval-self.length)
         while True:
             # Depend on HI running
             if self.parent_running():
@@ -100,17 +277,15 @@ class Estimator:
                 # Run for 'length' secs
                 yield self.env.timeout(self.length)
                 # End estimator
-                # Update counter
-                self.update_counter()
-                if self.verbosity > 3:
-                    print('@ {}: {} ended, count = {}'.format(
-                        self.HI.now2str(), self.name, self.HI.RAM[self.name]))
-                self.running = False
+                self.end_window()
                 # Wait for 'interval - length' secs
                 yield self.env.timeout(self.interval-self.length)
             else:
-                # Kill time
-                yield self.env.timeout(self.interval)
+                # Sleep until the HI starts, resume on the 'interval' phase
+                self.t_off = self.env.now
+                yield self.HI.session_started
+                yield self.env.timeout(
+                    (self.t_off - self.env.now) % self.interval)
 
 
 class HI:
@@ -118,10 +293,32 @@ class HI:
     Class for holding a HI with detectors, estimators.
     The HI is connected to both an App and FSW
     which both can sample the logging data from the HI
+
+    The RAM counters are a list with the fields of memory_layout (fast
+    scalar updates). The NVRAM and NVRAM_MONTH ring buffers are rows of
+    one flat integer array. RAM (a copy), NVRAM and NVRAM_MONTH are
+    read-only structured numpy arrays, created on access.
+
+    Most of the rest of an HI is its SimPy processes, Estimators and
+    random generator, see 'python benchmark.py memory'. Fleets of HIs at
+    a fraction of that memory need the vectorized engine, see
+    logsim.fleet.
+
+    The processes keep their state in the HI and its components, so a
+    snapshot (see logsim.simulation) can restore them from their pending
+    events.
     """
 
+    __slots__ = ['HI_running', 'id', 'env', 'rng', 'last_updated_at',
+                 'nvram_array', 'nvram_month', 'estimators', 'detectors',
+                 'app', 'fsw', 'min_period', 'max_period', 'times_pr_day',
+                 'verbosity', 'sim_start', 'estimator_mode', 'fields',
+                 'index', 'dtype', 'ram', 'mem', 'NVRAM_yesterday',
+                 'session_started', 'session_ended', 'procs', 'cfg',
+                 'started', 'days', 'tick', 'first_day', 'month_cycle']
+
     # Constructor
-    def __init__(self, id, env, cdp, cfg):
+    def __init__(self, id, env, cdp, cfg, rng=random):
         """
         Constructor of HI
         Parameters
@@ -138,6 +335,9 @@ class HI:
         cfg: JSON object
             Reference to a Configuration dict
 
+        rng: random.Random, optional
+            Random generator of this HI. The default is the random module.
+
         Returns
         -------
         None.
@@ -147,6 +347,7 @@ class HI:
         self.HI_running = False
         self.id = id
         self.env = env
+        self.rng = rng
         self.last_updated_at = 0
         # self.power_cycle = 0
         # Size of NVRAM arrays
@@ -154,35 +355,46 @@ class HI:
         self.nvram_month = cfg['nvram_month']
         # Estimators
         self.estimators = {}
-        # Detectors
-        self.detectors = cfg['detectors']
         # App
         self.app = 0
-        self.min_period = tt.hms2sec(cfg['min_period'])
-        self.max_period = tt.hms2sec(cfg['max_period'])
-        self.times_pr_day = cfg['times_pr_day']
-        self.verbosity = cfg['verbosity']
+        # Detectors, session and verbosity parameters
+        self.configure(cfg)
+        # Process state: start time, days, session length, first session,
+        # NVRAM_MONTH index
+        self.started = self.env.now
+        self.days = 0
+        self.tick = 0
+        self.first_day = True
+        self.month_cycle = 0
         self.sim_start = tt.str2time(cfg['sim_start'])
-        self.pp = pprint.PrettyPrinter(indent=2, width=170)
+        # 'process' runs a SimPy process per estimator, 'analytic' derives
+        # the estimator counters from the session start/end times
+        self.estimator_mode = cfg.get('estimator_mode', 'process')
         # Declare
-        self.RAM = {}
-        self.NVRAM = []
-        self.NVRAM_MONTH = []
-        self.NVRAM_yesterday = 0
+        self.NVRAM_yesterday = None
+        # Session start/end events, processes sleep on them while HI is off
+        self.session_started = self.env.event()
+        self.session_ended = self.env.event()
+        # SimPy processes of the HI, its estimators, App and FSW
+        self.procs = []
         # Init memory
         self.init_memory(cfg)
         # Start daily ticks
-        self.env.process(self.run_daily())
+        self.start(self.run_daily())
         # Start the sessions and the detectors and estimators
-        self.env.process(self.run_sessions())
+        self.start(self.run_sessions())
         # Start detectors
         for d in self.detectors:
-            self.env.process(self.run_detectors(d))
-        # Start estimators
+            self.start(self.run_detectors(d))
+        # Start estimators, sharing one parent
+        running = self.is_running
         for d in cfg['estimators']:
             self.estimators[d] = Estimator(
                 d, self, self.env, cfg['estimators'][d],
-                self.is_running, self.verbosity)
+                running, self.verbosity,
+                analytic=self.estimator_mode == 'analytic')
+        # Column types of the samples stored by FSW and App
+        cdp.declare(pool_schemas(cfg))
         # Start FSW
         self.fsw = Fsw.FSW(self, self.env, cdp, cfg['fsw'], self.verbosity)
         # Start App
@@ -190,25 +402,172 @@ class HI:
             self.app = App.App(self, self.env, cdp, cfg['app'],
                                self.verbosity, self.sim_start)
 
+    def configure(self, cfg):
+        """Set the detectors, session and verbosity parameters of cfg"""
+        self.cfg = cfg
+        self.detectors = cfg['detectors']
+        self.min_period = tt.hms2sec(cfg['min_period'])
+        self.max_period = tt.hms2sec(cfg['max_period'])
+        self.times_pr_day = cfg['times_pr_day']
+        self.verbosity = cfg['verbosity']
+
+    def reconfigure(self, cfg):
+        """
+        Set the parameters of cfg in a restored HI and its components
+
+        The layout of the memory and whether the HI has an App cannot be
+        changed.
+
+        Parameters
+        ----------
+        cfg : JSON, HI configuration
+
+        Returns
+        -------
+        None.
+
+        """
+        if memory_layout(cfg)[0] != self.fields \
+                or cfg['nvram_array'] != self.nvram_array \
+                or cfg['nvram_month'] != self.nvram_month \
+                or bool(cfg['app']['on']) != bool(self.app):
+            raise ValueError('The memory layout and App of HI {} cannot '
+                             'be changed'.format(self.id))
+        self.configure(cfg)
+        for e in self.estimators:
+            self.estimators[e].configure(cfg['estimators'][e])
+        self.fsw.configure(cfg['fsw'])
+        if self.app:
+            self.app.configure(cfg['app'])
+            # The App may read percentages from now on
+            self.app.cdp_app_hourly.declare(pool_schemas(cfg)['app_hourly'])
+
+    # Processes
+    def start(self, gen):
+        """Start the process generator 'gen' as a process of the HI"""
+        p = self.env.process(gen)
+        self.procs.append(p)
+        return p
+
+    def proc_names(self):
+        """Names of the processes, in the order of 'procs'"""
+        names = ['daily', 'sessions'] \
+            + ['detector:' + d for d in self.detectors]
+        if self.estimator_mode != 'analytic':
+            names += ['estimator:' + e for e in self.estimators]
+        return names + ['fsw'] + (['app'] if self.app else [])
+
+    def process(self, name, wake=None):
+        """Process generator 'name', resumed from its pending 'wake'"""
+        kind, _, arg = name.partition(':')
+        if kind == 'detector':
+            return self.run_detectors(arg, wake)
+        if kind == 'estimator':
+            return self.estimators[arg].run(wake)
+        if kind == 'fsw':
+            return self.fsw.run(wake)
+        if kind == 'app':
+            return self.app.run(wake)
+        return getattr(self, 'run_' + kind)(wake)
+
+    def stop(self):
+        """
+        Stop all processes of the HI, e.g. when its user leaves
+
+        The processes are interrupted where they wait, the interrupts are
+        defused so they end the processes silently. The counters and the
+        data already stored in the CDP are kept.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.HI_running = False
+        for p in self.procs:
+            if p is not None and p.is_alive:
+                p.defused = True
+                p.interrupt('stop')
+        self.procs = []
+
+    # Snapshots
+    def __getstate__(self):
+        """State for a snapshot, without the SimPy environment"""
+        state = {k: getattr(self, k) for k in self.__slots__
+                 if k not in ['env', 'procs', 'session_started',
+                              'session_ended']}
+        # The random module itself is restored by the Simulation
+        if state['rng'] is random:
+            state['rng'] = None
+        return state
+
+    def __setstate__(self, state):
+        """Restore a snapshot, attach() it to an environment"""
+        for k, v in state.items():
+            setattr(self, k, v)
+        if self.rng is None:
+            self.rng = random
+
+    def attach(self, env):
+        """
+        Attach a restored HI and its components to 'env'
+
+        The processes are not started, see process() and
+        logsim.simulation.Simulation.restore.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.env = env
+        self.session_started = env.event()
+        self.session_ended = env.event()
+        self.procs = [None] * len(self.proc_names())
+        for e in self.estimators.values():
+            e.env = env
+        self.fsw.env = env
+        if self.app:
+            self.app.env = env
+
     # Init Memory
     def init_memory(self, cfg):
-        """Initialize RAM based on cfg data"""
-        # Create RAM version of HI-ID and usage
-        self.RAM['id'] = self.id
-        self.RAM['power_cycle'] = 0
-        self.RAM['charge'] = 0
-        self.RAM['usage'] = 0
-        # Create RAM version of all detectors: (State, cnt)
-        for d in cfg['estimators']:
-            self.RAM[d] = 0
-        # Create RAM version of all detectors: (State, cnt)
-        for d in cfg['detectors']:
-            self.RAM[d] = 0
-        # Allocate NVRAM
-        for k in range(self.nvram_array):
-            self.NVRAM.append(self.RAM.copy())
-        for k in range(self.nvram_month):
-            self.NVRAM_MONTH.append(self.RAM.copy())
+        """Allocate RAM and the NVRAM ring buffers based on cfg data"""
+        self.fields, self.index, self.dtype = memory_layout(cfg)
+        # All counters but the id start at 0
+        self.ram = [self.id] + [0] * (len(self.fields) - 1)
+        # NVRAM and NVRAM_MONTH rows
+        self.mem = array(COUNTER_CODE,
+                         self.ram * (self.nvram_array + self.nvram_month))
+
+    def counters(self, row, rows=1):
+        """Read-only structured view of 'rows' NVRAM rows from 'row'"""
+        v = np.frombuffer(self.mem, dtype=self.dtype, count=rows,
+                          offset=row * self.dtype.itemsize)
+        v.flags.writeable = False
+        return v
+
+    def store(self, row):
+        """Copy RAM to an NVRAM row"""
+        n = len(self.fields)
+        self.mem[row * n:(row + 1) * n] = array(COUNTER_CODE, self.ram)
+
+    @property
+    def RAM(self):
+        """RAM, a read-only copy"""
+        v = np.array(tuple(self.ram), dtype=self.dtype)
+        v.flags.writeable = False
+        return v[()]
+
+    @property
+    def NVRAM(self):
+        """NVRAM ring buffer, a read-only view"""
+        return self.counters(0, self.nvram_array)
+
+    @property
+    def NVRAM_MONTH(self):
+        """NVRAM_MONTH ring buffer, a read-only view"""
+        return self.counters(self.nvram_array, self.nvram_month)
 
     def is_running(self):
         """Is Hi running?"""
@@ -218,28 +577,37 @@ class HI:
         """Printable version of present time"""
         return tt.time2str(self.sim_start + self.env.now)
 
-    def get_counters_RAM(self):
-        """Return RAM"""
+    def get_counters_RAM(self, as_dict=False):
+        """Return RAM, a read-only copy or a dict copy"""
         self.update_usage()
         self.update_estimators()
+        if as_dict:
+            return dict(zip(self.fields, self.ram))
         return self.RAM
 
     def get_counters_NVRAM(self):
-        """Return NVRAM"""
+        """Return NVRAM, a read-only view"""
         return self.NVRAM
 
     def get_counters_NVRAM_MONTH(self):
-        """Return NVRAM_MONTH"""
+        """Return NVRAM_MONTH, a read-only view"""
         return self.NVRAM_MONTH
 
     # Get yeterdays counters
     def get_yesterdays_counters(self):
-        return self.NVRAM_yesterday
+        """Return yesterdays NVRAM entry (read-only view), None if none"""
+        if self.NVRAM_yesterday is None:
+            return None
+        return self.counters(self.NVRAM_yesterday)[0]
+
+    def counters2dict(self, counters):
+        """Counters of a RAM/NVRAM entry as a dict"""
+        return dict(zip(self.fields, counters.tolist()))
 
     def update_usage(self):
         """Update usage counter"""
         if (self.HI_running and (self.env.now > self.last_updated_at)):
-            self.RAM['usage'] += self.env.now - self.last_updated_at
+            self.ram[USAGE] += self.env.now - self.last_updated_at
             self.last_updated_at = self.env.now
 
     def update_estimators(self):
@@ -248,14 +616,22 @@ class HI:
             for e in self.estimators.keys():
                 self.estimators[e].update_counter()
 
-    def run_daily(self):
-        """Run daily"""
+    def advance_estimators(self):
+        """Account for analytic estimators up to a session start/end"""
+        if self.estimator_mode == 'analytic':
+            for e in self.estimators.keys():
+                self.estimators[e].advance(self.env.now, self.HI_running)
+
+    def run_daily(self, wake=None):
+        """Run daily, a restored HI from its pending 'wake'"""
         t_24h = tt.hms2sec('24h')
-        cnt = 0
         while True:
-            yield self.env.timeout(t_24h)
+            yield self.env.timeout(
+                t_24h if wake is None else wake - self.env.now)
+            wake = None
             # Inc daily counter
-            cnt += 1
+            self.days += 1
+            cnt = self.days
             # Increase estimators
             for e in self.estimators.keys():
                 self.estimators[e].increase_daily()
@@ -276,75 +652,100 @@ class HI:
                     print('Monthly tick  @', self.now2str(),
                           ', HI: ', self.id, ', month: ', int(month_cnt))
 
-    def run_sessions(self):
-        """Run days/sessions until the end"""
-        # Start in the morning...
-        first_day = True
-        pwr_cycle = 0
-        month_cycle = 0
+    def start_session(self):
+        """Start session (HI removed from Charger)"""
+        self.advance_estimators()
+        self.HI_running = True
+        self.session_started.succeed()
+        self.session_started = self.env.event()
+        if self.verbosity > 0:
+            print('Usage started @', self.now2str(), ', HI: ', self.id)
+        self.ram[CHARGE] += self.env.now - self.last_updated_at
+        self.last_updated_at = self.env.now
+
+    def end_session(self):
+        """End usage session (HI into Charger)"""
+        # Index for RAM and NVRAM arrays
+        pwr_cycle = self.ram[POWER_CYCLE] % self.nvram_array
+        self.advance_estimators()
+        self.update_usage()
+        self.HI_running = False
+        self.session_ended.succeed()
+        self.session_ended = self.env.event()
+        # Copy RAM to the NVRAM ring buffer
+        self.store(pwr_cycle)
+        # Store as yesterdays counters
+        self.NVRAM_yesterday = pwr_cycle
+        # Check if time to store monthly counters
+        if self.nvram_month > 0 and pwr_cycle == 0:
+            self.store(self.nvram_array + self.month_cycle)
+            self.month_cycle = (self.month_cycle + 1) % self.nvram_month
+        # Usage ended
+        if self.verbosity > 0:
+            print('Usage ended   @',
+                  self.now2str(), ', HI: ', self.id)
+        # Show memory content
+        if self.verbosity > 1:
+            print('RAM:')
+            self.pprint(self.counters2dict(self.RAM))
+            print('NVRAM:')
+            print(pd.DataFrame(self.NVRAM))
+        # inc power_cycle to prepare for next session
+        self.ram[POWER_CYCLE] += 1
+
+    def run_sessions(self, wake=None):
+        """Run days/sessions until the end, a restored HI from 'wake'"""
+        if wake is not None:
+            # Restored while charging or in a session
+            yield self.env.timeout(wake - self.env.now)
+            if not self.HI_running:
+                self.start_session()
+                yield self.env.timeout(self.tick)
+            self.end_session()
         while True:
-            # Create index for RAM and NVRAM arrays
-            pwr_cycle = self.RAM['power_cycle'] % self.nvram_array
             # Start by Charging
             cycle = int(24 / self.times_pr_day)
-            tick = random.randint(self.min_period, self.max_period)
-            chg = tt.hms2sec(
-                '{}h'.format(cycle)) - tick + random.randint(0, 600) - 300
-            if first_day:
+            self.tick = self.rng.randint(self.min_period, self.max_period)
+            chg = tt.hms2sec('{}h'.format(cycle)) - self.tick \
+                + self.rng.randint(0, 600) - 300
+            # Start in the morning...
+            if self.first_day:
                 chg -= tt.hms2sec('8h')
-                first_day = False
+                self.first_day = False
             # Check for negative time...
             chg = max(chg, 300)
             self.last_updated_at = self.env.now
             yield self.env.timeout(chg)
-
-            # Start session (HI removed from Charger)
-            self.HI_running = True
-            if self.verbosity > 0:
-                print('Usage started @', self.now2str(), ', HI: ', self.id)
-            self.RAM['charge'] += self.env.now - self.last_updated_at
-            self.last_updated_at = self.env.now
-            yield self.env.timeout(tick)
-
-            # End usage session (HI into Charger)
-            self.update_usage()
-            self.HI_running = False
-            # Copy RAM to NVRAM
-            for k in self.RAM.keys():
-                self.NVRAM[pwr_cycle][k] = self.RAM[k]
-            # Store as yesterdays counters
-            self.NVRAM_yesterday = self.NVRAM[pwr_cycle]
-            # Check if time to store monthly counters
-            if self.nvram_month > 0 and pwr_cycle == 0:
-                for k in self.NVRAM[pwr_cycle]:
-                    self.NVRAM_MONTH[month_cycle][k] = self.NVRAM[pwr_cycle][k]
-                month_cycle = (month_cycle + 1) % self.nvram_month
-            # Usage ended
-            if self.verbosity > 0:
-                print('Usage ended   @',
-                      self.now2str(), ', HI: ', self.id)
-            # Show memory content
-            if self.verbosity > 1:
-                print('RAM:')
-                self.pp.pprint(self.RAM)
-                print('NVRAM:')
-                self.pp.pprint(self.NVRAM)
-            # inc power_cycle to prepare for next session
-            self.RAM['power_cycle'] += 1
+            self.start_session()
+            yield self.env.timeout(self.tick)
+            self.end_session()
 
     def pprint(self, dct):
         """Pretty print RAM, NVRAM etc"""
-        self.pp.pprint(dct)
-
-    def run_detectors(self, d):
-        """Start HI detectors"""
+        pprint.pprint(dct, indent=2, width=170)
+
+    def run_detectors(self, d, wake=None):
+        """Start HI detectors, a restored HI from the pending 'wake'"""
+        period = tt.hms2sec(self.detectors[d])
+        idx = self.index[d]
+        if wake == tt.ASLEEP:
+            # The detectors fire on a grid of 'period' from the start
+            yield self.session_started
+            wake = self.env.now + (self.started - self.env.now) % period
+        yield self.env.timeout(
+            period if wake is None else wake - self.env.now)
         while True:
-            yield self.env.timeout(tt.hms2sec(self.detectors[d]))
             if self.is_running():
-                self.RAM[d] = self.RAM[d] + 1
+                self.ram[idx] += 1
                 if self.verbosity > 3:
                     print('@ {}: {} fired, count = {}'.format(
-                        self.env.now, d, self.RAM[d]))
+                        self.env.now, d, self.ram[idx]))
+                yield self.env.timeout(period)
+            else:
+                # Sleep until the HI starts, resume on the detector phase
+                t_off = self.env.now
+                yield self.session_started
+                yield self.env.timeout((t_off - self.env.now) % period)
 
     def plotMonthlyData(self):
         """Plot monthly data"""
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked ingestion of CDP log dumps larger than memory.
+
+DataPool.loadAsCSV reads a whole file at once. ingest() reads CSV or
+JSONL dumps in chunks of a bounded number of rows and routes the rows of
+every chunk to partitions by user id, so all rows of a user end up in the
+same partition of a logsim.partition.PartitionedPool. When all chunks
+are routed, every partition is cleaned on its own: sorted by
+(id, power_cycle) with duplicates dropped (DataPool.clean_data), also
+those from different chunks or dumps. Features are then computed
+partition by partition, so memory holds one chunk while reading and one
+whole partition while cleaning and computing features. The chunk size
+bounds the reading only, the number of partitions bounds the rest: a
+partition holds about 1/partitions of the rows of all dumps, see
+'largest' of the result of ingest:
+
+    ingest(['dump_01.csv', 'dump_02.jsonl'], 'parts', partitions=64)
+    dfeat = partition_features('parts')
+
+Usage:
+    python -m logsim ingest dump_01.csv dump_02.jsonl --out parts \\
+        [--partitions 64] [--chunk-rows 100000] [--features features.csv]
+"""
+
+# %% Import essentials
+import pandas as pd
+from logsim.datapool import apply_schema, without_dates
+from logsim.partition import PartitionedPool
+
+
+# %% Ingestion
+def read_chunks(fname, chunk_rows=100000):
+    """
+    Read a CSV or JSONL log dump in chunks
+
+    Files saved by DataPool.saveAsCSV are read with their times as epoch
+    secs, see without_dates.
+
+    Parameters
+    ----------
+    fname : string
+        CSV file, or JSON lines file if it ends with .jsonl or .json
+    chunk_rows : int, optional
+        Rows pr chunk. The default is 100000.
+
+    Returns
+    -------
+    generator of DataFrame
+
+    """
+    if fname.endswith(('.jsonl', '.json')):
+        reader = pd.read_json(fname, lines=True, chunksize=chunk_rows,
+                              convert_dates=False)
+    else:
+        reader = pd.read_csv(fname, chunksize=chunk_rows)
+    with reader:
+        for df in reader:
+            # Index column of saved DB's
+            df = df.drop(columns=[k for k in df.keys()
+                                  if str(k).startswith('Unnamed:')])
+            yield without_dates(df)
+
+
+def ingest(fnames, out, partitions=16, chunk_rows=100000, schema=None,
+           name='app_daily'):
+    """
+    Route the rows of log dumps to partitions by user id
+
+    Partitions already in 'out' are kept and the new rows added, rows
+    seen before are dropped by the cleaning. Reading holds 'chunk_rows'
+    rows in memory, cleaning a whole partition: use more partitions if
+    the largest partition doesn't fit in memory.
+
+    Parameters
+    ----------
+    fnames : string or list of string
+        CSV or JSONL files, see read_chunks.
+    out : string
+        Directory of the partitions, created if needed.
+    partitions : int, optional
+        Number of partitions. The default is 16.
+    chunk_rows : int, optional
+        Rows read at a time, this doesn't bound the memory of the
+        cleaning. The default is 100000.
+    schema : dict of {column: numpy.dtype}, optional
+        Column types of the rows, see logsim.hi.pool_schemas. The default
+        is the types read.
+    name : string, optional
+        Name of the DB. The default is 'app_daily'.
+
+    Returns
+    -------
+    dict of the number of rows read, duplicates dropped, chunks,
+    partitions and the rows of the largest partition cleaned
+
+    """
+    if isinstance(fnames, str):
+        fnames = [fnames]
+    pp = PartitionedPool(out, partitions, name=name)
+    rows = chunks = 0
+    touched = set()
+    for fname in fnames:
+        for df in read_chunks(fname, chunk_rows):
+            if schema is not None:
+                df = apply_schema(df, schema, name)
+            touched.update(pp.write(df))
+            rows += len(df)
+            chunks += 1
+    # Only partitions with new rows need cleaning, one at a time
+    res = pp.clean_data(workers=1, parts=sorted(touched))
+    return {'rows': rows, 'duplicates': res['duplicates'], 'chunks': chunks,
+            'partitions': pp.partitions, 'largest': res['largest']}
+
+
+# %% Analytics
+def partition_features(out, features=None, name='app_daily', workers=1):
+    """
+    Features pr user, computed one partition at a time
+
+    Every worker holds a whole partition in memory, see ingest.
+
+    Parameters
+    ----------
+    out : string
+        Directory of the partitions, see ingest.
+    features : list of string, optional
+        Names of registered features, see DataPool.create_features. The
+        default is all features available from the DB columns.
+    name : string, optional
+        Name of the DB. The default is 'app_daily'.
+    workers : int, optional
+        Number of worker processes, see PartitionedPool.run. The default
+        is 1.
+
+    Returns
+    -------
+    DataFrame of features indexed by user id
+
+    """
+    pp = PartitionedPool(out, name=name)
+    pp.create_features(features, workers)
+    return pp.dfeat
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+DB's partitioned by user id on disk, analyzed partition by partition.
+
+The analytics of DataPool work on one DataFrame in memory, on one core.
+A PartitionedPool keeps the rows of a DB in partitions by user id, every
+partition a directory of DataFrame chunks (see logsim.sink.DiskSink)
+opened as a DataPool. Rows of a user never cross partitions, so clean,
+diff, normalize and features run on each partition in a process pool and
+the results of the partitions are simply joined.
+
+Users are hashed to partitions (id % partitions), or split in ranges of
+ids by 'bounds', the first id of every partition but the first. Range
+partitions match the shards of logsim.runner, so shard workers write
+their partition directly, see run_partitioned:
+
+    pools = run_partitioned(users, until, 'parts', seed=1, workers=4)
+    pools['app_daily'].create_features(workers=4)
+
+Chunked ingestion of log dumps (logsim.ingest) writes hash partitions.
+The layout of a PartitionedPool is stored in its directory (layout.json).
+"""
+
+# %% Import essentials
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from logsim.datapool import DataPool
+from logsim.sink import DiskSink
+
+# Files of a PartitionedPool: its layout and the diff'd DB pr partition
+LAYOUT = 'layout.json'
+DDIFF = 'ddiff.pkl'
+STAGES = ['clean', 'diff', 'normalize', 'features']
+
+
+# %% Partition stages
+def drop_ddiff(path):
+    """ Remove the diff'd DB of a partition, stale once rows are added """
+    try:
+        os.remove(os.path.join(path, DDIFF))
+    except FileNotFoundError:
+        pass
+
+
+def run_partition(path, name, stage, features=None):
+    """
+    Run an analytics stage on a partition, in a worker process
+
+    The stages read the whole partition into memory, so the memory of a
+    worker is bounded by the size of a partition, not by the chunks it
+    was written in.
+
+    Parameters
+    ----------
+    path : string, directory of the partition
+    name : string, name of the DB
+    stage : string
+        'clean': sort and drop duplicates, stored as one chunk.
+        'diff' and 'normalize': the diff'd DB, stored in DDIFF. DDIFF is
+        removed when rows are written to the partition or it is cleaned.
+        'features': features pr user, see DataPool.create_features.
+    features : list of string, optional
+        Features of the 'features' stage. The default is all available.
+
+    Returns
+    -------
+    (rows before, rows after) for 'clean', rows diff'd for 'diff' and
+    'normalize', DataFrame of features for 'features', None if empty
+
+    """
+    dp = DataPool(name, sink=DiskSink(path))
+    if dp.isEmpty():
+        return None
+    if stage == 'clean':
+        old = dp.sink.files()
+        n = len(dp.df)
+        dp.clean_data()
+        df = dp.df.reset_index(drop=True)
+        # The old chunks are removed once the cleaned one is written
+        dp.sink.write(df)
+        for f in old:
+            os.remove(f)
+        drop_ddiff(path)
+        return n, len(df)
+    if stage == 'features':
+        dp.create_features(features)
+        return dp.dfeat
+    if stage == 'diff':
+        dp.diff_data()
+    else:
+        dp.normalize_data()
+    dp.ddiff.to_pickle(os.path.join(path, DDIFF))
+    return len(dp.ddiff)
+
+
+# %% Partitioned DB
+class PartitionedPool:
+    """Class holding a DB partitioned by user id in directories on disk"""
+
+    def __init__(self, path, partitions=None, bounds=None, name=None):
+        """
+        Constructor of a PartitionedPool, opens or creates its layout
+
+        Parameters
+        ----------
+        path : string
+            Directory of the partitions, created if needed.
+        partitions : int, optional
+            Number of hash partitions of a new DB. The default is 16, or
+            the number of partitions in 'path'.
+        bounds : list of int, optional
+            First id of every range partition but the first, for a new
+            DB. The default is None (hash partitions).
+        name : string, optional
+            Name of the DB. The default is the name of the directory.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.path = path
+        self.name = name if name else os.path.basename(
+            os.path.normpath(path))
+        layout = self.read_layout()
+        if bounds is not None:
+            bounds = [int(b) for b in bounds]
+            if partitions is None:
+                partitions = len(bounds) + 1
+        if layout is None:
+            layout = {'partitions': partitions if partitions else 16,
+                      'bounds': bounds}
+            if bounds is not None and sorted(bounds) != bounds:
+                raise ValueError('Partition bounds must be increasing')
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, LAYOUT), 'w') as f:
+                json.dump(layout, f)
+        elif (partitions and partitions != layout['partitions']) or \
+                (bounds is not None and bounds != layout['bounds']):
+            raise ValueError('{} holds another layout: {}'.format(
+                path, layout))
+        self.partitions = layout['partitions']
+        self.bounds = layout['bounds']
+        self.dfeat = pd.DataFrame()
+        self._sinks = {}
+
+    def read_layout(self):
+        """ Stored layout, hash partitions if only partitions are found """
+        try:
+            with open(os.path.join(self.path, LAYOUT)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        # Partitions written before layouts were stored
+        n = len(glob.glob(os.path.join(self.path, 'part_*')))
+        return {'partitions': n, 'bounds': None} if n else None
+
+    # Partitions
+    def partition_of(self, ids):
+        """ Partition of each user id """
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.bounds is None:
+            return ids % self.partitions
+        return np.searchsorted(self.bounds, ids, side='right')
+
+    def part_path(self, k):
+        """ Directory of partition 'k' """
+        return os.path.join(self.path, 'part_{:04d}'.format(k))
+
+    def pool(self, k):
+        """ The DB of partition 'k', read when its 'df' is used """
+        return DataPool(self.name, sink=DiskSink(self.part_path(k)))
+
+    def sink(self, k):
+        """ Sink of partition 'k', kept for the next chunks """
+        if k not in self._sinks:
+            self._sinks[k] = DiskSink(self.part_path(k))
+        return self._sinks[k]
+
+    def write(self, df):
+        """
+        Add the rows of a DataFrame to their partitions
+
+        Returns
+        -------
+        list of int, the partitions written
+
+        """
+        part = self.partition_of(df['id'])
+        written = np.unique(part).tolist()
+        for k in written:
+            self.sink(k).write(df.loc[part == k].reset_index(drop=True))
+            drop_ddiff(self.part_path(k))
+        return written
+
+    def write_partition(self, k, df):
+        """ Add the rows of a DataFrame, all of users of partition 'k' """
+        if not df.empty:
+            self.sink(k).write(df.reset_index(drop=True))
+            drop_ddiff(self.part_path(k))
+
+    def isEmpty(self):
+        """ Check if no partition holds rows """
+        return all(self.pool(k).isEmpty() for k in range(self.partitions))
+
+    def read(self, diffed=False):
+        """ All partitions as one DataFrame, sorted by partition """
+        if diffed:
+            frames = [pd.read_pickle(os.path.join(self.part_path(k), DDIFF))
+                      for k in range(self.partitions)
+                      if os.path.exists(os.path.join(self.part_path(k),
+                                                     DDIFF))]
+        else:
+            frames = [self.pool(k).df for k in range(self.partitions)]
+            frames = [f for f in frames if not f.empty]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    # Analytics
+    def run(self, stage, workers=None, parts=None, features=None):
+        """
+        Run an analytics stage on every partition in a process pool
+
+        Parameters
+        ----------
+        stage : string, see run_partition
+        workers : int, optional
+            Number of worker processes. The default is the number of cores.
+        parts : list of int, optional
+            Partitions to run. The default is all.
+        features : list of string, optional
+            Features of the 'features' stage. The default is all available.
+
+        Returns
+        -------
+        list of the results of the partitions, see run_partition
+
+        """
+        if stage not in STAGES:
+            raise ValueError('Unknown stage: ' + stage)
+        workers = workers if workers else os.cpu_count()
+        parts = list(range(self.partitions)) if parts is None else parts
+        n = len(parts)
+        args = ([self.part_path(k) for k in parts], [self.name] * n,
+                [stage] * n, [features] * n)
+        if workers == 1 or n <= 1:
+            return list(map(run_partition, *args))
+        with ProcessPoolExecutor(max_workers=min(workers, n)) as pool:
+            return list(pool.map(run_partition, *args))
+
+    def clean_data(self, workers=None, parts=None):
+        """
+        Clean every partition, return the rows, duplicates dropped and the
+        rows of the largest partition cleaned
+        """
+        res = [r for r in self.run('clean', workers, parts) if r]
+        rows = sum(r[0] for r in res)
+        return {'rows': rows, 'duplicates': rows - sum(r[1] for r in res),
+                'largest': max((r[0] for r in res), default=0)}
+
+    def diff_data(self, workers=None):
+        """ Diff every partition into its DDIFF, return the rows diff'd """
+        return sum(r for r in self.run('diff', workers) if r)
+
+    def normalize_data(self, workers=None):
+        """ Normalize every partition into its DDIFF, return the rows """
+        return sum(r for r in self.run('normalize', workers) if r)
+
+    def create_features(self, features=None, workers=None):
+        """
+        Create the features pr user of all partitions in 'dfeat'
+
+        Parameters
+        ----------
+        features : list of string, optional
+            See DataPool.create_features. The default is all available.
+        workers : int, optional
+            Number of worker processes. The default is the number of cores.
+
+        Returns
+        -------
+        None.
+
+        """
+        parts = [r for r in self.run('features', workers, features=features)
+                 if r is not None]
+        self.dfeat = pd.concat(parts).sort_index() if parts \
+            else pd.DataFrame()
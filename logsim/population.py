@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Population of HIs: config archetypes, parameter distributions, joining and
+leaving users.
+
+A population file holds named HI configurations ('configs', like
+configs/reference.json) and a 'population' spec, see
+configs/population.json:
+
+    "population": {
+        "users": 1000,
+        "first_id": 0,
+        "archetypes": {
+            "HI_cfg0": {"weight": 0.4,
+                        "params": {"min_period": {"choice": ["5h", "6h"]},
+                                   "estimators.ovd.inc_m":
+                                       {"uniform": ["40s", "80s"]}}},
+            "HI_cfg1": {"weight": 0.6}},
+        "join": {"uniform": ["0d", "180d"]},
+        "churn": {"fraction": 0.2, "after": {"uniform": ["30d", "365d"]}}
+    }
+
+Every user draws its archetype, its parameters, its join time and its
+leave time from its own random generator seeded by (seed, id), so a user
+looks the same in any shard of the population. Parameters are dotted
+config keys, their value is a constant or a distribution:
+{"choice": [values], "p": [weights]}, {"uniform": [low, high]} or
+{"normal": [mean, std]}. Durations ('40s', '6h', '30d') are drawn in secs
+and given as '<n>s'.
+
+The Lifecycle process creates an HI when its user joins and stops it when
+the user leaves, so the SimPy processes and the memory track the live
+fleet instead of the total fleet. Users join at the start of a day of the
+simulation, the first one after their drawn join time, so a joining HI
+charges and starts its sessions on the same daily schedule as the HIs
+there from the start.
+"""
+
+# %% Import essentials
+import copy
+import itertools
+import json
+import random
+import numpy as np
+import pandas as pd
+import logsim.ttime as tt
+from logsim.hi import HI
+
+# Never leaving
+NEVER = -1
+# Length of a day (secs), users join at the start of one
+DAY = 24 * 3600
+
+
+# %% Distributions
+def is_duration(x):
+    """ Check if 'x' is a duration string like '30m' or '2d:4h' """
+    return isinstance(x, str) and len(x) > 1 and x[-1] in 'smhd' \
+        and x[0] in '-0123456789'
+
+
+def draw(dist, rng):
+    """
+    Draw a value from a distribution
+
+    Parameters
+    ----------
+    dist : constant or dict
+        {"choice": [values], "p": [weights]}, {"uniform": [low, high]} or
+        {"normal": [mean, std]}, anything else is a constant.
+    rng : random.Random
+
+    Returns
+    -------
+    The value, durations as '<secs>s'
+
+    """
+    if not isinstance(dist, dict):
+        return dist
+    if 'choice' in dist:
+        return rng.choices(dist['choice'], weights=dist.get('p'))[0]
+    if 'uniform' in dist:
+        lo, hi = dist['uniform']
+        if is_duration(lo):
+            return '{}s'.format(rng.randint(tt.hms2sec(lo), tt.hms2sec(hi)))
+        if isinstance(lo, int) and isinstance(hi, int):
+            return rng.randint(lo, hi)
+        return rng.uniform(lo, hi)
+    if 'normal' in dist:
+        mu, sigma = dist['normal']
+        if is_duration(mu):
+            return '{}s'.format(round(rng.gauss(tt.hms2sec(mu),
+                                                tt.hms2sec(sigma))))
+        return rng.gauss(mu, sigma)
+    return dist
+
+
+def draw_secs(dist, rng):
+    """ Draw a duration in secs """
+    return tt.hms2sec(draw(dist, rng))
+
+
+def set_key(cfg, key, value):
+    """ Set the dotted 'key' (e.g. 'estimators.ovd.inc_m') in cfg """
+    *path, last = key.split('.')
+    for k in path:
+        cfg = cfg[k]
+    cfg[last] = value
+
+
+def override(cfg, overrides):
+    """
+    Copy of cfg with the dotted keys of 'overrides' set
+
+    Only the dicts on the paths of the keys are copied, the rest is shared
+    with cfg.
+
+    Parameters
+    ----------
+    cfg : JSON, HI configuration
+    overrides : dict of {dotted key: value}
+
+    Returns
+    -------
+    JSON, HI configuration
+
+    """
+    cfg = dict(cfg)
+    for key, value in overrides.items():
+        *path, last = key.split('.')
+        d = cfg
+        for k in path:
+            d[k] = dict(d[k])
+            d = d[k]
+        d[last] = value
+    return cfg
+
+
+# %% Population
+class Population:
+    """Class holding the users of a population spec"""
+
+    def __init__(self, spec, seed=None, ids=None):
+        """
+        Constructor of a Population
+
+        Parameters
+        ----------
+        spec : dict with 'configs' and 'population'
+        seed : int, optional
+            Seed of the per user random generators. The default is None
+            (a random seed).
+        ids : iterable of int, optional
+            Subset of the user ids, e.g. a shard. The default is None (all
+            users).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.spec = spec
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        pop = spec['population']
+        first = pop.get('first_id', 0)
+        self.ids = np.array(sorted(ids) if ids is not None else
+                            range(first, first + pop['users']),
+                            dtype=np.int64)
+        self.archetypes = list(pop['archetypes'])
+        self.weights = [pop['archetypes'][a].get('weight', 1)
+                        for a in self.archetypes]
+        # Archetype index, join and leave time (secs) pr user
+        self.archetype = np.zeros(len(self.ids), dtype=np.int16)
+        self.join = np.zeros(len(self.ids), dtype=np.int64)
+        self.leave = np.full(len(self.ids), NEVER, dtype=np.int64)
+        for k, i in enumerate(self.ids):
+            self.archetype[k], self.join[k], self.leave[k], _ = \
+                self.member(i)
+
+    def rng(self, id):
+        """ Random generator of the population draws of user 'id' """
+        return random.Random('{}:pop:{}'.format(self.seed, id))
+
+    def member(self, id):
+        """
+        Draw user 'id'
+
+        Returns
+        -------
+        (archetype index, join secs, leave secs or NEVER, rng)
+            The join is at the start of a day. The rng is ready to draw
+            the parameters of the user.
+
+        """
+        pop = self.spec['population']
+        rng = self.rng(id)
+        a = rng.choices(range(len(self.archetypes)), weights=self.weights)[0]
+        join = max(draw_secs(pop['join'], rng), 0) if 'join' in pop else 0
+        # Next day boundary, HIs start their day at their creation
+        join += -join % DAY
+        leave = NEVER
+        churn = pop.get('churn')
+        if churn and rng.random() < churn.get('fraction', 1.0):
+            # Users stay at least a sec
+            leave = join + max(draw_secs(churn['after'], rng), 1)
+        return a, join, leave, rng
+
+    def config(self, id):
+        """ HI configuration of user 'id', parameters drawn """
+        a, _, _, rng = self.member(id)
+        name = self.archetypes[a]
+        params = self.spec['population']['archetypes'][name].get('params')
+        if not params:
+            return self.spec['configs'][name]
+        cfg = copy.deepcopy(self.spec['configs'][name])
+        for key in sorted(params):
+            set_key(cfg, key, draw(params[key], rng))
+        return cfg
+
+    def keys(self):
+        """ User ids, like the keys of a users dict """
+        return self.ids.tolist()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def subset(self, ids):
+        """ Population of the users 'ids', e.g. a shard """
+        sub = copy.copy(self)
+        k = np.searchsorted(self.ids, sorted(ids))
+        sub.ids = self.ids[k]
+        sub.archetype = self.archetype[k]
+        sub.join = self.join[k]
+        sub.leave = self.leave[k]
+        return sub
+
+    def users(self):
+        """ All users as a dict of {id: HI config} """
+        return {i: self.config(i) for i in self.keys()}
+
+    def members(self):
+        """ DataFrame of id, archetype, join and leave (secs, -1 never) """
+        return pd.DataFrame({'id': self.ids,
+                             'archetype': np.array(self.archetypes)[
+                                 self.archetype],
+                             'join': self.join, 'leave': self.leave})
+
+    def events(self):
+        """ Join/leave events as sorted lists of (secs, leaving, id) """
+        left = self.leave != NEVER
+        t = np.concatenate([self.join, self.leave[left]])
+        leaving = np.concatenate([np.zeros(len(self.ids), dtype=bool),
+                                  np.ones(left.sum(), dtype=bool)])
+        ids = np.concatenate([self.ids, self.ids[left]])
+        # Users leave before others join at the same time
+        k = np.lexsort((ids, ~leaving, t))
+        return zip(t[k].tolist(), leaving[k].tolist(), ids[k].tolist())
+
+    def active(self, t):
+        """ Number of users active at time 't' (secs) """
+        return int(((self.join <= t) & ((self.leave == NEVER)
+                                        | (self.leave > t))).sum())
+
+
+def load_population(fname, seed=None):
+    """ Load a Population from a JSON file with 'configs' and 'population' """
+    with open(fname) as f:
+        return Population(json.load(f), seed)
+
+
+# %% Lifecycle
+class Lifecycle:
+    """Class creating the HIs of a Population as users join and leave"""
+
+    def __init__(self, env, cdp, pop, rng=None):
+        """
+        Constructor of a Lifecycle, starts its SimPy process
+
+        Parameters
+        ----------
+        env : simpy.env
+        cdp : CDP, Common Data Platform
+        pop : Population
+        rng : function, optional
+            rng(id) returns the random generator of HI 'id'. The default
+            is None (the random module).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.env = env
+        self.cdp = cdp
+        self.pop = pop
+        self.rng = rng
+        # Config overrides of the joining users, see override()
+        self.overrides = None
+        # Live HIs {id: HI}
+        self.active = {}
+        self.joined = 0
+        self.left = 0
+        self.peak = 0
+        # Number of join/leave events done
+        self.done = 0
+        self.proc = self.env.process(self.run())
+
+    def __getstate__(self):
+        """ State for a snapshot, without the SimPy environment """
+        return {k: v for k, v in self.__dict__.items()
+                if k not in ['env', 'proc']}
+
+    def run(self, wake=None):
+        """ Create and stop the HIs at their join and leave times """
+        for t, leaving, id in itertools.islice(self.pop.events(), self.done,
+                                               None):
+            if t > self.env.now:
+                yield self.env.timeout(t - self.env.now)
+            if leaving:
+                self.active.pop(id).stop()
+                self.left += 1
+            else:
+                cfg = self.pop.config(id)
+                if self.overrides:
+                    cfg = override(cfg, self.overrides)
+                self.active[id] = HI(id, self.env, self.cdp, cfg,
+                                     rng=self.rng(id) if self.rng else random)
+                self.joined += 1
+                self.peak = max(self.peak, len(self.active))
+            self.done += 1
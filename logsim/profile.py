@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of the simulation core.
+
+While a Profiler is installed, the SimPy process generators of the HI
+components are wrapped to count their resumes, the timeouts and other
+events they yield and the wall time spent in them, pr process kind and
+pr HI. DataPool.put/put_many are wrapped to count rows and time, this
+time is included in the time of the calling process (App.run, FSW.run).
+Nothing is wrapped when no Profiler is installed, so the overhead is zero.
+
+Usage:
+    with Profiler() as prof:
+        cdp = runner.simulate(users, until)
+    print(prof.table())
+    prof.save('profile.json')
+"""
+
+# %% Import essentials
+import json
+from time import perf_counter
+import pandas as pd
+import simpy
+from logsim.app import App
+from logsim.datapool import DataPool
+from logsim.fsw import FSW
+from logsim.hi import HI, Estimator
+
+# Process generators to profile: (class, method, kind)
+PROCESSES = [(Estimator, 'run', 'Estimator.run'),
+             (HI, 'run_detectors', 'HI.run_detectors'),
+             (HI, 'run_sessions', 'HI.run_sessions'),
+             (HI, 'run_daily', 'HI.run_daily'),
+             (App, 'run', 'App.run'),
+             (FSW, 'run', 'FSW.run')]
+_active = None
+
+
+def hi_id(obj):
+    """ ID of the HI a component belongs to """
+    return obj.id if isinstance(obj, HI) else obj.HI.id
+
+
+def profiled(gen, rec):
+    """
+    Run the process generator 'gen', accounting in 'rec'
+
+    rec is a list of [processes, resumes, timeouts, other events, secs].
+    Values sent and exceptions thrown (e.g. simpy.Interrupt) are passed on
+    to 'gen'.
+    """
+    rec[0] += 1
+    value = None
+    exc = None
+    while True:
+        t0 = perf_counter()
+        try:
+            event = gen.throw(exc) if exc else gen.send(value)
+        except StopIteration as e:
+            rec[1] += 1
+            rec[4] += perf_counter() - t0
+            return e.value
+        except BaseException:
+            rec[4] += perf_counter() - t0
+            raise
+        rec[1] += 1
+        rec[4] += perf_counter() - t0
+        if isinstance(event, simpy.Timeout):
+            rec[2] += 1
+        else:
+            rec[3] += 1
+        try:
+            value = yield event
+            exc = None
+        except GeneratorExit:
+            gen.close()
+            raise
+        except BaseException as e:
+            value = None
+            exc = e
+
+
+class Profiler:
+    """Class collecting process and DataPool accounting of simulations"""
+
+    def __init__(self):
+        """ Constructor of a Profiler, install() to start profiling """
+        # {(kind, HI id): [processes, resumes, timeouts, other, secs]}
+        self.procs = {}
+        # {DB name: [calls, rows, secs]}
+        self.pools = {}
+        self.originals = {}
+
+    def install(self):
+        """ Wrap the process generators and DataPool puts """
+        global _active
+        if _active is not None:
+            raise RuntimeError('A Profiler is already installed')
+        _active = self
+        for cls, name, kind in PROCESSES:
+            self.originals[(cls, name)] = getattr(cls, name)
+            setattr(cls, name, self.wrap_process(getattr(cls, name), kind))
+        for name in ['put', 'put_many']:
+            self.originals[(DataPool, name)] = getattr(DataPool, name)
+            setattr(DataPool, name,
+                    self.wrap_put(getattr(DataPool, name), name == 'put'))
+
+    def uninstall(self):
+        """ Restore the original methods """
+        global _active
+        for (cls, name), func in self.originals.items():
+            setattr(cls, name, func)
+        self.originals = {}
+        _active = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    def wrap_process(self, func, kind):
+        """ Wrapper of a process generator method """
+        procs = self.procs
+
+        def wrapper(obj, *args, **kwargs):
+            key = (kind, hi_id(obj))
+            if key not in procs:
+                procs[key] = [0, 0, 0, 0, 0.0]
+            return profiled(func(obj, *args, **kwargs), procs[key])
+        return wrapper
+
+    def wrap_put(self, func, single):
+        """ Wrapper of DataPool.put/put_many """
+        pools = self.pools
+
+        def wrapper(dp, data):
+            if not single and not isinstance(data, pd.DataFrame):
+                data = list(data)
+            t0 = perf_counter()
+            func(dp, data)
+            rec = pools.setdefault(dp.name, [0, 0, 0.0])
+            rec[0] += 1
+            rec[1] += 1 if single else len(data)
+            rec[2] += perf_counter() - t0
+        return wrapper
+
+    # Export
+    def table(self, per_hi=False):
+        """
+        Process accounting as a DataFrame
+
+        Parameters
+        ----------
+        per_hi : bool, optional
+            One row pr process kind and HI. The default is False (one row
+            pr process kind).
+
+        Returns
+        -------
+        DataFrame
+
+        """
+        df = pd.DataFrame([[kind, id] + rec for (kind, id), rec
+                           in self.procs.items()],
+                          columns=['kind', 'id', 'processes', 'resumes',
+                                   'timeouts', 'other-events', 'secs'])
+        if not per_hi:
+            df = df.drop(columns=['id']).groupby('kind').sum()
+        df['us-pr-resume'] = 1e6 * df['secs'] / df['resumes']
+        return df
+
+    def pool_table(self):
+        """ DataPool accounting as a DataFrame """
+        df = pd.DataFrame([[name] + rec for name, rec in self.pools.items()],
+                          columns=['pool', 'calls', 'rows', 'secs'])
+        df['us-pr-row'] = 1e6 * df['secs'] / df['rows']
+        return df.set_index('pool')
+
+    def to_dict(self):
+        """ All accounting as a JSON serializable dict """
+        return {'processes': self.table(per_hi=True).to_dict('records'),
+                'pools': self.pool_table().reset_index().to_dict('records')}
+
+    def save(self, fname):
+        """ Save the accounting as JSON """
+        with open(fname, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def report(self):
+        """ Print the accounting pr process kind and pr DataPool """
+        with pd.option_context('display.width', 120,
+                               'display.max_columns', 20):
+            print(self.table())
+            print(self.pool_table())
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+Batch reports: the daily and monthly charts of many users rendered to
+files.
+
+DataPool.plot_daily and plot_monthly draw the charts of one user on the
+screen. A report prepares the plot data of the DB once
+(DataPool.prepare_plot_data), slices the rows of every user out of the
+per user index (DataPool.index), and renders the pages headless in a
+process pool. Every worker draws its pages by updating the bars of one
+figure drawn once. The pages are PNG files, or one multi-page PDF pr
+worker part, with an index.html linking them:
+
+    dp = cdp.getAppDaily()
+    render_report(dp, 'report', kinds=['daily', 'monthly'], workers=4)
+
+Usage:
+    python -m logsim report --ver 01 [--fmt parquet] --out report \\
+        [--kinds daily monthly] [--pages png|pdf] [--workers 4]
+"""
+
+# %% Import essentials
+import html
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+import logsim.ttime as tt
+from logsim.datapool import plot_columns
+
+# Charts of a page, as drawn by DataPool.plot_data: (title, stacked
+# columns, colors, y label)
+CHARTS = [('Speech Overview', ['OwnVoice', 'Speech'],
+           ['gold', 'darkgoldenrod'], 'Percentage (%)'),
+          ('OVR pr SNR Overview', ['OVD-snr-low', 'OVD-snr-med',
+                                   'OVD-snr-high'],
+           ['orangered', 'orange', 'greenyellow'], 'Percentage (%)'),
+          ('Usage Overview', ['Usage Low', 'Usage OK', 'Charge'],
+           ['red', 'limegreen', 'steelblue'], 'Hours')]
+KINDS = ['daily', 'monthly']
+
+
+# %% Plot data
+def report_kinds(dp, kinds=None):
+    """
+    Kinds of pages of a report of 'dp', checked up front
+
+    Daily pages need the counters of the App DBs, monthly pages also need
+    the times of the rows (calendar rollups).
+
+    Parameters
+    ----------
+    dp : DataPool
+    kinds : list of string, optional
+        'daily' and/or 'monthly'. The default is the kinds of the DB.
+
+    Raises
+    ------
+    ValueError
+        If the DB can't be drawn as some of the kinds.
+
+    Returns
+    -------
+    list of string
+
+    """
+    keys = set(dp.df.keys())
+    supported = []
+    if {'usage', 'speech', 'ovd'} <= keys:
+        supported = KINDS if 'time' in keys else ['daily']
+    if kinds is None:
+        kinds = supported
+    if not kinds:
+        raise ValueError('No report pages of {}, rows without usage, '
+                         'speech and ovd'.format(dp.name))
+    unknown = [k for k in kinds if k not in KINDS]
+    if unknown:
+        raise ValueError('Unknown report kinds {}, use {}'.format(unknown,
+                                                                  KINDS))
+    missing = [k for k in kinds if k not in supported]
+    if missing:
+        raise ValueError('No {} pages of {}, rows without {}. Kinds of {}: '
+                         '{}'.format(', '.join(missing), dp.name,
+                                     'times' if supported else 'usage',
+                                     dp.name, supported))
+    return list(kinds)
+
+
+def report_pages(dp, kinds=None, ids=None, days=31, last_day=-1):
+    """
+    Plot data of every page of a report, in one pass over the DB
+
+    Parameters
+    ----------
+    dp : DataPool
+    kinds : list of string, optional
+        'daily' and/or 'monthly', see report_kinds. The default is the
+        kinds of the DB.
+    ids : list of int, optional
+        Users of the report. The default is all users.
+    days, last_day : int, optional
+        Rows of the daily page, as DataPool.plot_daily.
+
+    Returns
+    -------
+    charts : list of the CHARTS in the DB
+    pages : list of (user id, kind, x labels, values of the chart columns
+        and the threshold)
+    x_label : string
+
+    """
+    kinds = report_kinds(dp, kinds)
+    dp.prepare_plot_data()
+    # Rows of each user are consecutive in the index
+    idx = dp.index(diffed=True)
+    d = idx.df
+    charts = [c for c in CHARTS if set(c[1]) <= set(d.keys())]
+    cols = [col for c in charts for col in c[1]] + ['Threshold']
+    values = d[cols].to_numpy(np.float64)
+    if 'time' in d.keys():
+        labels = tt.times2date(d['time'].to_numpy())
+        x_label = 'Date'
+    else:
+        labels = d['power_cycle'].to_numpy().astype(str)
+        x_label = 'Sessions'
+    months = {}
+    if 'monthly' in kinds:
+        # Calendar months, as DataPool.plot_monthly
+        r = dp.rollup('month')
+        plot_columns(r)
+        m_values = r[cols].to_numpy(np.float64)
+        m_labels = tt.times2date(r['time'].to_numpy())
+        m_ids, first = np.unique(r['id'].to_numpy(), return_index=True)
+        last = np.append(first[1:], len(r))
+        months = {u: (m_labels[a:b], m_values[a:b])
+                  for u, a, b in zip(m_ids.tolist(), first, last)}
+    wanted = None if ids is None else set(ids)
+    pages = []
+    for u, a, b in zip(idx.ids.tolist(), idx.first.tolist(),
+                       idx.last.tolist()):
+        if wanted is not None and u not in wanted:
+            continue
+        for kind in kinds:
+            if kind == 'daily':
+                sel = np.arange(a, b)[last_day - days:last_day]
+                pages.append((u, kind, labels[sel], values[sel]))
+            else:
+                pages.append((u, kind) + months[u])
+    return charts, pages, x_label
+
+
+# %% Rendering
+def page_name(user_id, kind, ext='png'):
+    """ File name of a page """
+    return 'user_{}_{}.{}'.format(user_id, kind, ext)
+
+
+class PageFigure:
+    """Class holding a figure drawn once and updated for every page"""
+
+    def __init__(self, charts, rows, x_label):
+        """
+        Constructor of a PageFigure, creates the bars of all charts
+
+        Parameters
+        ----------
+        charts : list of CHARTS
+        rows : int, number of bars pr chart
+        x_label : string
+
+        Returns
+        -------
+        None.
+
+        """
+        self.fig = Figure(figsize=(10, 3.5 * len(charts)),
+                          constrained_layout=True)
+        self.axes = self.fig.subplots(len(charts), 1, squeeze=False)[:, 0]
+        self.charts = charts
+        x = np.arange(rows)
+        zero = np.zeros(rows)
+        # Bar containers pr chart column, in the order of the values
+        self.bars = []
+        for ax, (title, cols, colors, y_label) in zip(self.axes, charts):
+            for name, color in zip(cols, colors):
+                self.bars.append(ax.bar(x, zero, 0.5, color=color,
+                                        label=name))
+            ax.set_title(title)
+            ax.set_ylabel(y_label)
+            ax.set_xticks(x)
+            ax.set_xticklabels([''] * rows, rotation=90)
+        # Threshold of the usage chart
+        self.threshold, = self.axes[-1].plot(
+            x, zero, linestyle='dotted', color='black', label='Threshold')
+        self.axes[-1].set_xlabel(x_label)
+        for ax in self.axes:
+            ax.legend(loc='upper right')
+        self.title = self.fig.suptitle('')
+        self.laid_out = False
+
+    def draw(self, page):
+        """ Update the figure to show 'page', see report_pages """
+        user_id, kind, labels, values = page
+        col = 0
+        for k, (ax, (_, cols, _, _)) in enumerate(zip(self.axes,
+                                                      self.charts)):
+            bottom = np.zeros(len(labels))
+            for _ in cols:
+                for rect, y, h in zip(self.bars[col], bottom,
+                                      values[:, col]):
+                    rect.set_y(y)
+                    rect.set_height(h)
+                bottom += values[:, col]
+                col += 1
+            if k == len(self.charts) - 1:
+                bottom = np.maximum(bottom, values[:, -1])
+            top = bottom.max() if len(bottom) else 0
+            ax.set_ylim(0, 1.05 * top if top > 0 else 1)
+            ax.set_xticklabels(labels)
+        self.threshold.set_ydata(values[:, -1])
+        self.title.set_text('HI #{}, {} view'.format(user_id,
+                                                     kind.capitalize()))
+
+    def save(self, target, **kwargs):
+        """ Save the figure to a file name or a PdfPages """
+        if isinstance(target, PdfPages):
+            target.savefig(self.fig, **kwargs)
+        else:
+            self.fig.savefig(target, **kwargs)
+        if not self.laid_out:
+            # Pages of the same size share the layout of the first one,
+            # set_layout_engine is matplotlib >= 3.6
+            if hasattr(self.fig, 'set_layout_engine'):
+                self.fig.set_layout_engine(None)
+            else:
+                self.fig.set_constrained_layout(False)
+            self.laid_out = True
+
+
+def render_pages(charts, pages, x_label, out, pages_fmt='png', part=0,
+                 dpi=80):
+    """
+    Render pages on reused figures, one pr number of rows
+
+    Parameters
+    ----------
+    charts, pages, x_label : see report_pages
+    out : string, output directory
+    pages_fmt : string, optional
+        'png' (a file pr page) or 'pdf' (one file of all pages). The
+        default is 'png'.
+    part : int, optional
+        Number of the PDF file. The default is 0.
+    dpi : int, optional
+        Resolution of PNG pages. The default is 80.
+
+    Returns
+    -------
+    list of (user id, kind, file name)
+
+    """
+    figures = {}
+
+    def figure(page):
+        rows = len(page[2])
+        if rows not in figures:
+            figures[rows] = PageFigure(charts, rows, x_label)
+        figures[rows].draw(page)
+        return figures[rows]
+    res = []
+    if pages_fmt == 'pdf':
+        fname = 'report_{:03d}.pdf'.format(part)
+        with PdfPages(os.path.join(out, fname)) as pdf:
+            for page in pages:
+                figure(page).save(pdf)
+                res.append((page[0], page[1], fname))
+        return res
+    for page in pages:
+        fname = page_name(page[0], page[1])
+        figure(page).save(os.path.join(out, fname), dpi=dpi)
+        res.append((page[0], page[1], fname))
+    return res
+
+
+def write_index(out, files, kinds):
+    """ Write index.html linking the pages of every user """
+    links = {}
+    for user_id, kind, fname in files:
+        links.setdefault(user_id, {})[kind] = fname
+    rows = []
+    for user_id in sorted(links):
+        cells = ''.join(
+            '<td><a href="{0}">{1}</a></td>'.format(
+                html.escape(links[user_id][k]), k) if k in links[user_id]
+            else '<td></td>' for k in kinds)
+        rows.append('<tr><td>HI #{}</td>{}</tr>'.format(user_id, cells))
+    with open(os.path.join(out, 'index.html'), 'w') as f:
+        f.write('<html><head><title>logsim report</title></head><body>\n'
+                '<h1>logsim report, {} users</h1>\n<table>\n{}\n</table>\n'
+                '</body></html>\n'.format(len(links), '\n'.join(rows)))
+
+
+def render_report(dp, out, kinds=None, ids=None, pages_fmt='png',
+                  workers=None, parts=None, days=31, dpi=80):
+    """
+    Render the charts of many users to files
+
+    Parameters
+    ----------
+    dp : DataPool, an App DB
+    out : string, output directory
+    kinds : list of string, optional
+        'daily' and/or 'monthly', see report_kinds. The default is the
+        kinds of the DB.
+    ids : list of int, optional
+        Users of the report. The default is all users.
+    pages_fmt : string, optional
+        'png' or 'pdf', see render_pages. The default is 'png'.
+    workers : int, optional
+        Number of worker processes. The default is the number of cores.
+    parts : int, optional
+        Number of parts of consecutive users, one PDF file pr part. The
+        default is a part pr worker for PDF, else 4 pr worker.
+    days : int, optional
+        Days of the daily pages. The default is 31.
+    dpi : int, optional
+        Resolution of PNG pages. The default is 80.
+
+    Returns
+    -------
+    string, file name of the index
+
+    """
+    workers = workers if workers else os.cpu_count()
+    if not parts:
+        parts = workers if pages_fmt == 'pdf' else 4 * workers
+    kinds = report_kinds(dp, kinds)
+    os.makedirs(out, exist_ok=True)
+    charts, pages, x_label = report_pages(dp, kinds, ids, days)
+    # The pages of a user stay in one part
+    users = len(pages) // len(kinds)
+    bounds = len(kinds) * np.linspace(0, users, min(parts, users) + 1,
+                                      dtype=int)
+    chunks = [pages[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    n = len(chunks)
+    args = ([charts] * n, chunks, [x_label] * n, [out] * n,
+            [pages_fmt] * n, range(n), [dpi] * n)
+    if workers == 1:
+        results = list(map(render_pages, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(render_pages, *args))
+    write_index(out, [f for r in results for f in r], kinds)
+    return os.path.join(out, 'index.html')
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Fleet runner: simulate a fleet of HIs sharded over a process pool.
+
+HIs never interact, so the user IDs are partitioned into shards, each
+shard is simulated in its own simpy.Environment and CDP, and the pools of
+all shards are merged into one CDP sorted by (id, power_cycle), or every
+shard writes its partition of the pools on disk (run_partitioned).
+Every HI draws from its own random generator seeded by (seed, id), so the
+result does not depend on the number of workers or shards.
+A population file (see logsim.population) is simulated with HIs created
+as their users join and stopped as they leave.
+
+Usage:
+    python -m logsim.runner configs/reference.json --until 372d:4h \\
+        --workers 4 --seed 1 --ver 01 [--fmt parquet] [--cache .logsim_cache]
+    python -m logsim.runner configs/reference.json --until 1116d --seed 1 \\
+        --spill spill_dir
+    python -m logsim.runner configs/population.json --until 372d --seed 1
+    python -m logsim.runner configs/reference.json --until 372d --seed 1 \\
+        --parts parts_dir
+    python -m logsim.runner configs/reference.json --until 31d --seed 1 \\
+        --profile profile.json
+The same runs are 'python -m logsim run ...', see logsim.__main__.
+"""
+
+# %% Import essentials
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from logsim.datapool import CDP
+from logsim.partition import PartitionedPool
+from logsim.population import Population
+from logsim.simulation import Simulation
+
+POOLS = ['app_daily', 'app_hourly', 'fsw_daily', 'fsw_monthly']
+
+
+# %% Configuration
+def load_users(fname, **overrides):
+    """
+    Load HI configurations and the user mapping from a JSON file
+
+    The file holds a dict of named HI configurations ('configs') and a
+    list of ['config name', first id, last id + 1] ranges ('users'),
+    see configs/reference.json.
+
+    Parameters
+    ----------
+    fname : string
+    overrides : optional
+        Configuration keys to override in all configurations
+
+    Returns
+    -------
+    dict of {id: HI config}
+
+    """
+    with open(fname) as f:
+        spec = json.load(f)
+    users = {}
+    for name, first, last in spec['users']:
+        cfg = dict(spec['configs'][name], **overrides)
+        for i in range(first, last):
+            users[i] = cfg
+    return users
+
+
+def load_fleet(fname, seed=None, **overrides):
+    """
+    Load the users of a JSON file
+
+    Returns
+    -------
+    Population if the file holds a 'population' spec, else a dict of
+    {id: HI config}, see load_users. The overrides apply to the configs.
+
+    """
+    with open(fname) as f:
+        spec = json.load(f)
+    if 'population' not in spec:
+        return load_users(fname, **overrides)
+    spec['configs'] = {name: dict(cfg, **overrides)
+                       for name, cfg in spec['configs'].items()}
+    return Population(spec, seed)
+
+
+# %% Simulation
+def simulate(users, until, seed=None, cdp=None):
+    """
+    Simulate the HIs in 'users' in one simpy.Environment
+
+    Parameters
+    ----------
+    users : dict of {id: HI config} or Population
+        The HIs of a Population are created as their users join.
+    until : int, end of simulation (secs)
+    seed : int, optional
+        Seed of the per HI random generators. The default is None.
+    cdp : CDP, optional
+        CDP to fill. The default is None (create a new one).
+
+    Returns
+    -------
+    cdp : CDP
+
+    """
+    return Simulation(users, seed, cdp).run(until).result()
+
+
+def run_shard(users, until, seed):
+    """Simulate a shard, return the pools as DataFrames"""
+    cdp = simulate(users, until, seed)
+    return {p: getattr(cdp, p).df for p in POOLS}
+
+
+def merge_pools(shards, cdp=None):
+    """Merge shard results into one CDP sorted by (id, power_cycle)"""
+    cdp = cdp if cdp else CDP()
+    for p in POOLS:
+        frames = [s[p] for s in shards if not s[p].empty]
+        if not frames:
+            continue
+        # Stable sort, samples of a session stay in time order
+        df = pd.concat(frames, ignore_index=True)
+        df = df.sort_values(by=['id', 'power_cycle'], kind='stable')
+        getattr(cdp, p).put_many(df)
+    return cdp
+
+
+def shard_ids(ids, n_shards):
+    """Partition the ids in 'n_shards' contiguous shards"""
+    ids = sorted(ids)
+    if not ids:
+        return []
+    size = -(-len(ids) // n_shards)
+    return [ids[k:k + size] for k in range(0, len(ids), size)]
+
+
+def run_fleet(users, until, seed=None, workers=None, shards=None):
+    """
+    Simulate a fleet of HIs sharded over a process pool
+
+    Parameters
+    ----------
+    users : dict of {id: HI config} or Population
+    until : int, end of simulation (secs)
+    seed : int, optional
+        Seed of the per HI random generators. The default is None.
+    workers : int, optional
+        Number of worker processes. The default is the number of cores.
+    shards : int, optional
+        Number of shards. The default is 4 pr worker.
+
+    Returns
+    -------
+    cdp : CDP
+
+    """
+    workers = workers if workers else os.cpu_count()
+    shards = shards if shards else 4 * workers
+    parts = [users.subset(ids) if isinstance(users, Population)
+             else {i: users[i] for i in ids}
+             for ids in shard_ids(users.keys(), shards)]
+    if workers == 1:
+        results = [run_shard(p, until, seed) for p in parts]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            n = len(parts)
+            results = list(pool.map(run_shard, parts, [until] * n,
+                                    [seed] * n))
+    return merge_pools(results)
+
+
+def write_shard(users, until, seed, out, k):
+    """Simulate a shard, write its pools to partition 'k' in 'out'"""
+    cdp = simulate(users, until, seed)
+    rows = {}
+    for p in POOLS:
+        # Sorted as merge_pools, the partitions in order are the merged DB
+        df = getattr(cdp, p).df
+        if not df.empty:
+            df = df.sort_values(by=['id', 'power_cycle'], kind='stable')
+        PartitionedPool(os.path.join(out, p)).write_partition(k, df)
+        rows[p] = len(df)
+    return rows
+
+
+def run_partitioned(users, until, out, seed=None, workers=None, shards=None):
+    """
+    Simulate a fleet sharded over a process pool, every shard writing its
+    partition of the pools on disk, see logsim.partition
+
+    Parameters
+    ----------
+    users : dict of {id: HI config} or Population
+    until : int, end of simulation (secs)
+    out : string
+        Directory of the pools, one PartitionedPool pr pool. Rows of an
+        earlier run are removed.
+    seed : int, optional
+        Seed of the per HI random generators. The default is None.
+    workers : int, optional
+        Number of worker processes. The default is the number of cores.
+    shards : int, optional
+        Number of shards and partitions. The default is 4 pr worker.
+
+    Returns
+    -------
+    dict of {pool name: PartitionedPool}
+
+    """
+    workers = workers if workers else os.cpu_count()
+    shards = shards if shards else 4 * workers
+    ids = shard_ids(users.keys(), shards)
+    parts = [users.subset(s) if isinstance(users, Population)
+             else {i: users[i] for i in s} for s in ids]
+    # Range partitions on the first id of each shard
+    pools = {}
+    for p in POOLS:
+        shutil.rmtree(os.path.join(out, p), ignore_errors=True)
+        pools[p] = PartitionedPool(os.path.join(out, p),
+                                   bounds=[s[0] for s in ids[1:]])
+    n = len(parts)
+    args = (parts, [until] * n, [seed] * n, [out] * n, range(n))
+    if workers == 1:
+        list(map(write_shard, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(write_shard, *args))
+    return pools
+
+
+# %% Main
+if __name__ == '__main__':
+    # Same as python -m logsim run, see logsim.__main__
+    from logsim.__main__ import main
+    main(['run'] + sys.argv[1:])
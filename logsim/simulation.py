@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Simulations that can be snapshot, restored and forked.
+
+Scenario studies often share a warm-up and differ only after it, e.g. in
+the FSW visits or the App interval. A Simulation is run up to the end of
+the warm-up once, its state is snapshot and every scenario is forked from
+the snapshot with its config overrides:
+
+    sim = Simulation(users, seed=1).run(until=tt.hms2sec('90d'))
+    for visits in [[1, 6, 12], [1, 4, 8, 12]]:
+        fork = sim.fork({'fsw.visits': visits})
+        cdp = fork.run(until=tt.hms2sec('372d')).result()
+
+A snapshot holds the HIs (RAM/NVRAM, estimator lengths, random generators,
+session state, App timelog), the population and the CDP so far. The SimPy
+processes cannot be pickled, instead the pending event of every process is
+recorded. A restored process waits for that event and continues from the
+state in its object. The processes are restarted in the order of their
+pending events, so a restored simulation gives the same DB's as one that
+was never interrupted. Finding the pending events relies on internals
+of SimPy 4 (the event queue and the resume callback of a process), see
+check_simpy.
+"""
+
+# %% Import essentials
+import functools
+import os
+import pickle
+import random
+import simpy
+import logsim.ttime as tt
+from logsim.datapool import CDP
+from logsim.hi import HI
+from logsim.population import Lifecycle, Population, override
+from logsim.sink import DiskSink
+
+
+def hi_rng(seed, id):
+    """Random generator of HI 'id', the random module if no seed"""
+    if seed is None:
+        return random
+    return random.Random('{}:{}'.format(seed, id))
+
+
+def check_simpy(env):
+    """Check that SimPy has the internals snapshots depend on"""
+    queue = getattr(env, '_queue', None)
+    if not isinstance(queue, list) \
+            or not callable(getattr(simpy.Process, '_resume', None)) \
+            or any(len(item) != 4 for item in queue[:1]):
+        raise RuntimeError(
+            'Snapshots need the event queue (Environment._queue) and '
+            'Process._resume of SimPy 4, not found in SimPy {}'.format(
+                getattr(simpy, '__version__', '?')))
+
+
+class Simulation:
+    """Class holding a simulation of HIs that can be snapshot and forked"""
+
+    def __init__(self, users, seed=None, cdp=None):
+        """
+        Constructor of a Simulation, creates the HIs
+
+        Parameters
+        ----------
+        users : dict of {id: HI config} or Population
+            The HIs of a Population are created as their users join.
+        seed : int, optional
+            Seed of the per HI random generators. The default is None.
+        cdp : CDP, optional
+            CDP to fill. The default is None (create a new one).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.env = simpy.Environment()
+        self.cdp = cdp if cdp else CDP()
+        self.seed = seed
+        self.his = {}
+        self.lifecycle = None
+        if isinstance(users, Population):
+            self.lifecycle = Lifecycle(self.env, self.cdp, users,
+                                       rng=functools.partial(hi_rng, seed))
+        else:
+            for i in sorted(users):
+                self.his[i] = HI(i, self.env, self.cdp, users[i],
+                                 rng=hi_rng(seed, i))
+
+    @property
+    def now(self):
+        """ Simulated time (secs) """
+        return self.env.now
+
+    def live(self):
+        """ The HIs simulated now """
+        if self.lifecycle:
+            return list(self.lifecycle.active.values())
+        return list(self.his.values())
+
+    def run(self, until):
+        """ Run until 'until' (secs from the start), return self """
+        self.env.run(until=until)
+        return self
+
+    def result(self):
+        """ The CDP, rows buffered are handed to the sinks """
+        # Spilled DB's are complete on disk
+        self.cdp.flush()
+        return self.cdp
+
+    # Snapshots
+    def pending(self):
+        """
+        Pending event of every live process
+
+        Returns
+        -------
+        Sorted list of (order, HI id or None, process index, wake)
+            'wake' is the time of the pending timeout or tt.ASLEEP for a
+            process waiting for the session start, None for the Lifecycle
+            and processes not started yet.
+
+        """
+        check_simpy(self.env)
+        queued = {id(ev): (t, prio, eid)
+                  for t, prio, eid, ev in self.env._queue}
+        res = []
+        if self.lifecycle and self.lifecycle.proc.is_alive:
+            ev = self.lifecycle.proc.target
+            res.append(((0,) + queued[id(ev)], None, 0, None))
+        for hi in self.live():
+            for k, p in enumerate(hi.procs):
+                if p is None or not p.is_alive:
+                    continue
+                ev = p.target
+                if id(ev) in queued:
+                    t, prio, eid = queued[id(ev)]
+                    wake = None if isinstance(ev, simpy.events.Initialize) \
+                        else t
+                    res.append(((0, t, prio, eid), hi.id, k, wake))
+                else:
+                    # Waiting for the session start, in callback order
+                    res.append(((1, hi.id, ev.callbacks.index(p._resume)),
+                                hi.id, k, tt.ASLEEP))
+        return sorted(res, key=lambda r: r[0])
+
+    def snapshot(self):
+        """ The state of the simulation as bytes, see restore() """
+        state = {'now': self.env.now, 'cdp': self.cdp, 'seed': self.seed,
+                 'his': self.his, 'lifecycle': self.lifecycle,
+                 'pending': [r[1:] for r in self.pending()],
+                 # Unseeded HIs draw from the random module
+                 'random': random.getstate() if self.seed is None else None}
+        return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def save(self, fname):
+        """ Save a snapshot """
+        with open(fname, 'wb') as f:
+            f.write(self.snapshot())
+
+    @staticmethod
+    def load(fname, overrides=None, spill=None):
+        """ Restore a saved snapshot, see restore() """
+        with open(fname, 'rb') as f:
+            return Simulation.restore(f.read(), overrides, spill)
+
+    @staticmethod
+    def restore(snapshot, overrides=None, spill=None):
+        """
+        Restore a Simulation from a snapshot
+
+        Parameters
+        ----------
+        snapshot : bytes, see snapshot()
+        overrides : dict of {dotted config key: value}, optional
+            Config changes of the HIs from now on, e.g. {'fsw.visits':
+            [1, 3, 12], 'app.interval': '30m'}. The layout of the HI memory
+            cannot change. The default is None.
+        spill : string, optional
+            Directory for the DB chunks of a spilled CDP, the chunks spilled
+            so far are copied. Required if the CDP was spilled. The default
+            is None.
+
+        Returns
+        -------
+        Simulation
+
+        """
+        state = pickle.loads(snapshot)
+        sim = Simulation.__new__(Simulation)
+        sim.env = simpy.Environment(initial_time=state['now'])
+        sim.cdp = state['cdp']
+        sim.seed = state['seed']
+        sim.his = state['his']
+        sim.lifecycle = state['lifecycle']
+        if state['random'] is not None:
+            random.setstate(state['random'])
+        for dp in sim.cdp.pools():
+            if isinstance(dp.sink, DiskSink):
+                if not spill:
+                    raise ValueError('A spilled simulation is restored into '
+                                     'a new spill directory')
+                dp.sink = dp.sink.copy(os.path.join(spill, dp.name))
+        his = {hi.id: hi for hi in sim.live()}
+        for hi in his.values():
+            hi.attach(sim.env)
+        if sim.lifecycle:
+            sim.lifecycle.env = sim.env
+        if overrides:
+            # HIs sharing a config keep sharing it
+            cfgs = {}
+            for hi in his.values():
+                if id(hi.cfg) not in cfgs:
+                    cfgs[id(hi.cfg)] = override(hi.cfg, overrides)
+                hi.reconfigure(cfgs[id(hi.cfg)])
+            if sim.lifecycle:
+                sim.lifecycle.overrides = dict(sim.lifecycle.overrides or {},
+                                               **overrides)
+        # Restart the processes in the order of their pending events
+        for id_, k, wake in state['pending']:
+            if id_ is None:
+                sim.lifecycle.proc = sim.env.process(sim.lifecycle.run())
+                continue
+            hi = his[id_]
+            hi.procs[k] = sim.env.process(
+                hi.process(hi.proc_names()[k], wake))
+        # An FSW done with its visits may have new ones
+        for hi in his.values():
+            k = hi.proc_names().index('fsw')
+            if hi.procs[k] is None and hi.fsw.remaining():
+                hi.procs[k] = sim.env.process(hi.fsw.run(wake=sim.env.now))
+        return sim
+
+    def fork(self, overrides=None, spill=None):
+        """ A copy of the simulation continuing on its own, see restore() """
+        return Simulation.restore(self.snapshot(), overrides, spill)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Sinks receiving the DataFrame chunks of a DataPool.
+
+A DataPool collects the rows put by App and FSW in chunks and hands every
+full chunk to its sink. MemorySink keeps the chunks in memory until the DB
+is read. DiskSink spills every chunk to a file as the simulation runs, so
+memory stays bounded regardless of the simulated horizon, and the chunks
+are read back when the DB is read after the run. A directory of spilled
+chunks can be reopened as a DataPool by a later process.
+"""
+
+# %% Import essentials
+import glob
+import os
+import shutil
+import pandas as pd
+
+
+# %% Sinks
+class MemorySink:
+    """Class keeping the chunks of a DataPool in memory"""
+
+    def __init__(self):
+        """ Constructor of a MemorySink """
+        self.chunks = []
+
+    def write(self, df):
+        """ Store a chunk """
+        self.chunks.append(df)
+
+    def take(self):
+        """ Return the chunks written since the last take """
+        chunks = self.chunks
+        self.chunks = []
+        return chunks
+
+    def read(self):
+        """ The chunks not yet taken, without taking them """
+        return iter(self.chunks)
+
+    def empty(self):
+        """ Check if there are chunks to take """
+        return not self.chunks
+
+    def discard(self):
+        """ Drop the chunks not yet taken """
+        self.chunks = []
+
+
+class DiskSink:
+    """Class spilling the chunks of a DataPool to files in a directory"""
+
+    def __init__(self, path):
+        """
+        Constructor of a DiskSink
+
+        Chunk files already in 'path' (e.g. from a previous run) are kept
+        and read as part of the DB, use clear() to start from scratch.
+
+        Parameters
+        ----------
+        path : string
+            Directory of the chunk files, created if needed.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        # Index of the next chunk and of the first chunk not yet taken.
+        # Chunks may have been removed (e.g. when a partition is cleaned),
+        # so the next index follows the highest one, not the file count.
+        self.n_chunks = self.next_index()
+        self.n_taken = 0
+
+    def files(self):
+        """ Chunk files in the order they were written """
+        return sorted(glob.glob(os.path.join(self.path, 'chunk_*.pkl')))
+
+    @staticmethod
+    def index(fname):
+        """ Index of a chunk file """
+        return int(os.path.basename(fname)[len('chunk_'):-len('.pkl')])
+
+    def next_index(self):
+        """ Index following the highest chunk file in the directory """
+        files = self.files()
+        return self.index(files[-1]) + 1 if files else 0
+
+    def write(self, df):
+        """
+        Spill a chunk to disk
+
+        The chunk is written to a temporary file and renamed, so a chunk
+        file is never seen half written and never replaces another chunk,
+        also one written by another DiskSink in the same directory.
+        """
+        self.n_chunks = max(self.n_chunks, self.next_index())
+        fname = os.path.join(self.path,
+                             'chunk_{:08d}.pkl'.format(self.n_chunks))
+        df.to_pickle(fname + '.tmp')
+        os.replace(fname + '.tmp', fname)
+        self.n_chunks += 1
+
+    def take(self):
+        """ Read the chunks written since the last take """
+        chunks = [pd.read_pickle(f) for f in self.files()
+                  if self.n_taken <= self.index(f) < self.n_chunks]
+        self.n_taken = self.n_chunks
+        return chunks
+
+    def read(self):
+        """ Read the chunks not yet taken one at a time, without taking """
+        for f in self.files():
+            if self.n_taken <= self.index(f) < self.n_chunks:
+                yield pd.read_pickle(f)
+
+    def empty(self):
+        """ Check if there are chunks to take """
+        return self.n_taken == self.n_chunks
+
+    def discard(self):
+        """ Skip the chunks not yet taken, the files are kept """
+        self.n_taken = self.n_chunks
+
+    def copy(self, path):
+        """ DiskSink in 'path' with copies of the chunk files written """
+        sink = DiskSink(path)
+        sink.clear()
+        for f in self.files():
+            if self.index(f) < self.n_chunks:
+                shutil.copy(f, sink.path)
+        sink.n_chunks = self.n_chunks
+        sink.n_taken = self.n_taken
+        return sink
+
+    def clear(self):
+        """ Remove all chunk files """
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        self.n_chunks = 0
+        self.n_taken = 0
+
+    def size(self):
+        """ Bytes spilled to disk """
+        return sum(os.path.getsize(f) for f in self.files())
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps over HI configurations.
+
+A sweep file names the fleet (a configs/users or population file, see
+logsim.runner), the simulation length and seed, and either a grid or a
+random design over dotted HI config keys, see configs/sweep.json:
+
+    {"config": "configs/reference.json", "until": "62d", "seed": 1,
+     "grid": {"estimators.ovd.inc_m": ["30s", "60s", "90s"],
+              "app.interval": ["30m", "1h"]}}
+
+    {"config": "configs/reference.json", "until": "62d", "seed": 1,
+     "points": 20,
+     "random": {"min_period": {"uniform": ["3h", "6h"]},
+                "max_period": {"uniform": ["7h", "10h"]}}}
+
+The random design draws like a population, see logsim.population.draw.
+Every point simulates the fleet with its overrides in a worker process.
+The features of the daily App DB (DataPool.create_features) are averaged
+over the users into one row of the results table. Each point is stored
+in its own file in the output directory as soon as it is done. A sweep
+run again, e.g. after a crash, only simulates the points not stored.
+
+Usage:
+    python -m logsim.sweep configs/sweep.json --out sweep_out --workers 4
+"""
+
+# %% Import essentials
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import logsim.ttime as tt
+from logsim.population import Population, draw, override
+from logsim.runner import load_fleet, simulate
+
+
+# %% Design
+def design(spec):
+    """
+    Points of a sweep
+
+    Parameters
+    ----------
+    spec : dict, see the module doc
+
+    Returns
+    -------
+    list of dict of {dotted config key: value}
+
+    """
+    if 'grid' in spec:
+        keys = list(spec['grid'])
+        return [dict(zip(keys, values)) for values in
+                itertools.product(*[spec['grid'][k] for k in keys])]
+    points = []
+    for k in range(spec['points']):
+        rng = random.Random('{}:sweep:{}'.format(spec.get('seed'), k))
+        points.append({key: draw(dist, rng)
+                       for key, dist in spec['random'].items()})
+    return points
+
+
+def point_key(spec, point):
+    """
+    Hash identifying a point of a sweep, see the module doc
+
+    The contents of the fleet file are hashed, not its name, so points
+    are simulated again after the file is edited.
+    """
+    with open(spec['config'], 'rb') as f:
+        config = hashlib.sha256(f.read()).hexdigest()
+    run = {'config': config, 'until': spec['until'],
+           'seed': spec.get('seed'), 'point': point}
+    return hashlib.sha256(
+        json.dumps(run, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def override_users(users, overrides):
+    """
+    Users with the config overrides of a point
+
+    Parameters
+    ----------
+    users : dict of {id: HI config} or Population
+    overrides : dict of {dotted config key: value}
+
+    Returns
+    -------
+    dict of {id: HI config} or Population
+
+    """
+    if isinstance(users, Population):
+        spec = copy.deepcopy(users.spec)
+        spec['configs'] = {name: override(cfg, overrides)
+                           for name, cfg in spec['configs'].items()}
+        # The point wins over the parameter distributions
+        for a in spec['population']['archetypes'].values():
+            for key in overrides:
+                a.get('params', {}).pop(key, None)
+        return Population(spec, users.seed, ids=users.keys())
+    # HIs sharing a config keep sharing it
+    cfgs = {}
+    for cfg in users.values():
+        if id(cfg) not in cfgs:
+            cfgs[id(cfg)] = override(cfg, overrides)
+    return {i: cfgs[id(cfg)] for i, cfg in users.items()}
+
+
+# %% Points
+def run_point(users, point, until, seed):
+    """
+    Simulate a point and summarize its features
+
+    Returns
+    -------
+    dict of the point, the mean features over the users, the number of
+    users and the wall time
+
+    """
+    t0 = time.perf_counter()
+    cdp = simulate(override_users(users, point), until, seed)
+    dp = cdp.getAppDaily()
+    dp.create_features()
+    res = dict(point)
+    res.update(dp.dfeat.mean().to_dict())
+    res['users'] = len(dp.dfeat)
+    res['secs'] = time.perf_counter() - t0
+    return res
+
+
+def load_point(fname):
+    """Stored result of a point, None if not done"""
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def store_point(fname, res):
+    """Store the result of a point, a crash never leaves a partial file"""
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(res, f)
+    os.replace(fname + '.tmp', fname)
+
+
+def run_sweep(spec, out, workers=None):
+    """
+    Run the points of a sweep not done before
+
+    Parameters
+    ----------
+    spec : dict, see the module doc
+    out : string
+        Output directory, one file pr point and the results table
+        (results.csv).
+    workers : int, optional
+        Number of worker processes. The default is the number of cores.
+
+    Returns
+    -------
+    DataFrame with a row pr point done
+
+    """
+    workers = workers if workers else os.cpu_count()
+    os.makedirs(os.path.join(out, 'points'), exist_ok=True)
+    with open(os.path.join(out, 'sweep.json'), 'w') as f:
+        json.dump(spec, f, indent=1)
+    users = load_fleet(spec['config'], spec.get('seed'))
+    until = tt.hms2sec(spec['until'])
+    points = design(spec)
+    fnames = [os.path.join(out, 'points', point_key(spec, p) + '.json')
+              for p in points]
+    todo = [k for k, fname in enumerate(fnames) if load_point(fname) is None]
+    print('Sweep: {} points, {} done before'.format(
+        len(points), len(points) - len(todo)))
+
+    def done(k, result):
+        """Store a point, failed points are run again next time"""
+        try:
+            store_point(fnames[k], result())
+            print('Point {} done: {}'.format(k, points[k]))
+        except Exception as e:
+            print('Point {} failed: {}: {!r}'.format(k, points[k], e))
+    if workers == 1:
+        for k in todo:
+            done(k, lambda: run_point(users, points[k], until,
+                                      spec.get('seed')))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_point, users, points[k], until,
+                                   spec.get('seed')): k for k in todo}
+            for future in as_completed(futures):
+                done(futures[future], future.result)
+    results = {k: load_point(fname) for k, fname in enumerate(fnames)}
+    df = pd.DataFrame.from_dict({k: r for k, r in results.items() if r},
+                                orient='index')
+    df.index.name = 'point'
+    df.to_csv(os.path.join(out, 'results.csv'))
+    return df
+
+
+# %% Main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Sweep HI config parameters on all cores')
+    parser.add_argument('sweep', help='JSON file with the sweep')
+    parser.add_argument('--out', default='sweep_out',
+                        help='Output directory, points done are kept')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.sweep) as f:
+        spec = json.load(f)
+    with pd.option_context('display.width', 160, 'display.max_columns', 20):
+        print(run_sweep(spec, args.out, args.workers))
@@ -9,6 +9,11 @@ Created on Thu May 13 09:01:13 2021
 import math
 import time
 import random
+import numpy as np
+
+# Pending time of a restored process waiting for the session start, not for
+# a timeout (see logsim.simulation)
+ASLEEP = -1
 
 
 # %% Time related functions
@@ -23,12 +28,62 @@ def time2date(t=0):
     return time2str(t).split(' ')[0]
 
 
+def times2local(t):
+    """Convert an array of times(secs) to local datetime64[s]"""
+    t = np.asarray(t, dtype=np.int64)
+    # UTC offset pr hour, DST changes on whole hours
+    h, inv = np.unique(t // 3600, return_inverse=True)
+    off = np.array([time.localtime(3600 * x).tm_gmtoff for x in h.tolist()],
+                   dtype=np.int64)
+    return (t + off[inv]).astype('datetime64[s]')
+
+
+def times2str(t):
+    """Convert an array of times(secs) to string format"""
+    s = np.datetime_as_string(times2local(t), unit='s')
+    return np.char.replace(s, 'T', ' ').astype(object)
+
+
+def times2date(t):
+    """Convert an array of times(secs) to string format, date only"""
+    return np.datetime_as_string(times2local(t), unit='D').astype(object)
+
+
+def times2period(t, grain):
+    """Convert an array of times(secs) to the local start (secs) of their
+    'week' (from Monday), 'month' or 'year'"""
+    d = times2local(t).astype('datetime64[D]')
+    if grain == 'week':
+        # 1970-01-01 was a Thursday
+        d = d - (d.astype(np.int64) + 3) % 7
+    elif grain in ['month', 'year']:
+        d = d.astype('datetime64[{}]'.format(grain[0].upper())).astype(
+            'datetime64[D]')
+    else:
+        raise ValueError('Unknown calendar grain: ' + str(grain))
+    # Few distinct periods, convert those only
+    u, inv = np.unique(d, return_inverse=True)
+    return np.array([date2time(str(x)) for x in u], dtype=np.int64)[inv]
+
+
 def str2time(s=''):
     """Convert time from string to secs"""
     return int(time.mktime(
         time.strptime(s if len(s) else time2str(), '%Y-%m-%d %H:%M:%S')))
 
 
+def strs2time(s):
+    """Convert an array of time strings to secs"""
+    # Samples share few distinct times (App ticks), convert those only
+    u, inv = np.unique(np.asarray(s, dtype=str), return_inverse=True)
+    return np.array([str2time(x) for x in u], dtype=np.int64)[inv]
+
+
+def date2time(d):
+    """Convert a date string to secs at local midnight"""
+    return str2time(d + ' 00:00:00')
+
+
 def sec2hms(s):
     """Converts time in secs to H:M:S format"""
     H = math.floor(s/3600)
@@ -60,7 +115,7 @@ def hms2sec(hms):
 
 
 # %% Random functions
-def intRndPct(n, pct=20):
+def intRndPct(n, pct=20, rng=random):
     """
     Randomize an integer
 
@@ -69,6 +124,8 @@ def intRndPct(n, pct=20):
     n : int
     pct : int, optional
         Randomization factor in %. The default is 20.
+    rng : random.Random, optional
+        Random generator. The default is the random module.
 
     Returns
     -------
@@ -76,4 +133,4 @@ def intRndPct(n, pct=20):
         Randomized integer
 
     """
-    return int(n * (100.0 + random.uniform(-pct, pct)) / 100.0)
+    return int(n * (100.0 + rng.uniform(-pct, pct)) / 100.0)
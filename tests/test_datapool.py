@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the DataPool analytics, logsim.datapool
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import logsim.ttime as tt
+from logsim.datapool import DataPool, UserIndex, rollup_sums
+from logsim.runner import load_users, simulate
+
+REFERENCE = os.path.join(os.path.dirname(__file__), '..', 'configs',
+                         'reference.json')
+
+
+def test_rate_features_without_usage_are_nan():
+    dp = DataPool('app_daily')
+    dp.put_many(pd.DataFrame({'id': [0, 0, 1, 1], 'power_cycle': [0, 1] * 2,
+                              'usage': [0, 7200, 3600, 3600],
+                              'vcUp': [0, 4, 2, 2], 'vcDwn': [0, 2, 1, 1]}))
+    dp.create_features(['vcUp-rate', 'vcDwn-rate'])
+    assert dp.dfeat.loc[0, 'vcUp-rate'] == 2.0
+    assert np.isnan(dp.dfeat.loc[1, 'vcUp-rate'])
+    assert not np.isinf(dp.dfeat.to_numpy()).any()
+
+
+def simulated_pools(n_users=4, days=70):
+    """ Pools of a few reference users """
+    ref = load_users(REFERENCE)
+    return simulate({i: ref[i] for i in range(n_users)}, days * 24 * 3600,
+                    seed=1)
+
+
+def test_rollup_of_a_user():
+    cdp = simulated_pools()
+    dp = cdp.app_daily
+    r = dp.rollup('month')
+    for user_id in [0, 3]:
+        mine = dp.rollup('month', user_id)
+        expected = r.loc[r['id'] == user_id].reset_index(drop=True)
+        pd.testing.assert_frame_equal(mine, expected)
+    assert dp.rollup('month', 99).empty
+
+
+def test_rollup_sums_need_usage():
+    cdp = simulated_pools(1, 10)
+    with pytest.raises(ValueError, match='Usage'):
+        rollup_sums(cdp.fsw_daily.df.assign(time=0), 'month', ['usage'])
+
+
+def test_csv_round_trip_keeps_epoch_times(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dp = simulated_pools().app_daily
+    r = dp.rollup('month')
+    dp.saveAsCSV('01')
+    loaded = DataPool('app_daily')
+    loaded.loadAsCSV('01')
+    assert loaded.df['time'].dtype == np.int64
+    np.testing.assert_array_equal(loaded.df['time'], dp.df['time'])
+    pd.testing.assert_frame_equal(loaded.rollup('month'), r,
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather', 'csv'])
+def test_storage_round_trip_keeps_declared_types(tmp_path, monkeypatch, fmt):
+    monkeypatch.chdir(tmp_path)
+    cdp = simulated_pools(days=10)
+    cdp.save('01', fmt)
+    for dp in [cdp.app_daily, cdp.app_hourly]:
+        loaded = DataPool(dp.name)
+        loaded.load('01', fmt)
+        if fmt == 'csv':
+            # CSV keeps the values, integers are read as int64
+            assert loaded.df['time'].dtype == np.int64
+            pd.testing.assert_frame_equal(loaded.df, dp.df,
+                                          check_dtype=False)
+        else:
+            assert dict(loaded.df.dtypes) == dp.schema
+            pd.testing.assert_frame_equal(loaded.df, dp.df)
+
+
+def test_user_index_matches_boolean_masks():
+    df = simulated_pools(days=20).app_daily.df
+    # Shuffled, the index sorts by (id, power_cycle)
+    shuffled = df.sample(frac=1, random_state=1)
+    idx = UserIndex(shuffled)
+    ref = df.sort_values(by=['id', 'power_cycle'])
+    for user_id in [0, 2, 3, 99]:
+        mask = ref['id'] == user_id
+        pd.testing.assert_frame_equal(idx.user(user_id), ref.loc[mask])
+        mask &= (ref['power_cycle'] >= 3) & (ref['power_cycle'] < 9)
+        pd.testing.assert_frame_equal(idx.user(user_id, 3, 9), ref.loc[mask])
+    mask = ref['id'].isin([1, 3])
+    pd.testing.assert_frame_equal(idx.users([3, 1, 3]), ref.loc[mask])
+    dates = tt.times2date(ref['time'].to_numpy())
+    first, last = sorted(set(dates))[5], sorted(set(dates))[9]
+    mask = (dates >= first) & (dates <= last)
+    pd.testing.assert_frame_equal(idx.dates((first, last)), ref.loc[mask])
+    mask &= (ref['id'] == 2).to_numpy()
+    pd.testing.assert_frame_equal(idx.user(2, dates=(first, last)),
+                                  ref.loc[mask])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the analytic estimator mode, see logsim.hi.Estimator
+"""
+
+import copy
+import os
+import pandas as pd
+import pytest
+from logsim.runner import POOLS, load_users, simulate
+
+REFERENCE = os.path.join(os.path.dirname(__file__), '..', 'configs',
+                         'reference.json')
+DAYS = 62
+
+
+def reference_users(**overrides):
+    """ Reference users, with window lengths also increasing daily """
+    users = {}
+    for i, cfg in load_users(REFERENCE, **overrides).items():
+        cfg = copy.deepcopy(cfg)
+        for e in ['ovd', 'noise']:
+            cfg['estimators'][e]['inc_d'] = '10s'
+        users[i] = cfg
+    return users
+
+
+def pools(until=DAYS * 24 * 3600, **overrides):
+    """ Pools of the reference users in (id, power_cycle, time) order """
+    cdp = simulate(reference_users(**overrides), until, seed=1)
+    res = {}
+    for p in POOLS:
+        df = getattr(cdp, p).df
+        keys = [k for k in ['id', 'power_cycle', 'time'] if k in df.keys()]
+        res[p] = df.sort_values(by=keys).reset_index(drop=True)
+    return res
+
+
+@pytest.mark.parametrize('overrides', [
+    {},
+    # Lengths changing in windows of sessions spanning the daily tick
+    {'times_pr_day': 3, 'min_period': '2h', 'max_period': '6h'},
+    {'min_period': '14h', 'max_period': '20h'},
+], ids=['reference', 'times_pr_day', 'midnight'])
+def test_analytic_counters_match_process_mode(overrides):
+    ref = pools(**overrides)
+    ana = pools(estimator_mode='analytic', **overrides)
+    for p in POOLS:
+        pd.testing.assert_frame_equal(ref[p], ana[p])
+
+
+def test_analytic_counters_match_process_mode_on_a_short_run():
+    # Ends in the sessions of the third day, within estimator windows
+    until = 2 * 24 * 3600 + 17 * 3600 + 1234
+    ref = pools(until)
+    ana = pools(until, estimator_mode='analytic')
+    assert len(ref['app_hourly']) > 0
+    for p in POOLS:
+        pd.testing.assert_frame_equal(ref[p], ana[p])
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the vectorized fleet engine, logsim.fleet
+"""
+
+import os
+from logsim.fleet import simulate_fleet
+from logsim.runner import POOLS, load_users, simulate
+
+REFERENCE = os.path.join(os.path.dirname(__file__), '..', 'configs',
+                         'reference.json')
+USERS = 400
+DAYS = 100
+# Max deviation of the pool sizes from the SimPy engine, percent
+TOL_ROWS = 1.2
+# Max deviation of the mean session increments, in standard errors of the
+# means pr HI. The window lengths of estimators with 'inc_m' evolve
+# randomly pr HI, so their means deviate up to ~3% at 400 HIs
+TOL_SEM = 4.0
+
+
+def increments_pr_hi(df):
+    """ Mean per session increments of all counters, pr HI """
+    df = df.sort_values(by=['id', 'power_cycle']).reset_index(drop=True)
+    cols = [k for k in df.keys() if k not in ['id', 'power_cycle', 'time']]
+    inc = df.groupby('id')[cols].diff()
+    inc['id'] = df['id']
+    return inc.dropna().groupby('id').mean()
+
+
+def test_fleet_engine_matches_simpy_engine():
+    ref = load_users(REFERENCE, estimator_mode='analytic')
+    users = {i: ref[i % len(ref)] for i in range(USERS)}
+    until = DAYS * 24 * 3600
+    simpy_cdp = simulate(users, until, seed=1)
+    fleet_cdp = simulate_fleet(users, until, seed=1)
+    for p in POOLS:
+        a, b = getattr(simpy_cdp, p).df, getattr(fleet_cdp, p).df
+        assert 100.0 * abs(len(b) / len(a) - 1) < TOL_ROWS, p
+        if p in ['app_daily', 'fsw_daily']:
+            inc_a, inc_b = increments_pr_hi(a), increments_pr_hi(b)
+            sem = (inc_a.var() / len(inc_a)
+                   + inc_b.var() / len(inc_b)) ** 0.5
+            dev = ((inc_b.mean() - inc_a.mean()) / sem).abs()
+            assert dev.max() < TOL_SEM, (p, dev.idxmax(), dev.max())
+
+
+def test_fleet_emits_days_of_sessions_without_app_reads():
+    # Sessions shorter than the App interval, some without reads
+    ref = load_users(REFERENCE, estimator_mode='analytic',
+                     min_period='10m', max_period='90m')
+    users = {i: ref[i % len(ref)] for i in range(40)}
+    cdp = simulate_fleet(users, 20 * 24 * 3600, seed=1)
+    hourly, daily = cdp.app_hourly.df, cdp.app_daily.df
+    read = set(zip(hourly['id'], hourly['power_cycle']))
+    days = set(zip(daily['id'], daily['power_cycle']))
+    # Every session with reads stores yesterday
+    assert days == {(i, pc - 1) for i, pc in read if pc > 0}
+    assert days - read
+    # And so does the SimPy engine
+    cdp = simulate(users, 20 * 24 * 3600, seed=1)
+    hourly, daily = cdp.app_hourly.df, cdp.app_daily.df
+    assert set(zip(daily['id'], daily['power_cycle'])) - set(
+        zip(hourly['id'], hourly['power_cycle']))
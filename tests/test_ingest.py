@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the chunked ingestion of log dumps, logsim.ingest
+"""
+
+import os
+import pandas as pd
+from logsim.hi import pool_schemas
+from logsim.ingest import ingest
+from logsim.partition import PartitionedPool
+from logsim.runner import load_users, simulate
+
+REFERENCE = os.path.join(os.path.dirname(__file__), '..', 'configs',
+                         'reference.json')
+
+
+def dump(tmp_path, name, days):
+    """ CSV dump of a few counters of 6 users on 'days' """
+    df = pd.DataFrame([{'id': uid, 'power_cycle': day,
+                        'time': 86400 * day, 'usage': 3600 * day}
+                       for day in days for uid in range(6)])
+    fname = str(tmp_path / name)
+    df.to_csv(fname, index=False)
+    return fname
+
+
+def test_ingest_twice_adds_rows(tmp_path):
+    out = str(tmp_path / 'parts')
+    ingest([dump(tmp_path, 'a.csv', [0, 1])], out, partitions=2,
+           chunk_rows=4)
+    # Second dump overlaps the first by a day
+    res = ingest(dump(tmp_path, 'b.csv', [1, 2]), out, partitions=2,
+                 chunk_rows=4)
+    assert res['duplicates'] == 6
+    # 3 users of 4 days pr partition before cleaning
+    assert res['largest'] == 12
+    df = PartitionedPool(out).read()
+    assert len(df) == 18
+    assert sorted(df['power_cycle'].unique()) == [0, 1, 2]
+    # And once more, after the partitions were compacted
+    ingest(dump(tmp_path, 'c.csv', [3]), out, partitions=2, chunk_rows=4)
+    assert len(PartitionedPool(out).read()) == 24
+
+
+def test_ingest_saved_db_with_declared_types(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ref = load_users(REFERENCE)
+    users = {i: ref[i] for i in range(6)}
+    cdp = simulate(users, 40 * 24 * 3600, seed=1)
+    cdp.app_daily.saveAsCSV('01')
+    schema = pool_schemas(ref[0])['app_daily']
+    ingest('app_daily_01.csv', 'parts', partitions=2, chunk_rows=50,
+           schema=schema)
+    df = PartitionedPool('parts').read()
+    assert dict(df.dtypes) == schema
+    # Same rows as the DB saved
+    keys = ['id', 'power_cycle']
+    df = df.sort_values(by=keys).reset_index(drop=True)
+    ref_df = cdp.app_daily.df.sort_values(by=keys).reset_index(drop=True)
+    pd.testing.assert_frame_equal(df, ref_df[df.keys()], check_dtype=False)
+    # Without a schema the times are read back as epoch secs too
+    ingest('app_daily_01.csv', 'raw', partitions=2, chunk_rows=50)
+    assert PartitionedPool('raw').read()['time'].dtype == 'int64'
+
+
+def test_ingest_routes_users_to_partitions(tmp_path):
+    out = str(tmp_path / 'parts')
+    # Overlapping dumps, the second read in chunks across users
+    ingest([dump(tmp_path, 'a.csv', [0, 1, 2]),
+            dump(tmp_path, 'b.csv', [2, 1, 3])], out, partitions=4,
+           chunk_rows=5)
+    pp = PartitionedPool(out)
+    seen = []
+    for k in range(4):
+        df = pp.pool(k).df
+        ids = sorted(df['id'].unique())
+        assert ids == [i for i in range(6) if i % 4 == k]
+        # Cleaned: one chunk sorted by (id, power_cycle), no duplicates
+        assert len(pp.pool(k).sink.files()) == 1
+        keys = list(zip(df['id'], df['power_cycle']))
+        assert keys == sorted(set(keys))
+        seen.extend(keys)
+    assert sorted(seen) == [(i, d) for i in range(6) for d in range(4)]
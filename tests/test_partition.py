@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the DB's partitioned by user id, logsim.partition
+"""
+
+import pandas as pd
+from logsim.partition import PartitionedPool
+
+
+def rows(days):
+    """ A few counters of 4 users on 'days' """
+    return pd.DataFrame([{'id': uid, 'power_cycle': day,
+                          'time': 86400 * day, 'usage': 3600 * day}
+                         for day in days for uid in range(4)])
+
+
+def test_diff_is_dropped_when_rows_are_added(tmp_path):
+    path = str(tmp_path / 'app_daily')
+    pp = PartitionedPool(path, 2)
+    pp.write(rows([0, 1]))
+    pp.clean_data(workers=1)
+    pp.diff_data(workers=1)
+    n = len(pp.read(diffed=True))
+    assert n > 0
+    # Appending to the pool, in a later session
+    pp = PartitionedPool(path)
+    pp.write(rows([2]))
+    assert pp.read(diffed=True).empty
+    pp.clean_data(workers=1)
+    pp.diff_data(workers=1)
+    assert len(pp.read(diffed=True)) > n
+    assert len(pp.read()) == 12
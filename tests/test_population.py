@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of population specs, logsim.population
+"""
+
+import json
+import os
+from logsim.population import DAY, Population, is_duration
+from logsim.simulation import Simulation
+
+POPULATION = os.path.join(os.path.dirname(__file__), '..', 'configs',
+                          'population.json')
+
+
+def test_is_duration():
+    assert is_duration('30m')
+    assert is_duration('2d:4h')
+    assert is_duration('-1s')
+    assert not is_duration('')
+    assert not is_duration('m')
+    assert not is_duration('7')
+    assert not is_duration(30)
+
+
+def test_users_join_at_the_start_of_a_day():
+    with open(POPULATION) as f:
+        spec = json.load(f)
+    spec['population'].update(users=20, join={'uniform': ['0d', '10d']})
+    spec['population'].pop('churn')
+    pop = Population(spec, seed=1)
+    assert (pop.join % DAY == 0).all()
+    assert len(set(pop.join.tolist())) > 1
+    sim = Simulation(pop, seed=1).run(12 * DAY)
+    joins = dict(zip(pop.keys(), pop.join.tolist()))
+    assert len(sim.lifecycle.active) == 20
+    for i, hi in sim.lifecycle.active.items():
+        assert hi.started == joins[i]
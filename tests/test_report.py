@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the batch reports, logsim.report
+"""
+
+import os
+import pandas as pd
+import pytest
+from logsim.datapool import DataPool
+from logsim.report import render_report, report_kinds
+from logsim.runner import load_users, simulate
+
+REFERENCE = os.path.join(os.path.dirname(__file__), '..', 'configs',
+                         'reference.json')
+
+
+def sessions_pool():
+    """ App rows of two users without times, as the fsw pools """
+    cdp = simulate({i: u for i, u in load_users(REFERENCE).items()
+                    if i < 2}, 10 * 24 * 3600, seed=1)
+    dp = DataPool('sessions')
+    dp.put_many(cdp.app_daily.df.drop(columns=['time', 'usage-at-time']))
+    return dp
+
+
+def test_pools_without_times_have_no_monthly_pages(tmp_path):
+    dp = sessions_pool()
+    assert report_kinds(dp) == ['daily']
+    with pytest.raises(ValueError, match='No monthly pages of sessions'):
+        render_report(dp, str(tmp_path), kinds=['daily', 'monthly'],
+                      workers=1)
+    assert not os.listdir(tmp_path)
+    index = render_report(dp, str(tmp_path), workers=1)
+    assert sorted(os.listdir(tmp_path)) == ['index.html',
+                                            'user_0_daily.png',
+                                            'user_1_daily.png']
+    assert index == os.path.join(str(tmp_path), 'index.html')
+
+
+def test_pools_without_usage_have_no_pages():
+    dp = DataPool('fsw_daily')
+    dp.put_many(pd.DataFrame({'id': [0, 0], 'power_cycle': [0, 1],
+                              'boots': [1, 2]}))
+    with pytest.raises(ValueError, match='No report pages of fsw_daily'):
+        report_kinds(dp)
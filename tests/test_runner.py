@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the sharded fleet runner, logsim.runner
+"""
+
+from logsim.runner import POOLS, run_fleet, shard_ids
+
+
+def test_shard_ids():
+    assert shard_ids([5, 1, 3, 2, 4], 2) == [[1, 2, 3], [4, 5]]
+    assert shard_ids([1, 2], 4) == [[1], [2]]
+    assert shard_ids([], 4) == []
+
+
+def test_run_empty_fleet():
+    cdp = run_fleet({}, 24 * 3600, seed=1, workers=1)
+    assert all(getattr(cdp, p).isEmpty() for p in POOLS)
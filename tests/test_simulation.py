@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of Simulation snapshots, see logsim.simulation
+"""
+
+import os
+import pandas as pd
+import pytest
+import simpy
+from logsim.runner import POOLS, load_users
+from logsim.simulation import Simulation
+
+REFERENCE = os.path.join(os.path.dirname(__file__), '..', 'configs',
+                         'reference.json')
+DAY = 24 * 3600
+
+
+def test_restored_run_matches_uninterrupted_run():
+    users = load_users(REFERENCE)
+    ref = Simulation(users, seed=1).run(40 * DAY).result()
+    sim = Simulation(users, seed=1).run(17 * DAY + 3600)
+    res = Simulation.restore(sim.snapshot()).run(40 * DAY).result()
+    for p in POOLS:
+        pd.testing.assert_frame_equal(getattr(ref, p).df,
+                                      getattr(res, p).df)
+
+
+def test_snapshot_fails_without_simpy_internals(monkeypatch):
+    sim = Simulation(load_users(REFERENCE), seed=1).run(DAY)
+    monkeypatch.delattr(simpy.Process, '_resume')
+    with pytest.raises(RuntimeError, match='SimPy'):
+        sim.snapshot()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of simulations spilling their DB's to disk, see logsim.sink
+"""
+
+import os
+import pandas as pd
+import pytest
+from logsim.__main__ import main
+from logsim.datapool import CDP
+from logsim.runner import load_users, simulate
+
+REFERENCE = os.path.join(os.path.dirname(__file__), '..', 'configs',
+                         'reference.json')
+
+
+def test_run_refuses_spill_directory_of_another_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spill = str(tmp_path / 'spill')
+    run = ['run', REFERENCE, '--until', '3d', '--seed', '1', '--spill',
+           spill]
+    assert not main(run)
+    rows = len(CDP(spill=spill).app_hourly.df)
+    assert rows > 0
+    assert main(run) == 1
+    assert len(CDP(spill=spill).app_hourly.df) == rows
+
+
+def test_memory_report_does_not_read_spilled_pools(tmp_path):
+    spill = str(tmp_path / 'spill')
+    cdp = simulate(load_users(REFERENCE), 3 * 24 * 3600, 1, CDP(spill=spill))
+    report = cdp.memory_report()
+    app = report.loc[['app_daily', 'app_hourly']]
+    assert (app['bytes on disk'] > 0).all()
+    assert report['rows'].isna().all()
+    assert all(dp._df.empty for dp in cdp.pools())
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather', 'csv'])
+def test_save_streams_spilled_pools(tmp_path, monkeypatch, fmt):
+    monkeypatch.chdir(tmp_path)
+    users = load_users(REFERENCE)
+    spilled = simulate(users, 3 * 24 * 3600, 1, CDP(spill='spill'))
+    spilled.save('01', fmt)
+    # The chunks were written without joining them
+    assert all(dp._df.empty for dp in spilled.pools())
+    simulate(users, 3 * 24 * 3600, 1).save('02', fmt)
+    cdp, expected = CDP(), CDP()
+    cdp.load('01', fmt)
+    expected.load('02', fmt)
+    assert len(cdp.app_hourly.df) > 0
+    for dp, other in zip(cdp.pools(), expected.pools()):
+        pd.testing.assert_frame_equal(dp.df, other.df)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of parameter sweeps, logsim.sweep
+"""
+
+import json
+import os
+from logsim.sweep import point_key
+
+REFERENCE = os.path.join(os.path.dirname(__file__), '..', 'configs',
+                         'reference.json')
+
+
+def test_point_key_follows_the_config_contents(tmp_path):
+    fname = str(tmp_path / 'fleet.json')
+    with open(REFERENCE) as f:
+        fleet = json.load(f)
+    with open(fname, 'w') as f:
+        json.dump(fleet, f)
+    spec = {'config': fname, 'until': '62d', 'seed': 1}
+    point = {'app.interval': '30m'}
+    key = point_key(spec, point)
+    assert point_key(dict(spec), dict(point)) == key
+    fleet['configs']['HI_cfg0']['times_pr_day'] = 2
+    with open(fname, 'w') as f:
+        json.dump(fleet, f)
+    assert point_key(spec, point) != key